@@ -0,0 +1,35 @@
+# apps/core/management/commands/rebuild_counters.py
+"""
+件数の集計値（ダッシュボード・一覧の統計）の検証・再集計コマンド
+"""
+from django.core.management.base import BaseCommand
+from apps.core.models import Counter
+
+
+class Command(BaseCommand):
+    help = '商品・棚・段・配置の件数の集計値を各テーブルから再集計し、ずれを補正します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='ずれの検出のみ行い、補正しない'
+        )
+
+    def handle(self, *args, **options):
+        stored = dict(Counter.objects.values_list('name', 'value'))
+        actual = Counter.rebuild() if not options['check'] else Counter.compute()
+
+        drifted = 0
+        for name in Counter.NAMES:
+            before = stored.get(name)
+            if before == actual[name]:
+                self.stdout.write(f'{name}: {actual[name]}')
+                continue
+            drifted += 1
+            self.stdout.write(f'{name}: {actual[name]}（集計値: {"未作成" if before is None else before}）')
+
+        if options['check']:
+            self.stdout.write(f'ずれのある集計値: {drifted}件')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{drifted}件の集計値を補正しました'))
@@ -5,6 +5,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from apps.core.models import Counter
 from apps.products.models import Category, Manufacturer, Product
 from apps.shelves.models import Shelf, ShelfSegment, ProductPlacement
 
@@ -50,6 +51,9 @@ class Command(BaseCommand):
             # サンプル配置作成
             self.create_sample_placements(shelves, products, admin_user)
 
+            # 件数の集計値を再集計（削除したデータは集計値に反映されないため）
+            Counter.rebuild()
+
         self.stdout.write(
             self.style.SUCCESS('デモデータの作成が完了しました！')
         )
@@ -1,7 +1,8 @@
 """
 共通抽象モデル
 """
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
 from django.contrib.auth import get_user_model
 
 
@@ -41,9 +42,36 @@ class BaseModel(TimestampMixin, UserTrackableMixin):
     """基底モデル"""
     is_active = models.BooleanField('有効', default=True)
 
+    # 有効な行の件数を保持する集計値（Counter）の名前。None の場合は集計しない
+    counter_name = None
+
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 作成・論理削除・復元を判定するため、読み込み時の有効フラグを記録
+        instance._loaded_is_active = instance.__dict__.get('is_active')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """作成・論理削除・復元の際に集計値（counter_name）を増減"""
+        delta = 0
+        if self.counter_name is not None:
+            update_fields = kwargs.get('update_fields')
+            before = False if self._state.adding else getattr(self, '_loaded_is_active', None)
+            if before is not None and (update_fields is None or 'is_active' in update_fields):
+                delta = int(self.is_active) - int(before)
+
+        if delta:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                Counter.add(**{self.counter_name: delta})
+        else:
+            super().save(*args, **kwargs)
+        self._loaded_is_active = self.is_active
+
     def delete(self, *args, **kwargs):
         """ソフトデリート"""
         self.is_active = False
@@ -51,4 +79,91 @@ class BaseModel(TimestampMixin, UserTrackableMixin):
 
     def hard_delete(self, *args, **kwargs):
         """物理削除"""
-        super().delete(*args, **kwargs)
\ No newline at end of file
+        if self.counter_name is not None and getattr(self, '_loaded_is_active', None):
+            with transaction.atomic():
+                super().delete(*args, **kwargs)
+                Counter.add(**{self.counter_name: -1})
+        else:
+            super().delete(*args, **kwargs)
+
+
+class Counter(models.Model):
+    """件数の集計値（ダッシュボード・一覧の統計表示用）
+
+    画面表示のたびに COUNT(*) を実行しないよう、作成・論理削除・復元の際に増減して保持する。
+    save() を経由しない一括処理は呼び出し側で add() を実行する。
+    ずれた場合は rebuild_counters コマンドで再集計する。
+    """
+    PRODUCTS = 'products'
+    OWN_PRODUCTS = 'own_products'
+    SHELVES = 'shelves'
+    SEGMENTS = 'segments'
+    PLACEMENTS = 'placements'
+    NAMES = (PRODUCTS, OWN_PRODUCTS, SHELVES, SEGMENTS, PLACEMENTS)
+
+    name = models.CharField('名前', max_length=50, primary_key=True)
+    value = models.BigIntegerField('値', default=0)
+
+    class Meta:
+        verbose_name = '集計値'
+        verbose_name_plural = '集計値'
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    @classmethod
+    def add(cls, **deltas):
+        """集計値を増減（1クエリ）
+
+        例: Counter.add(products=1, own_products=1)
+        未作成の集計値は更新しない（values() の初回呼び出し時に再集計される）。
+        """
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        cls.objects.filter(name__in=deltas).update(value=F('value') + Case(
+            *[When(name=name, then=Value(delta)) for name, delta in deltas.items()],
+            default=Value(0),
+            output_field=models.BigIntegerField()
+        ))
+
+    @classmethod
+    def add_expression(cls, name, expression):
+        """集計値に式（サブクエリ等）の値を加算"""
+        cls.objects.filter(name=name).update(value=F('value') + expression)
+
+    @classmethod
+    def values(cls):
+        """全集計値 {名前: 値}（1クエリ。未作成の集計値があれば再集計する）"""
+        values = dict(cls.objects.values_list('name', 'value'))
+        if any(name not in values for name in cls.NAMES):
+            values = cls.rebuild()
+        return values
+
+    @classmethod
+    def compute(cls):
+        """各テーブルから集計値を計算"""
+        from apps.products.models import Product
+        from apps.shelves.models import Shelf, ShelfSegment, ProductPlacement
+
+        products = Product.objects.filter(is_active=True).order_by()
+        return {
+            cls.PRODUCTS: products.count(),
+            cls.OWN_PRODUCTS: products.filter(manufacturer__is_own_company=True).count(),
+            cls.SHELVES: Shelf.objects.filter(is_active=True).count(),
+            cls.SEGMENTS: ShelfSegment.objects.filter(is_active=True).count(),
+            cls.PLACEMENTS: ProductPlacement.objects.filter(is_active=True).count(),
+        }
+
+    @classmethod
+    def rebuild(cls):
+        """全集計値を再集計して保存し、{名前: 値} を返す
+
+        集計値の行をロックしてから数えるため、並行する増減は再集計の前後どちらかに反映される。
+        """
+        with transaction.atomic():
+            list(cls.objects.select_for_update().values_list('name', flat=True))
+            values = cls.compute()
+            for name, value in values.items():
+                cls.objects.update_or_create(name=name, defaults={'value': value})
+        return values
\ No newline at end of file
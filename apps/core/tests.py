@@ -1,3 +1,142 @@
+# apps/core/tests.py
+"""
+共通機能のテスト
+"""
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 
-# Create your tests here.
+from apps.products.models import Category, Manufacturer, Product
+from apps.products.services import ProductService
+from apps.shelves.models import Shelf, ShelfSegment, ProductPlacement, ShelfLayoutSnapshot
+from apps.shelves.services import ShelfCloneService, ShelfService, ShelfSnapshotService
+from .models import Counter
+
+User = get_user_model()
+
+
+class CounterTest(TestCase):
+    """件数の集計値のテスト"""
+
+    def setUp(self):
+        Counter.rebuild()
+        self.user = User.objects.create_user(username='counteruser', password='testpass123')
+        self.category = Category.objects.create(name='飲料', code='C01')
+        self.own_maker = Manufacturer.objects.create(name='自社', code='M01', is_own_company=True)
+        self.other_maker = Manufacturer.objects.create(name='競合', code='M02')
+        self.shelf = ShelfService.create_shelf_with_segments(
+            {'name': 'テスト棚', 'width': 90, 'depth': 45}, [{'height': 30}, {'height': 25}], self.user
+        )
+        self.tea = self.create_product('お茶', '4900000000001', self.own_maker)
+        self.water = self.create_product('水', '4900000000002', self.other_maker)
+
+    def create_product(self, name, jan_code, manufacturer):
+        return Product.objects.create(
+            name=name, jan_code=jan_code, manufacturer=manufacturer, category=self.category,
+            width=10, height=20, depth=10
+        )
+
+    def place(self, product, x_position, level=1):
+        return ProductPlacement.objects.create(
+            shelf=self.shelf,
+            segment=self.shelf.segments.get(level=level),
+            product=product,
+            x_position=x_position
+        )
+
+    def assertCountersMatch(self):
+        self.assertEqual(Counter.values(), Counter.compute())
+
+    def test_create_delete_restore(self):
+        self.assertEqual(Counter.values(), {
+            'products': 2, 'own_products': 1, 'shelves': 1, 'segments': 2, 'placements': 0,
+        })
+
+        placement = self.place(self.tea, 0)
+        self.place(self.water, 20, level=2)
+        self.assertEqual(Counter.values()['placements'], 2)
+
+        placement.delete()
+        self.tea.delete()
+        self.assertEqual(Counter.values()['products'], 1)
+        self.assertEqual(Counter.values()['own_products'], 0)
+        self.assertEqual(Counter.values()['placements'], 1)
+
+        # 論理削除済みの商品は再度の保存で二重に減らさない
+        self.tea.save()
+        self.tea.is_active = True
+        self.tea.save()
+        placement.is_active = True
+        placement.save()
+        self.assertCountersMatch()
+
+        # メーカーの変更・メーカーの自社/競合の変更
+        self.water.manufacturer = self.own_maker
+        self.water.save()
+        self.assertEqual(Counter.values()['own_products'], 2)
+        self.own_maker.is_own_company = False
+        self.own_maker.save()
+        self.assertEqual(Counter.values()['own_products'], 0)
+
+        segment = self.shelf.segments.get(level=2)
+        segment.delete()
+        self.assertCountersMatch()
+
+    def test_bulk_operations(self):
+        self.place(self.tea, 0)
+        self.place(self.water, 20, level=2)
+        snapshot = ShelfLayoutSnapshot.capture(self.shelf, self.user, '初期')
+
+        target = Shelf.objects.create(name='複製先', width=90, depth=45)
+        ShelfSegment.objects.create(shelf=target, level=3, height=40)
+        ShelfCloneService.clone(self.shelf, self.user, targets=[target], new_names=['店舗1', '店舗2'])
+        self.assertCountersMatch()
+        self.assertEqual(Counter.values()['placements'], 8)
+
+        ProductPlacement.objects.get(shelf=self.shelf, product=self.water).delete()
+        self.shelf.segments.get(level=2).delete()
+        ShelfSnapshotService.restore(snapshot, self.user)
+        self.assertCountersMatch()
+
+        feed = (
+            'JANコード,商品名,メーカーコード,カテゴリコード,幅(cm),高さ(cm),奥行(cm),最小フェース,最大フェース,推奨フェース\n'
+            '4900000000002,水,M01,C01,10,20,10,,,\n'
+            '4900000000003,新商品,M01,C01,10,20,10,,,\n'
+        )
+        self.create_product('廃番', '4900000000009', self.own_maker)
+        ProductService.bulk_import_products(feed, self.user, deactivate_missing=True)
+        self.assertCountersMatch()
+        self.assertEqual(Counter.values()['own_products'], 3)
+
+    def test_shelf_delete_view(self):
+        self.client.force_login(self.user)
+        self.client.post(f'/shelves/{self.shelf.pk}/delete/')
+        self.assertEqual(Counter.values()['shelves'], 0)
+        self.assertEqual(Counter.values()['segments'], 0)
+        self.assertCountersMatch()
+
+    def test_dashboard_reads_counters(self):
+        self.place(self.tea, 0)
+        with self.assertNumQueries(1):
+            values = Counter.values()
+
+        self.client.force_login(self.user)
+        response = self.client.get('/dashboard/')
+        self.assertEqual(response.context['total_products'], values['products'])
+        self.assertEqual(response.context['total_placements'], 1)
+        response = self.client.get('/products/')
+        self.assertEqual(response.context['stats']['competitor_products'], 1)
+
+    def test_rebuild_command(self):
+        Counter.objects.filter(name='products').update(value=100)
+        Counter.objects.filter(name='segments').delete()
+
+        output = StringIO()
+        call_command('rebuild_counters', '--check', stdout=output)
+        self.assertIn('ずれのある集計値: 2件', output.getvalue())
+        self.assertEqual(Counter.objects.get(name='products').value, 100)
+
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(dict(Counter.objects.values_list('name', 'value')), Counter.compute())
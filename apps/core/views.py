@@ -5,25 +5,23 @@
 from django.shortcuts import render
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
+from .models import Counter
 
 
 @login_required
 def dashboard_api(request):
-    """ダッシュボード用API"""
-    from apps.products.models import Product
-    from apps.shelves.models import Shelf, ProductPlacement
+    """ダッシュボード用API（件数は集計値から1クエリで取得）"""
+    counters = Counter.values()
     
     data = {
         'stats': {
-            'total_products': Product.objects.filter(is_active=True).count(),
-            'total_shelves': Shelf.objects.filter(is_active=True).count(),
-            'total_placements': ProductPlacement.objects.filter(is_active=True).count(),
-            'own_products': Product.objects.filter(
-                is_active=True, 
-                manufacturer__is_own_company=True
-            ).count(),
+            'total_products': counters[Counter.PRODUCTS],
+            'total_shelves': counters[Counter.SHELVES],
+            'total_segments': counters[Counter.SEGMENTS],
+            'total_placements': counters[Counter.PLACEMENTS],
+            'own_products': counters[Counter.OWN_PRODUCTS],
+            'competitor_products': counters[Counter.PRODUCTS] - counters[Counter.OWN_PRODUCTS],
         }
     }
     
     return JsonResponse(data)
-
@@ -1,8 +1,23 @@
 # apps/products/apps.py
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def install_search_backend(sender, using='default', **kwargs):
+    """migrate 後に、DBの検索バックエンドの索引・テーブルを作成"""
+    if using == 'default' and getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'memory') == 'database':
+        from .search import get_search_backend
+        get_search_backend().install()
 
 
 class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.products'
     verbose_name = '商品管理'
+
+    def ready(self):
+        from .search import register_sqlite_functions
+        connection_created.connect(register_sqlite_functions)
+        post_migrate.connect(install_search_backend, sender=self)
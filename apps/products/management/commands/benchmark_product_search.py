@@ -0,0 +1,106 @@
+# apps/products/management/commands/benchmark_product_search.py
+"""
+商品検索バックエンドの性能比較コマンド
+"""
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.products.models import Product
+from apps.products.search import get_search_backend, product_index
+
+
+class Command(BaseCommand):
+    help = '商品検索（Ajax検索API・一覧画面の絞り込み）の応答時間を検索バックエンドごとに比較します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', help='検索語（省略時は登録済みの商品から作成）')
+        parser.add_argument(
+            '--backends',
+            default='orm,memory,database',
+            help='比較する検索バックエンド（カンマ区切り）'
+        )
+        parser.add_argument('--samples', type=int, default=20, help='検索語を自動作成する件数')
+        parser.add_argument('--repeat', type=int, default=10, help='1つの検索語を繰り返す回数')
+        parser.add_argument('--limit', type=int, default=20, help='検索APIの取得件数')
+        parser.add_argument('--seed', type=int, default=0, help='検索語を作成する乱数の種')
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or self.sample_queries(options['samples'], options['seed'])
+        if not queries:
+            raise CommandError('検索語を作成できる商品がありません')
+
+        backends = []
+        for name in options['backends'].split(','):
+            try:
+                backend = get_search_backend(name.strip())
+            except ValueError as e:
+                raise CommandError(str(e))
+            if not backend.installed():
+                self.stderr.write(f'{name}: 索引が未作成のため除外します（setup_product_search を実行してください）')
+                continue
+            if backend.name == 'memory':
+                started = time.perf_counter()
+                product_index.build()
+                self.stdout.write(f'memory: 検索インデックスの構築 {time.perf_counter() - started:.1f}秒')
+            backends.append(backend)
+
+        summary = {}
+        self.stdout.write(f"{'検索語':<20} {'方式':<10} {'API(ms)':>9} {'一覧(ms)':>9} {'件数':>8}")
+        for query in queries:
+            for backend in backends:
+                api = self.measure(lambda: backend.search(query, options['limit']), options['repeat'])
+                count = 0
+
+                def list_page():
+                    nonlocal count
+                    queryset = backend.filter(Product.objects.filter(is_active=True), query)
+                    count = queryset.count()
+                    list(queryset.select_related('manufacturer', 'category')[:20])
+
+                page = self.measure(list_page, options['repeat'])
+                summary.setdefault(backend.name, []).append((api, page))
+                self.stdout.write(f'{query:<20} {backend.name:<10} {api:>9.2f} {page:>9.2f} {count:>8}')
+
+        self.stdout.write('')
+        self.stdout.write(f"{'方式':<10} {'API中央値':>10} {'API最大':>10} {'一覧中央値':>10} {'一覧最大':>10}")
+        for name, timings in summary.items():
+            api, page = zip(*timings)
+            self.stdout.write(
+                f'{name:<10} {statistics.median(api):>10.2f} {max(api):>10.2f} '
+                f'{statistics.median(page):>10.2f} {max(page):>10.2f}'
+            )
+
+    @staticmethod
+    def measure(func, repeat):
+        """1回目（キャッシュの準備）を除いた実行時間の中央値(ms)"""
+        func()
+        timings = []
+        for _ in range(max(repeat, 1)):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    @staticmethod
+    def sample_queries(samples, seed):
+        """商品名の一部・JANコードの先頭・メーカー名の先頭から検索語を作成"""
+        products = Product.objects.filter(is_active=True).order_by('pk')
+        total = products.count()
+        generator = random.Random(seed)
+        queries = []
+        for index in range(min(samples, total)):
+            offset = generator.randrange(total)
+            name, jan_code, manufacturer = products.values_list('name', 'jan_code', 'manufacturer__name')[offset]
+            name = ''.join(name.split())
+            kind = index % 4
+            if kind == 1 and jan_code:
+                queries.append(jan_code[:7])
+            elif kind == 2:
+                queries.append(manufacturer[:3])
+            elif len(name) >= 2:
+                length = min(generator.randint(2, 4), len(name))
+                start = generator.randint(0, len(name) - length)
+                queries.append(name[start:start + length])
+        return queries
@@ -0,0 +1,81 @@
+# apps/products/management/commands/import_products.py
+"""
+商品の一括インポートコマンド
+"""
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from apps.products.services import ProductService
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'CSV/TSVファイルから商品をJANコード単位で一括登録・更新します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='取り込むCSV/TSVファイル（UTF-8）')
+        parser.add_argument(
+            '--delimiter',
+            choices=['comma', 'tab'],
+            help='区切り文字（省略時は見出し行から判定）'
+        )
+        parser.add_argument(
+            '--mode',
+            choices=['full', 'delta'],
+            default='full',
+            help='取込方法（delta: 前回の取込内容から変わった行のみ照合する差分同期）'
+        )
+        parser.add_argument(
+            '--deactivate-missing',
+            action='store_true',
+            help='ファイルにないJANコードの商品を論理削除する（棚に配置中の商品は残す）'
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000, help='一括登録・更新の件数')
+        parser.add_argument('--user', help='登録者として記録するユーザー名')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"ユーザーが見つかりません: {options['user']}")
+
+        delimiter = {'comma': ',', 'tab': '\t'}.get(options['delimiter'])
+        try:
+            with open(options['path'], 'rb') as file:
+                result = ProductService.bulk_import_products(
+                    file,
+                    user,
+                    delimiter=delimiter,
+                    chunk_size=options['chunk_size'],
+                    mode=options['mode'],
+                    deactivate_missing=options['deactivate_missing'],
+                )
+        except OSError as e:
+            raise CommandError(f'ファイルを開けません: {e}')
+        except ValidationError as e:
+            raise CommandError(' / '.join(e.messages))
+        except UnicodeDecodeError:
+            raise CommandError('ファイルはUTF-8で保存してください')
+
+        for error in result['row_errors']:
+            self.stdout.write(self.style.ERROR(
+                f"{error['line']}行目 ({error['jan_code'] or 'JANなし'}): {' / '.join(error['errors'])}"
+            ))
+        if result['error_count'] > len(result['row_errors']):
+            self.stdout.write(self.style.ERROR(f"ほか{result['error_count'] - len(result['row_errors'])}件のエラー"))
+
+        if options['verbosity'] >= 2:
+            labels = {'created': '新規', 'updated': '更新', 'deactivated': '削除', 'retained': '配置中のため維持'}
+            for change in result['changes']:
+                fields = f" ({', '.join(change['fields'])})" if change['fields'] else ''
+                self.stdout.write(f"{labels[change['action']]}: {change['jan_code']}{fields}")
+
+        message = (
+            f"{result['total']}行を処理しました（新規: {result['created']}件, 更新: {result['updated']}件, "
+            f"変更なし: {result['unchanged']}件, エラー: {result['error_count']}件）"
+        )
+        if options['deactivate_missing']:
+            message += f"\n未掲載の商品: 削除 {result['deactivated']}件, 配置中のため維持 {result['retained']}件"
+        self.stdout.write(self.style.SUCCESS(message))
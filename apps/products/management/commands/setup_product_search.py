@@ -0,0 +1,33 @@
+# apps/products/management/commands/setup_product_search.py
+"""
+商品検索バックエンドの索引・テーブルの作成コマンド
+"""
+from django.core.management.base import BaseCommand, CommandError
+from apps.products.search import SEARCH_BACKENDS, get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'DBの商品検索バックエンド（PostgreSQL: pg_trgm索引、SQLite: FTS5テーブル）を作成・再構築します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend',
+            choices=sorted({key[0] if isinstance(key, tuple) else key for key in SEARCH_BACKENDS}),
+            help='対象の検索バックエンド（省略時は PRODUCT_SEARCH_BACKEND）'
+        )
+        parser.add_argument('--rebuild', action='store_true', help='作成済みでも内容を作り直す')
+        parser.add_argument('--drop', action='store_true', help='作成した索引・テーブルを削除する')
+
+    def handle(self, *args, **options):
+        try:
+            backend = get_search_backend(options['backend'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['drop']:
+            backend.uninstall()
+            self.stdout.write(self.style.SUCCESS(f'検索用の索引を削除しました（{type(backend).__name__}）'))
+            return
+
+        backend.install(rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f'検索用の索引を作成しました（{type(backend).__name__}）'))
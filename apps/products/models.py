@@ -1,10 +1,11 @@
 """
 商品管理モデル
 """
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
-from apps.core.models import BaseModel
+from apps.core.models import BaseModel, Counter
 from apps.core.validators import validate_dimension, validate_face_count
+from .search import product_index
 
 
 class Category(BaseModel):
@@ -44,6 +45,37 @@ class Manufacturer(BaseModel):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 自社/競合の変更を検知するため、読み込み時の値を記録
+        instance._loaded_own_company = instance.__dict__.get('is_own_company')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """既存メーカーの保存時は、その商品の配置先の棚のレイアウト版数を加算
+
+        自社/競合が変わった場合は自社商品数の集計値を増減する。
+        コミット後に商品検索インデックスへメーカー名を反映する。
+        """
+        adding = self._state.adding
+        own_changed = (
+            not adding
+            and getattr(self, '_loaded_own_company', None) is not None
+            and self._loaded_own_company != self.is_own_company
+        )
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not adding:
+                from apps.shelves.models import Shelf
+                Shelf.bump_layout_revisions(product__manufacturer=self)
+            if own_changed:
+                count = self.products.filter(is_active=True).count()
+                Counter.add(**{Counter.OWN_PRODUCTS: count if self.is_own_company else -count})
+            transaction.on_commit(lambda: product_index.update_manufacturer(self))
+        
+        self._loaded_own_company = self.is_own_company
+
 
 class Product(BaseModel):
     """商品"""
@@ -124,6 +156,8 @@ class Product(BaseModel):
         blank=True
     )
     description = models.TextField('商品説明', blank=True)
+    # 一括インポート時の取込内容のハッシュ（差分同期で変更のない行を判定する）
+    content_hash = models.CharField('取込内容ハッシュ', max_length=32, blank=True, editable=False)
 
     class Meta:
         verbose_name = '商品'
@@ -137,6 +171,75 @@ class Product(BaseModel):
     def __str__(self):
         return f"{self.name} ({self.manufacturer.name})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 幅の変更を検知するため、読み込み時の幅を記録
+        instance._loaded_width = instance.__dict__.get('width')
+        instance._loaded_manufacturer_id = instance.__dict__.get('manufacturer_id')
+        return instance
+
+    @staticmethod
+    def count_changes(changes):
+        """商品の (有効かどうか, メーカーID) の変更を件数の集計値に反映
+
+        changes: [(変更前, 変更後)]。新規作成の変更前は None とする。
+        """
+        changes = [(before, after) for before, after in changes if before != after]
+        if not changes:
+            return
+        manufacturer_ids = {state[1] for change in changes for state in change if state and state[0]}
+        own = set(
+            Manufacturer.objects.filter(pk__in=manufacturer_ids, is_own_company=True).order_by()
+            .values_list('pk', flat=True)
+        ) if manufacturer_ids else set()
+
+        deltas = {Counter.PRODUCTS: 0, Counter.OWN_PRODUCTS: 0}
+        for before, after in changes:
+            for state, sign in ((before, -1), (after, 1)):
+                if state and state[0]:
+                    deltas[Counter.PRODUCTS] += sign
+                    if state[1] in own:
+                        deltas[Counter.OWN_PRODUCTS] += sign
+        Counter.add(**deltas)
+
+    def save(self, *args, **kwargs):
+        """保存時に幅が変わっていれば配置の占有幅を更新
+
+        既存商品の保存時は、配置先の棚のレイアウト版数を加算する（表示内容が変わるため）。
+        画面等で編集した商品は次回の差分同期で取込内容と照合し直すよう、取込内容ハッシュを消去する。
+        作成・論理削除・復元・メーカーの変更時は商品数・自社商品数の集計値を増減する。
+        コミット後に商品検索インデックスへ反映する。
+        """
+        adding = self._state.adding
+        before = None if adding else (
+            getattr(self, '_loaded_is_active', None),
+            getattr(self, '_loaded_manufacturer_id', None),
+        )
+        self.content_hash = ''
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'content_hash'}
+        width_changed = (
+            not adding
+            and getattr(self, '_loaded_width', None) is not None
+            and self._loaded_width != self.width
+        )
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if width_changed:
+                from apps.shelves.models import ProductPlacement
+                ProductPlacement.sync_product_width(self)
+            elif not adding:
+                from apps.shelves.models import Shelf
+                Shelf.bump_layout_revisions(product=self)
+            if before is None or None not in before:
+                Product.count_changes([(before, (self.is_active, self.manufacturer_id))])
+            transaction.on_commit(lambda: product_index.update(self))
+        
+        self._loaded_width = self.width
+        self._loaded_manufacturer_id = self.manufacturer_id
+
     @property
     def is_own_product(self):
         """自社商品かどうか"""
@@ -0,0 +1,656 @@
+# apps/products/search.py
+"""
+商品検索
+
+PRODUCT_SEARCH_BACKEND で検索方式を選ぶ（get_search_backend() が返すバックエンドを使う）。
+
+- 'orm': icontains による検索
+- 'memory': プロセス内の検索インデックス（product_index）。構築中・一覧画面はORM検索
+- 'database': DBの索引。PostgreSQL は pg_trgm のGIN索引、SQLite は FTS5 の検索用テーブル
+  （setup_product_search コマンドまたは migrate 後に作成）
+
+■ プロセス内の検索インデックス
+
+商品名・メーカー名を正規化した文字 bi-gram の転置インデックスと、JANコードの前方一致で検索する。
+正規化では全角/半角（NFKC）、大文字/小文字、カタカナ/ひらがなの違いと空白を無視する。
+
+- 初回の検索時にバックグラウンドで構築し、構築が終わるまでは None を返す（呼び出し側はORM検索を使う）
+- 同一プロセス内での商品・メーカーの保存はコミット後に即時反映する
+- 他プロセスでの変更や一括更新は、キャッシュ上の版数の変化（または一定時間の経過）を検知したときに
+  updated_at が新しい商品を読み直して反映する
+"""
+import logging
+import threading
+import time
+import unicodedata
+import uuid
+from array import array
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZE = 2
+
+# カタカナ（ァ〜ヶ）をひらがなに寄せる変換表
+_KANA_TABLE = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+_EMPTY = np.empty(0, dtype=np.int32)
+
+
+def normalize(text):
+    """検索用の正規化（NFKC・小文字化・カタカナ→ひらがな・空白除去）"""
+    text = unicodedata.normalize('NFKC', text or '').lower().translate(_KANA_TABLE)
+    return ''.join(text.split())
+
+
+def ngrams(text):
+    """正規化済み文字列の bi-gram（重複なし）"""
+    return set(_ngram_list(text))
+
+
+def _ngram_list(text):
+    return [text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)]
+
+
+class _IndexData:
+    """インデックス本体（文書番号は追加順の連番。更新時は旧文書を無効にして末尾に追加する）"""
+
+    def __init__(self):
+        self.product_ids = array('q')
+        self.manufacturer_ids = array('q')
+        self.name_lengths = array('i')
+        self.alive = bytearray()
+        self.names = []
+        self.jan_codes = []
+        self.doc_of = {}
+        # 構築時の転置リスト（昇順の配列）と、構築後に追加した文書の転置リスト
+        # キーは商品名の bi-gram、'^' + 先頭2文字、'@' + メーカーID
+        self.postings = {}
+        self.extra = defaultdict(list)
+        # 構築時のJANコード（昇順）と文書番号、構築後に追加した (JANコード, 文書番号)
+        self.jan_keys = np.empty(0, dtype='U13')
+        self.jan_docs_sorted = _EMPTY
+        self.extra_jans = []
+        # 構築時の商品名のキー（bi-gram・'^' + 先頭2文字）を含まれる文字ごとに分類したもの（1文字の語の検索用）
+        self.char_keys = defaultdict(list)
+        self.manufacturer_names = {}
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def add(self, product_id, name, manufacturer_id, jan_code):
+        """文書を末尾に追加（同じ商品の旧文書は無効にする）"""
+        self.remove(product_id)
+        doc = len(self.product_ids)
+        name = normalize(name)
+        self.product_ids.append(product_id)
+        self.manufacturer_ids.append(manufacturer_id)
+        self.name_lengths.append(len(name))
+        self.alive.append(1)
+        self.names.append(name)
+        self.jan_codes.append(jan_code or '')
+        self.doc_of[product_id] = doc
+        for gram in ngrams(name) | {'^' + name[:NGRAM_SIZE], f'@{manufacturer_id}'}:
+            self.extra[gram].append(doc)
+        if jan_code:
+            self.extra_jans.append((jan_code, doc))
+        return doc
+
+    def remove(self, product_id):
+        doc = self.doc_of.pop(product_id, None)
+        if doc is None:
+            return
+        self.alive[doc] = 0
+        self.dead += 1
+
+    def freeze(self):
+        """追加分の転置リストを配列に固める（構築直後に1回だけ呼ぶ）"""
+        self.postings = {gram: np.array(docs, dtype=np.int32) for gram, docs in self.extra.items()}
+        self.extra = defaultdict(list)
+        self.char_keys = defaultdict(list)
+        for gram in self.postings:
+            if not gram.startswith('@'):
+                for char in set(gram.lstrip('^')):
+                    self.char_keys[char].append(gram)
+        self.extra_jans.sort()
+        self.jan_keys = np.array([jan_code for jan_code, _ in self.extra_jans], dtype='U13')
+        self.jan_docs_sorted = np.array([doc for _, doc in self.extra_jans], dtype=np.int32)
+        self.extra_jans = []
+
+    def posting(self, gram):
+        base = self.postings.get(gram, _EMPTY)
+        extra = self.extra.get(gram)
+        if not extra:
+            return base
+        # 追加分の文書番号は構築時の文書番号より大きいため、連結しても昇順のまま
+        return np.concatenate((base, np.array(extra, dtype=np.int32)))
+
+    def name_docs(self, token):
+        """商品名に token の bi-gram をすべて含む文書と、そのうち商品名の先頭が一致する文書
+
+        bi-gram が連続しているとは限らないため、最終的な一致は検索結果の確定時に文字列で確認する。
+        """
+        postings = sorted((self.posting(gram) for gram in ngrams(token)), key=len)
+        docs = postings[0]
+        if len(postings) > 1:
+            mask = np.zeros(len(self), dtype=bool)
+            for posting in postings[1:]:
+                if not len(docs):
+                    break
+                mask[:] = False
+                mask[posting] = True
+                docs = docs[mask[docs]]
+        prefix = self.posting('^' + token[:NGRAM_SIZE])
+        if len(docs) and len(prefix):
+            mask = np.zeros(len(self), dtype=bool)
+            mask[docs] = True
+            prefix = prefix[mask[prefix]]
+        return docs, prefix
+
+    def char_docs(self, char):
+        """商品名に1文字の char を含む文書と、そのうち商品名が char で始まる文書
+
+        char を含むキーの転置リストの和集合（1文字の商品名は '^' のキーにのみ含まれる）。
+        """
+        keys = list(self.char_keys.get(char, ()))
+        keys += [gram for gram in self.extra if char in gram and not gram.startswith('@')]
+        if not keys:
+            return _EMPTY, _EMPTY
+        mask = np.zeros(len(self), dtype=bool)
+        prefix_mask = np.zeros(len(self), dtype=bool)
+        for gram in keys:
+            docs = self.posting(gram)
+            mask[docs] = True
+            if gram.startswith('^' + char):
+                prefix_mask[docs] = True
+        return np.flatnonzero(mask).astype(np.int32), np.flatnonzero(prefix_mask).astype(np.int32)
+
+    def matches(self, doc, token):
+        """文書が token に一致するか（商品名・メーカー名の部分一致、JANコードの前方一致）"""
+        return (
+            token in self.names[doc]
+            or token in self.manufacturer_names.get(self.manufacturer_ids[doc], '')
+            or (token.isdigit() and self.jan_codes[doc].startswith(token))
+        )
+
+    def manufacturer_docs(self, token):
+        """メーカー名に token を含む文書"""
+        postings = [self.posting(f'@{pk}') for pk, name in self.manufacturer_names.items() if token in name]
+        return np.concatenate(postings) if postings else _EMPTY
+
+    def jan_docs(self, token):
+        """JANコードが token で始まる文書"""
+        start, end = np.searchsorted(self.jan_keys, [token, token + '\uffff'])
+        extra = [doc for jan_code, doc in self.extra_jans if jan_code.startswith(token)]
+        if not extra:
+            return self.jan_docs_sorted[start:end]
+        return np.concatenate((self.jan_docs_sorted[start:end], np.array(extra, dtype=np.int32)))
+
+
+class ProductSearchIndex:
+    """商品検索インデックス（プロセスごとに1つ。product_index を使う）"""
+
+    VERSION_KEY = 'products:search_index:version'
+    # 版数が変わっていなくても他プロセスの変更を取り込む間隔(秒)と、取り込みの最短間隔(秒)
+    REFRESH_INTERVAL = 60
+    MIN_REFRESH_INTERVAL = 2
+    # 変更の取り込み時に遡る時間（トランザクションのコミット遅れを吸収する）
+    REFRESH_OVERLAP = timedelta(seconds=30)
+    # 無効になった文書がこの割合を超えたら作り直す
+    REBUILD_RATIO = 0.25
+    # 順位付けの重み（トークンごとに加算）
+    WEIGHTS = {'jan': 8, 'prefix': 4, 'name': 2, 'manufacturer': 1}
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = None
+        self._building = False
+        self._version = None
+        self._synced_at = None
+        self._checked_at = 0.0
+        self._refreshed_at = 0.0
+        # False の場合、構築・作り直しを呼び出し元のスレッドで同期実行する（テスト用）
+        self.background = True
+
+    # ---- 構築・更新 ----
+
+    def build(self):
+        """DBから全件読み込んでインデックスを作り直す（同期実行）"""
+        from .models import Manufacturer, Product
+
+        started = time.monotonic()
+        version = cache.get(self.VERSION_KEY)
+        synced_at = timezone.now()
+        data = _IndexData()
+        data.manufacturer_names = {
+            pk: normalize(name) for pk, name in Manufacturer.objects.filter(is_active=True).values_list('id', 'name')
+        }
+        rows = (
+            Product.objects.filter(is_active=True, manufacturer__is_active=True).order_by('pk')
+            .values_list('id', 'name', 'manufacturer_id', 'jan_code').iterator(chunk_size=5000)
+        )
+        for product_id, name, manufacturer_id, jan_code in rows:
+            data.add(product_id, name, manufacturer_id, jan_code)
+        data.freeze()
+
+        with self._lock:
+            self._data = data
+            self._version = version
+            self._synced_at = synced_at
+            self._checked_at = self._refreshed_at = time.monotonic()
+        logger.info('商品検索インデックスを構築しました（%d件、%.1f秒）', len(data), time.monotonic() - started)
+        return data
+
+    def _build_in_background(self):
+        if not self.background:
+            self.build()
+            return
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def run():
+            try:
+                self.build()
+            except Exception:
+                logger.exception('商品検索インデックスの構築に失敗しました')
+            finally:
+                self._building = False
+                connection.close()
+
+        threading.Thread(target=run, name='product-search-index', daemon=True).start()
+
+    def update(self, product):
+        """1商品の変更を反映（未構築なら版数の更新のみ）"""
+        with self._lock:
+            data = self._data
+            if data is not None and product.is_active and product.manufacturer_id in data.manufacturer_names:
+                data.add(product.pk, product.name, product.manufacturer_id, product.jan_code)
+            elif data is not None:
+                data.remove(product.pk)
+        self.mark_changed()
+
+    def update_manufacturer(self, manufacturer):
+        """メーカー名の変更を反映（メーカーの無効化は商品ごと外れるため、次回の取り込みに任せる）"""
+        with self._lock:
+            if self._data is not None and manufacturer.is_active:
+                self._data.manufacturer_names[manufacturer.pk] = normalize(manufacturer.name)
+        self.mark_changed()
+
+    def mark_changed(self):
+        """他プロセスのインデックスに変更の取り込みを促す（一括更新の後にも呼ぶ）"""
+        cache.set(self.VERSION_KEY, uuid.uuid4().hex, None)
+
+    def reset(self):
+        with self._lock:
+            self._data = None
+            self._version = None
+            self._synced_at = None
+
+    def refresh(self):
+        """前回の取り込み以降に更新された商品・メーカーを読み直して反映"""
+        from .models import Manufacturer, Product
+
+        with self._lock:
+            data = self._data
+            if data is None:
+                return
+            version = cache.get(self.VERSION_KEY)
+            synced_at = timezone.now()
+            previous = data.manufacturer_names
+            data.manufacturer_names = {
+                pk: normalize(name)
+                for pk, name in Manufacturer.objects.filter(is_active=True).values_list('id', 'name')
+            }
+            # 有効に戻ったメーカーの商品は updated_at が変わらないため、メーカー単位で読み直す
+            restored = data.manufacturer_names.keys() - previous.keys()
+            rows = (
+                Product.objects.filter(
+                    Q(updated_at__gte=self._synced_at - self.REFRESH_OVERLAP) | Q(manufacturer_id__in=restored)
+                ).order_by().values_list('id', 'name', 'manufacturer_id', 'jan_code', 'is_active')
+            )
+            for product_id, name, manufacturer_id, jan_code, is_active in rows:
+                if is_active and manufacturer_id in data.manufacturer_names:
+                    doc = data.doc_of.get(product_id)
+                    # 取り込み範囲の重複で同じ内容を追加し直さないよう、変化がなければ飛ばす
+                    if (
+                        doc is None
+                        or data.names[doc] != normalize(name)
+                        or data.manufacturer_ids[doc] != manufacturer_id
+                        or data.jan_codes[doc] != (jan_code or '')
+                    ):
+                        data.add(product_id, name, manufacturer_id, jan_code)
+                else:
+                    data.remove(product_id)
+            # 無効になったメーカーの商品を外す
+            for manufacturer_id in previous.keys() - data.manufacturer_names.keys():
+                for doc in data.posting(f'@{manufacturer_id}').tolist():
+                    if data.alive[doc]:
+                        data.remove(data.product_ids[doc])
+            self._version = version
+            self._synced_at = synced_at
+            self._refreshed_at = time.monotonic()
+            if data.dead > len(data) * self.REBUILD_RATIO:
+                self._build_in_background()
+
+    def _sync(self):
+        """他プロセスの変更があれば取り込む"""
+        now = time.monotonic()
+        if now - self._checked_at < self.MIN_REFRESH_INTERVAL:
+            return
+        self._checked_at = now
+        if cache.get(self.VERSION_KEY) != self._version or now - self._refreshed_at > self.REFRESH_INTERVAL:
+            self.refresh()
+
+    # ---- 検索 ----
+
+    def search(self, query, limit=20):
+        """検索して商品IDを関連度順に返す
+
+        未構築の場合は None（バックグラウンドで構築を始める）。
+        空白区切りの語はすべて（商品名・メーカー名・JANコードのいずれかに）一致する必要がある。
+        """
+        if self._data is None:
+            self._build_in_background()
+            return None
+        try:
+            self._sync()
+        except Exception:
+            logger.exception('商品検索インデックスの更新に失敗しました')
+
+        tokens = [normalize(token) for token in (query or '').split()]
+        tokens = [token for token in tokens if token]
+        if not tokens or limit <= 0:
+            return []
+
+        with self._lock:
+            return self._search(self._data, tokens, limit)
+
+    def _search(self, data, tokens, limit):
+        # 文書数の長さの配列で、語ごとの一致と点数を集計する
+        matched = np.frombuffer(data.alive, dtype=bool).copy()
+        scores = np.zeros(len(data), dtype=np.int32)
+        hit = np.empty(len(data), dtype=bool)
+        for token in tokens:
+            hit[:] = False
+            fields = {'manufacturer': data.manufacturer_docs(token)}
+            if len(token) >= NGRAM_SIZE:
+                fields['name'], fields['prefix'] = data.name_docs(token)
+            else:
+                fields['name'], fields['prefix'] = data.char_docs(token)
+            if token.isdigit():
+                fields['jan'] = data.jan_docs(token)
+            for field, docs in fields.items():
+                hit[docs] = True
+                scores[docs] += self.WEIGHTS[field]
+            matched &= hit
+
+        candidates = np.flatnonzero(matched)
+        # 関連度の高い順、同点なら商品名の短い順、登録の古い順（小さいほど上位になる並び替えキー）
+        lengths = np.frombuffer(data.name_lengths, dtype=np.int32)[candidates]
+        relevance = scores[candidates].astype(np.int64) * 1000 - np.minimum(lengths, 999)
+        keys = np.frombuffer(data.product_ids, dtype=np.int64)[candidates] - (relevance << 32)
+
+        # 上位から順に文字列で一致を確認し、limit 件そろわなければ範囲を広げる
+        results = []
+        checked = 0
+        size = limit * 2
+        while checked < len(candidates) and len(results) < limit:
+            size = min(size, len(candidates))
+            top = np.argpartition(keys, size - 1)[:size] if size < len(candidates) else np.arange(size)
+            top = top[np.argsort(keys[top])]
+            for doc in candidates[top[checked:]].tolist():
+                if all(data.matches(doc, token) for token in tokens):
+                    results.append(data.product_ids[doc])
+                    if len(results) >= limit:
+                        break
+            checked = size
+            size *= 4
+        return results
+
+
+product_index = ProductSearchIndex()
+
+
+# ---- 検索バックエンド ----
+
+class OrmSearchBackend:
+    """icontains による検索（空白区切りの語はすべて、商品名・JANコード・メーカー名のいずれかに一致）"""
+
+    name = 'orm'
+
+    def filter(self, queryset, query):
+        for word in query.split():
+            queryset = queryset.filter(
+                Q(name__icontains=word) |
+                Q(jan_code__icontains=word) |
+                Q(manufacturer__name__icontains=word)
+            )
+        return queryset
+
+    def search(self, query, limit=20):
+        """関連度順の商品リスト（Ajax検索用）"""
+        from .models import Product
+
+        queryset = Product.objects.filter(is_active=True).select_related('manufacturer')
+        return list(self.filter(queryset, query)[:limit])
+
+    def installed(self):
+        """検索用の索引・テーブルが作成済みか"""
+        return True
+
+    def install(self, rebuild=False):
+        """検索用の索引・テーブルを作成（DBを使うバックエンドのみ。rebuild=True なら内容を作り直す）"""
+
+    def uninstall(self):
+        """install() で作成したものを削除"""
+
+    @staticmethod
+    def _fetch(product_ids):
+        """商品IDの順に有効な商品を取得"""
+        from .models import Product
+
+        products = Product.objects.filter(is_active=True).select_related('manufacturer').in_bulk(product_ids)
+        return [products[pk] for pk in product_ids if pk in products]
+
+
+class MemorySearchBackend(OrmSearchBackend):
+    """プロセス内の検索インデックス（構築が終わるまではORM検索）"""
+
+    name = 'memory'
+
+    def search(self, query, limit=20):
+        product_ids = product_index.search(query, limit)
+        if product_ids is None:
+            return super().search(query, limit)
+        return self._fetch(product_ids)
+
+
+class PostgresSearchBackend(OrmSearchBackend):
+    """pg_trgm のGIN索引を使う検索（PostgreSQL）
+
+    icontains が生成する UPPER(列) LIKE の条件に索引が効くよう、同じ式で索引を作る。
+    3文字未満の語は trigram を取り出せないため索引では絞り込めない。
+    """
+
+    name = 'database'
+    INDEXES = (
+        ('products_product', 'name'),
+        ('products_product', 'jan_code'),
+        ('products_manufacturer', 'name'),
+    )
+
+    def search(self, query, limit=20):
+        from django.contrib.postgres.search import TrigramSimilarity
+        from .models import Product
+
+        queryset = Product.objects.filter(is_active=True).select_related('manufacturer')
+        return list(
+            self.filter(queryset, query)
+            .annotate(similarity=TrigramSimilarity('name', query))
+            .order_by('-similarity', 'name')[:limit]
+        )
+
+    def installed(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT count(*) FROM pg_indexes WHERE indexname = ANY(%s)',
+                ([f'{table}_{column}_trgm' for table, column in self.INDEXES],)
+            )
+            return cursor.fetchone()[0] == len(self.INDEXES)
+
+    def install(self, rebuild=False):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for table, column in self.INDEXES:
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {table}_{column}_trgm '
+                    f'ON {table} USING gin (UPPER({column}) gin_trgm_ops)'
+                )
+                if rebuild:
+                    cursor.execute(f'REINDEX INDEX {table}_{column}_trgm')
+
+    def uninstall(self):
+        with connection.cursor() as cursor:
+            for table, column in self.INDEXES:
+                cursor.execute(f'DROP INDEX IF EXISTS {table}_{column}_trgm')
+
+
+def search_terms(text):
+    """FTS5 に格納する語（正規化した文字列の bi-gram を順に並べ、末尾に最後の1文字を加える）
+
+    語句検索で bi-gram の連続を求めれば部分文字列の一致になる。1文字の語は前方一致で探す。
+    """
+    text = normalize(text)
+    return ' '.join(_ngram_list(text) + [text[-1:]])
+
+
+def register_sqlite_functions(sender, connection, **kwargs):
+    """SQLite の接続ごとに search_terms() をSQL関数として登録（検索用テーブルのトリガーが使う）"""
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function('product_search_terms', 1, search_terms, deterministic=True)
+
+
+class SqliteSearchBackend(OrmSearchBackend):
+    """FTS5 の検索用テーブルを使う検索（SQLite）
+
+    商品名・メーカー名は search_terms() で bi-gram に分けて格納し、商品・メーカーのトリガーで同期する。
+    """
+
+    name = 'database'
+    TABLE = 'products_product_search'
+    TOKENIZER = "unicode61 remove_diacritics 0 categories 'L* N* Co M* P* S*'"
+    # bm25 の列ごとの重み（商品名, メーカー名, JANコード）
+    WEIGHTS = (10.0, 2.0, 5.0)
+
+    def match_expression(self, query):
+        """FTS5 の検索式（語はすべて一致。各語は商品名・メーカー名の部分一致か、JANコードの前方一致）"""
+        clauses = []
+        for word in query.split():
+            token = normalize(word)
+            if not token:
+                continue
+            if len(token) < NGRAM_SIZE:
+                phrase = '"{}"*'.format(token.replace('"', '""'))
+            else:
+                phrase = '"{}"'.format(' '.join(_ngram_list(token)).replace('"', '""'))
+            clause = '{name manufacturer} : ' + phrase
+            if token.isdigit():
+                clause = f'({clause} OR jan_code : "{token}"*)'
+            clauses.append(clause)
+        return ' AND '.join(clauses)
+
+    def filter(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {self.TABLE} WHERE {self.TABLE} MATCH %s', (expression,)
+        ))
+
+    def search(self, query, limit=20):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        weights = ', '.join(str(weight) for weight in self.WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT s.rowid FROM {self.TABLE} s JOIN products_product p ON p.id = s.rowid '
+                f'WHERE {self.TABLE} MATCH %s AND p.is_active '
+                f'ORDER BY bm25({self.TABLE}, {weights}), length(p.name), p.id LIMIT %s',
+                (expression, limit)
+            )
+            return self._fetch([row[0] for row in cursor.fetchall()])
+
+    def installed(self):
+        return self.TABLE in connection.introspection.table_names()
+
+    def install(self, rebuild=False):
+        """検索用テーブルとトリガーを作成（作成時と rebuild=True の場合は全件を投入し直す）"""
+        populate = rebuild or not self.installed()
+        document = (
+            'SELECT p.id, product_search_terms(p.name), product_search_terms(m.name), COALESCE(p.jan_code, \'\') '
+            'FROM products_product p JOIN products_manufacturer m ON m.id = p.manufacturer_id'
+        )
+        statements = [
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.TABLE} '
+            f'USING fts5(name, manufacturer, jan_code, tokenize="{self.TOKENIZER}")',
+            f'CREATE TRIGGER IF NOT EXISTS {self.TABLE}_insert AFTER INSERT ON products_product BEGIN '
+            f'INSERT INTO {self.TABLE}(rowid, name, manufacturer, jan_code) {document} WHERE p.id = new.id; END',
+            f'CREATE TRIGGER IF NOT EXISTS {self.TABLE}_update AFTER UPDATE OF name, jan_code, manufacturer_id '
+            f'ON products_product WHEN old.name IS NOT new.name OR old.jan_code IS NOT new.jan_code '
+            f'OR old.manufacturer_id IS NOT new.manufacturer_id BEGIN '
+            f'DELETE FROM {self.TABLE} WHERE rowid = old.id; '
+            f'INSERT INTO {self.TABLE}(rowid, name, manufacturer, jan_code) {document} WHERE p.id = new.id; END',
+            f'CREATE TRIGGER IF NOT EXISTS {self.TABLE}_delete AFTER DELETE ON products_product BEGIN '
+            f'DELETE FROM {self.TABLE} WHERE rowid = old.id; END',
+            f'CREATE TRIGGER IF NOT EXISTS {self.TABLE}_manufacturer AFTER UPDATE OF name ON products_manufacturer '
+            f'WHEN old.name IS NOT new.name BEGIN '
+            f'UPDATE {self.TABLE} SET manufacturer = product_search_terms(new.name) '
+            f'WHERE rowid IN (SELECT id FROM products_product WHERE manufacturer_id = new.id); END',
+        ]
+        if populate:
+            statements += [
+                f'DELETE FROM {self.TABLE}',
+                f'INSERT INTO {self.TABLE}(rowid, name, manufacturer, jan_code) {document}',
+            ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def uninstall(self):
+        with connection.cursor() as cursor:
+            for trigger in ('insert', 'update', 'delete', 'manufacturer'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {self.TABLE}_{trigger}')
+            cursor.execute(f'DROP TABLE IF EXISTS {self.TABLE}')
+
+
+SEARCH_BACKENDS = {
+    'orm': OrmSearchBackend,
+    'memory': MemorySearchBackend,
+    ('database', 'postgresql'): PostgresSearchBackend,
+    ('database', 'sqlite'): SqliteSearchBackend,
+}
+
+
+def get_search_backend(name=None):
+    """設定（PRODUCT_SEARCH_BACKEND）または name の検索バックエンド
+
+    'database' に対応していないDBではORM検索を使う。
+    """
+    name = name or getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'memory')
+    if name == 'database':
+        return SEARCH_BACKENDS.get((name, connection.vendor), OrmSearchBackend)()
+    if name not in SEARCH_BACKENDS:
+        raise ValueError(f'不明な検索バックエンドです: {name}')
+    return SEARCH_BACKENDS[name]()
@@ -1,11 +1,50 @@
+import csv
+import hashlib
+import io
+import json
+import math
+from decimal import Decimal, InvalidOperation
+
 from django.db import transaction
-from django.db.models import Avg
+from django.db.models import Avg, F, OuterRef, Subquery
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+from apps.core.models import Counter
+from apps.core.validators import validate_dimension, validate_face_count
 from .models import Product, Category, Manufacturer
+from .search import get_search_backend, product_index
 
 
 class ProductService:
     """商品管理サービス"""
+
+    @staticmethod
+    def filter_products(queryset, params):
+        """一覧・エクスポート共通の検索条件（search, category, manufacturer, is_own）で絞り込み"""
+        search_query = params.get('search', '').strip()
+        if search_query:
+            queryset = get_search_backend().filter(queryset, search_query)
+
+        category_id = params.get('category', '')
+        if category_id:
+            queryset = queryset.filter(category_id=category_id)
+
+        manufacturer_id = params.get('manufacturer', '')
+        if manufacturer_id:
+            queryset = queryset.filter(manufacturer_id=manufacturer_id)
+
+        is_own = params.get('is_own', '')
+        if is_own == 'true':
+            queryset = queryset.filter(manufacturer__is_own_company=True)
+        elif is_own == 'false':
+            queryset = queryset.filter(manufacturer__is_own_company=False)
+
+        return queryset
+
+    @staticmethod
+    def search_products(query, limit=20):
+        """商品検索（Ajax用）。設定の検索バックエンドで関連度順に返す"""
+        return get_search_backend().search(query, limit)
     
     @staticmethod
     def create_product_with_validation(product_data, user):
@@ -31,12 +70,385 @@ class ProductService:
             
             return product
     
+    # インポートの列名（英字キーと日本語の見出しのどちらでも指定できる）
+    IMPORT_COLUMNS = {
+        'jan_code': 'JANコード',
+        'name': '商品名',
+        'manufacturer_code': 'メーカーコード',
+        'manufacturer': 'メーカー',
+        'category_code': 'カテゴリコード',
+        'category': 'カテゴリ',
+        'width': '幅(cm)',
+        'height': '高さ(cm)',
+        'depth': '奥行(cm)',
+        'min_faces': '最小フェース',
+        'max_faces': '最大フェース',
+        'recommended_faces': '推奨フェース',
+        'price': '価格',
+        'size_category': 'サイズ区分',
+        'description': '商品説明',
+    }
+    IMPORT_REQUIRED_COLUMNS = ('jan_code', 'name', 'width', 'height', 'depth')
+    IMPORT_UPDATE_FIELDS = [
+        'name', 'manufacturer_id', 'category_id', 'width', 'height', 'depth',
+        'min_faces', 'max_faces', 'recommended_faces', 'price', 'size_category', 'description',
+        'content_hash', 'is_active', 'updated_by', 'updated_at',
+    ]
+    IMPORT_MODES = ('full', 'delta')
+    # 結果に含める行エラー・変更内容の上限（総数は error_count・各件数で返す）
+    MAX_IMPORT_ERRORS = 1000
+    MAX_IMPORT_CHANGES = 1000
+    # 未掲載の商品を論理削除する際の1クエリあたりの件数
+    DEACTIVATE_CHUNK_SIZE = 1000
+
+    @classmethod
+    def bulk_import_products(cls, csv_data, user, delimiter=None, chunk_size=1000, mode='full',
+                             deactivate_missing=False):
+        """CSV/TSVの一括インポート（JANコードで登録・更新）
+
+        csv_data はファイル（テキスト・バイナリ、先頭に戻せるもの）または文字列。
+        区切り文字は省略時に見出し行から判定する。メーカー・カテゴリはコード列
+        （なければ名称列）で解決し、ファイル内で重複するJANコードの行は事前に検出して除外する。
+        行は chunk_size 件ずつ読み込んで検証し、bulk_create/bulk_update で反映するため、
+        エラーのある行があっても他の行は取り込まれる。
+
+        mode='full' は全行を既存の値と照合し、mode='delta' は行の内容ハッシュが前回の取込時と
+        一致する行を解析・照合せずに読み飛ばす（どちらも値が変わらない商品は更新しない）。
+        deactivate_missing=True の場合はファイルにないJANコードの商品を論理削除する
+        （棚に配置中の商品は削除せず retained として数える）。
+        戻り値: {'total', 'created', 'updated', 'unchanged', 'deactivated', 'retained', 'error_count',
+        'row_errors': [{'line'（ファイル上の開始行）, 'jan_code', 'errors'}], 'changes': [{'jan_code', 'action', 'fields'}]}
+        （row_errors は MAX_IMPORT_ERRORS 件、changes は MAX_IMPORT_CHANGES 件まで）
+        """
+        if mode not in cls.IMPORT_MODES:
+            raise ValidationError(f'未対応の取込方法です: {mode}')
+
+        stream = cls._open_import_stream(csv_data)
+        header = stream.readline()
+        if not header.strip():
+            raise ValidationError('見出し行がありません')
+        if delimiter is None:
+            delimiter = '\t' if header.count('\t') > header.count(',') else ','
+        columns = cls._import_columns(next(csv.reader([header], delimiter=delimiter)))
+
+        # ファイル内の重複JANコードを取り込み前に検出（JAN列のみを走査）
+        start = stream.tell()
+        jan_index = columns.index('jan_code')
+        seen = set()
+        duplicates = set()
+        for row in csv.reader(stream, delimiter=delimiter):
+            jan_code = row[jan_index].strip() if len(row) > jan_index else ''
+            if jan_code in seen:
+                duplicates.add(jan_code)
+            elif jan_code:
+                seen.add(jan_code)
+        stream.seek(start)
+        if deactivate_missing and not seen:
+            raise ValidationError('JANコードのある行がないため、未掲載の商品を削除できません')
+
+        manufacturers = {}
+        for manufacturer_id, code, name in Manufacturer.objects.filter(is_active=True).values_list('id', 'code', 'name'):
+            manufacturers[('code', code)] = manufacturers[('name', name)] = manufacturer_id
+        categories = {}
+        for category_id, code, name in Category.objects.filter(is_active=True).values_list('id', 'code', 'name'):
+            categories[('code', code)] = categories[('name', name)] = category_id
+
+        result = {
+            'total': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'deactivated': 0, 'retained': 0,
+            'error_count': 0, 'row_errors': [], 'changes': [],
+        }
+
+        def add_error(line, jan_code, messages):
+            result['error_count'] += 1
+            if len(result['row_errors']) < cls.MAX_IMPORT_ERRORS:
+                result['row_errors'].append({'line': line, 'jan_code': jan_code, 'errors': messages})
+
+        def add_change(jan_code, action, fields=()):
+            result[action] += 1
+            if len(result['changes']) < cls.MAX_IMPORT_CHANGES:
+                result['changes'].append({'jan_code': jan_code, 'action': action, 'fields': list(fields)})
+
+        def import_chunk(rows):
+            cls._import_chunk(rows, user, manufacturers, categories, mode == 'delta', result, add_error, add_change)
+
+        chunk = []
+        reader = csv.reader(stream, delimiter=delimiter)
+        next_line = 2
+        for row in reader:
+            # 行番号はファイル上の行（改行を含む値があっても行の開始位置を示す）
+            line, next_line = next_line, reader.line_num + 2
+            if not any(value.strip() for value in row):
+                continue
+            result['total'] += 1
+            values = {
+                column: value.strip()
+                for column, value in zip(columns, row) if column
+            }
+            jan_code = values.get('jan_code', '')
+            if jan_code in duplicates:
+                add_error(line, jan_code, ['JANコードがファイル内で重複しています'])
+                continue
+            chunk.append((line, values))
+            if len(chunk) >= chunk_size:
+                import_chunk(chunk)
+                chunk = []
+        if chunk:
+            import_chunk(chunk)
+
+        if deactivate_missing:
+            cls._deactivate_missing_products(seen, user, add_change)
+        if result['created'] or result['updated'] or result['deactivated']:
+            # 一括更新は save() を通らないため、検索インデックスには updated_at から取り込ませる
+            product_index.mark_changed()
+        return result
+
     @staticmethod
-    def bulk_import_products(csv_data, user):
-        """CSV一括インポート"""
-        # 将来の実装用
-        raise NotImplementedError('CSV一括インポート機能は今後実装予定です')
-    
+    def _import_hash(values):
+        """取込行の内容ハッシュ（列キーと値から計算するため、列の順序や見出しの表記には依存しない）"""
+        data = json.dumps(sorted(values.items()), ensure_ascii=False)
+        return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _open_import_stream(csv_data):
+        if isinstance(csv_data, str):
+            return io.StringIO(csv_data)
+        if isinstance(csv_data, bytes):
+            csv_data = io.BytesIO(csv_data)
+        if isinstance(csv_data, io.TextIOBase):
+            return csv_data
+        return io.TextIOWrapper(csv_data, encoding='utf-8-sig', newline='')
+
+    @classmethod
+    def _import_columns(cls, header):
+        """見出しを列キーの一覧に変換（未知の列は None）"""
+        aliases = {label: key for key, label in cls.IMPORT_COLUMNS.items()}
+        columns = []
+        for label in header:
+            label = label.strip().lstrip('\ufeff')
+            columns.append(label if label in cls.IMPORT_COLUMNS else aliases.get(label))
+
+        missing = [cls.IMPORT_COLUMNS[key] for key in cls.IMPORT_REQUIRED_COLUMNS if key not in columns]
+        if 'manufacturer_code' not in columns and 'manufacturer' not in columns:
+            missing.append(cls.IMPORT_COLUMNS['manufacturer_code'])
+        if 'category_code' not in columns and 'category' not in columns:
+            missing.append(cls.IMPORT_COLUMNS['category_code'])
+        if missing:
+            raise ValidationError(f"必須の列がありません: {', '.join(missing)}")
+        return columns
+
+    @staticmethod
+    def _parse_import_row(values, manufacturers, categories):
+        """1行分の値を型変換してモデルのフィールド値にする（空欄の任意列は含めない）
+
+        戻り値: (フィールド値, エラーメッセージの一覧)
+        """
+        fields = {}
+        errors = []
+
+        jan_code = values.get('jan_code', '')
+        if not jan_code:
+            errors.append('JANコードは必須です')
+        elif len(jan_code) > 13:
+            errors.append('JANコードは13文字以内である必要があります')
+        fields['jan_code'] = jan_code
+
+        fields['name'] = values.get('name', '')
+        if not fields['name']:
+            errors.append('商品名は必須です')
+
+        for key, label, lookup in (
+            ('manufacturer', 'メーカー', manufacturers),
+            ('category', 'カテゴリ', categories),
+        ):
+            if values.get(f'{key}_code'):
+                reference = ('code', values[f'{key}_code'])
+            else:
+                reference = ('name', values.get(key, ''))
+            if reference not in lookup:
+                errors.append(f'{label}が見つかりません: {reference[1]}')
+            else:
+                fields[f'{key}_id'] = lookup[reference]
+
+        for key in ('width', 'height', 'depth'):
+            try:
+                value = float(values.get(key, ''))
+            except ValueError:
+                errors.append(f'{ProductService.IMPORT_COLUMNS[key]}が数値ではありません')
+                continue
+            # nan / inf は float() で変換できるが、寸法の検証をすり抜けるため行エラーにする
+            if not math.isfinite(value):
+                errors.append(f'{ProductService.IMPORT_COLUMNS[key]}は有限の数値である必要があります')
+            else:
+                fields[key] = value
+
+        for key in ('min_faces', 'max_faces', 'recommended_faces'):
+            if values.get(key):
+                try:
+                    fields[key] = int(values[key])
+                except ValueError:
+                    errors.append(f'{ProductService.IMPORT_COLUMNS[key]}が整数ではありません')
+
+        if values.get('price'):
+            try:
+                price = Decimal(values['price'].replace(',', ''))
+            except InvalidOperation:
+                errors.append('価格が数値ではありません')
+            else:
+                if price.is_finite():
+                    fields['price'] = price
+                else:
+                    errors.append('価格は有限の数値である必要があります')
+        if values.get('size_category'):
+            fields['size_category'] = values['size_category']
+        if 'description' in values:
+            fields['description'] = values['description']
+
+        return fields, errors
+
+    @staticmethod
+    def _validate_import_values(product):
+        """寸法・フェース数・サイズ区分の検証（既存値と統合した後に行う）"""
+        errors = []
+        for key in ('width', 'height', 'depth', 'min_faces', 'max_faces', 'recommended_faces'):
+            validator = validate_dimension if key in ('width', 'height', 'depth') else validate_face_count
+            try:
+                validator(getattr(product, key))
+            except ValidationError as e:
+                errors.extend(f'{ProductService.IMPORT_COLUMNS[key]}: {message}' for message in e.messages)
+        if product.size_category and product.size_category not in dict(Product.SIZE_CHOICES):
+            errors.append(f'サイズ区分が正しくありません: {product.size_category}')
+        if not errors:
+            try:
+                product.clean()
+            except ValidationError as e:
+                errors.extend(e.messages)
+        return errors
+
+    @classmethod
+    def _import_chunk(cls, rows, user, manufacturers, categories, delta, result, add_error, add_change):
+        """取込行をまとめて検証・登録・更新（1トランザクション）"""
+        row_hashes = {values['jan_code']: cls._import_hash(values) for _, values in rows}
+        if delta:
+            # 前回の取込内容と同じ行は解析せずに読み飛ばす
+            stored = dict(
+                Product.objects.filter(jan_code__in=row_hashes, is_active=True).order_by()
+                .values_list('jan_code', 'content_hash')
+            )
+            changed_rows = [
+                (line, values) for line, values in rows
+                if stored.get(values['jan_code']) != row_hashes[values['jan_code']]
+            ]
+            result['unchanged'] += len(rows) - len(changed_rows)
+            rows = changed_rows
+
+        parsed = []
+        for line, values in rows:
+            fields, errors = cls._parse_import_row(values, manufacturers, categories)
+            if errors:
+                add_error(line, values.get('jan_code', ''), errors)
+            else:
+                parsed.append((line, fields))
+        if not parsed:
+            return
+
+        existing = Product.objects.in_bulk([fields['jan_code'] for _, fields in parsed], field_name='jan_code')
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        hash_only = []
+        width_changed = []
+        # 件数の集計値に反映する (有効かどうか, メーカーID) の変更
+        state_changes = []
+
+        for line, fields in parsed:
+            jan_code = fields['jan_code']
+            product = existing.get(jan_code)
+            if product is None:
+                product = Product(**fields, created_by=user, updated_by=user)
+            else:
+                before = {key: getattr(product, key) for key in fields}
+                was_active = product.is_active
+                for key, value in fields.items():
+                    setattr(product, key, value)
+
+            errors = cls._validate_import_values(product)
+            if errors:
+                add_error(line, jan_code, errors)
+                continue
+
+            content_hash = row_hashes[jan_code]
+            if product.pk is None:
+                product.content_hash = content_hash
+                to_create.append(product)
+                state_changes.append((None, (True, product.manufacturer_id)))
+                add_change(jan_code, 'created')
+            elif before == fields and was_active:
+                result['unchanged'] += 1
+                if product.content_hash != content_hash:
+                    product.content_hash = content_hash
+                    hash_only.append(product)
+            else:
+                changed = [key.removesuffix('_id') for key in fields if before[key] != fields[key]]
+                if not was_active:
+                    changed.append('is_active')
+                if before['width'] != product.width:
+                    width_changed.append(product.pk)
+                product.is_active = True
+                product.content_hash = content_hash
+                product.updated_by = user
+                product.updated_at = now
+                to_update.append(product)
+                state_changes.append(((was_active, before['manufacturer_id']), (True, product.manufacturer_id)))
+                add_change(jan_code, 'updated', changed)
+
+        with transaction.atomic():
+            Product.objects.bulk_create(to_create)
+            Product.objects.bulk_update(to_update, cls.IMPORT_UPDATE_FIELDS)
+            # 値が変わらない商品はハッシュのみ記録（更新日時・レイアウト版数は変えない）
+            Product.objects.bulk_update(hash_only, ['content_hash'])
+            Product.count_changes(state_changes)
+            if to_update:
+                # bulk_update は save() を経由しないため、配置の占有幅と棚のレイアウト版数をここで反映
+                from apps.shelves.models import ProductPlacement, Shelf, ShelfSegment
+                if width_changed:
+                    placements = ProductPlacement.objects.filter(product_id__in=width_changed).order_by()
+                    placements.update(occupied_width=F('face_count') * Subquery(
+                        Product.objects.filter(pk=OuterRef('product_id')).values('width')[:1]
+                    ))
+                    segment_ids = set(placements.filter(is_active=True).values_list('segment_id', flat=True))
+                    if segment_ids:
+                        ShelfSegment.refresh_placement_counters(segment_ids)
+                Shelf.bump_layout_revisions(product_id__in=[product.pk for product in to_update])
+
+    @classmethod
+    def _deactivate_missing_products(cls, jan_codes, user, add_change):
+        """jan_codes にない有効な商品を論理削除（棚に配置中の商品は残す）"""
+        from apps.shelves.models import ProductPlacement
+
+        missing = [
+            (product_id, jan_code)
+            for product_id, jan_code in Product.objects.filter(is_active=True).exclude(jan_code__isnull=True)
+            .exclude(jan_code='').order_by().values_list('id', 'jan_code').iterator(chunk_size=5000)
+            if jan_code not in jan_codes
+        ]
+        now = timezone.now()
+        for start in range(0, len(missing), cls.DEACTIVATE_CHUNK_SIZE):
+            chunk = dict(missing[start:start + cls.DEACTIVATE_CHUNK_SIZE])
+            placed = set(
+                ProductPlacement.objects.filter(is_active=True, product_id__in=chunk).order_by()
+                .values_list('product_id', flat=True)
+            )
+            targets = Product.objects.filter(pk__in=chunk.keys() - placed, is_active=True).order_by()
+            own_flags = list(targets.values_list('manufacturer__is_own_company', flat=True))
+            with transaction.atomic():
+                Counter.add(**{
+                    Counter.PRODUCTS: -len(own_flags),
+                    Counter.OWN_PRODUCTS: -sum(own_flags),
+                })
+                targets.update(is_active=False, updated_by=user, updated_at=now)
+            for product_id, jan_code in chunk.items():
+                add_change(jan_code, 'retained' if product_id in placed else 'deactivated')
+
     @staticmethod
     def get_product_placement_stats(product):
         """商品の配置統計を取得"""
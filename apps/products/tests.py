@@ -1,3 +1,400 @@
+# apps/products/tests.py
+"""
+商品管理機能のテスト
+"""
+import csv
+import gzip
+import io
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone
+
+from .models import Category, Manufacturer, Product
+
+User = get_user_model()
+
+
+class ProductExportTest(TestCase):
+    """商品CSVエクスポートのテスト"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='productuser', password='testpass123')
+        category = Category.objects.create(name='飲料', code='C01')
+        own = Manufacturer.objects.create(name='自社', code='M01', is_own_company=True)
+        other = Manufacturer.objects.create(name='競合', code='M02')
+        for index in range(3):
+            Product.objects.create(
+                name=f'お茶{index}', manufacturer=own, category=category, width=10, height=20, depth=10
+            )
+        Product.objects.create(name='競合茶', manufacturer=other, category=category, width=10, height=20, depth=10)
+        Product.objects.create(
+            name='終売品', manufacturer=own, category=category, width=10, height=20, depth=10, is_active=False
+        )
+        self.client.force_login(self.user)
+
+    def read_rows(self, content):
+        return list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+
+    def test_streaming_csv(self):
+        response = self.client.get('/products/export/csv/')
+        self.assertTrue(response.streaming)
+        rows = self.read_rows(b''.join(response.streaming_content))
+        self.assertEqual(rows[0][0], '商品名')
+        self.assertEqual([row[0] for row in rows[1:]], ['お茶0', 'お茶1', 'お茶2', '競合茶'])
+
+        # 一覧と同じ検索条件で絞り込み、gzip圧縮
+        response = self.client.get('/products/export/csv/', {'is_own': 'false', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('products.csv.gz', response['Content-Disposition'])
+        rows = self.read_rows(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual([row[0] for row in rows[1:]], ['競合茶'])
+
+
+class ProductImportTest(TestCase):
+    """商品一括インポートのテスト"""
+
+    HEADER = 'JANコード,商品名,メーカーコード,カテゴリコード,幅(cm),高さ(cm),奥行(cm),最小フェース,最大フェース,推奨フェース\n'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='productuser', password='testpass123')
+        self.category = Category.objects.create(name='飲料', code='C01')
+        self.maker = Manufacturer.objects.create(name='自社', code='M01', is_own_company=True)
+
+    def test_row_errors_do_not_abort(self):
+        from .services import ProductService
+
+        csv_data = self.HEADER + (
+            '4900000000001,"お茶\n（500ml）",M01,C01,10,20,10,1,5,2\n'
+            '4900000000002,重複A,M01,C01,10,20,10,,,\n'
+            '4900000000003,不明メーカー,M99,C01,10,20,10,,,\n'
+            '4900000000002,重複B,M01,C01,10,20,10,,,\n'
+            '4900000000004,幅不正,M01,C01,abc,20,10,,,\n'
+            '4900000000005,フェース不正,M01,C01,10,20,10,3,2,2\n'
+            '4900000000006,寸法超過,M01,C01,10,2000,10,,,\n'
+            '4900000000007,水,M01,C01,8,25,8,,,\n'
+            '4900000000008,幅NaN,M01,C01,nan,20,10,,,\n'
+            '4900000000009,奥行inf,M01,C01,10,20,inf,,,\n'
+        )
+        result = ProductService.bulk_import_products(csv_data, self.user, chunk_size=2)
+
+        self.assertEqual(result['total'], 10)
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['error_count'], 8)
+        # 改行を含む値（2行）の後の行もファイル上の行番号を返す
+        self.assertEqual([error['line'] for error in result['row_errors']], [4, 5, 6, 7, 8, 9, 11, 12])
+        self.assertIn('有限の数値', result['row_errors'][6]['errors'][0])
+        self.assertIn('有限の数値', result['row_errors'][7]['errors'][0])
+        self.assertIn('重複', result['row_errors'][0]['errors'][0])
+        self.assertEqual(
+            set(Product.objects.values_list('jan_code', flat=True)), {'4900000000001', '4900000000007'}
+        )
+        product = Product.objects.get(jan_code='4900000000001')
+        self.assertEqual((product.max_faces, product.recommended_faces, product.created_by), (5, 2, self.user))
+
+    def test_upsert_updates_placements(self):
+        from apps.shelves.models import Shelf, ShelfSegment, ProductPlacement
+        from .services import ProductService
+
+        product = Product.objects.create(
+            name='お茶', jan_code='4900000000001', manufacturer=self.maker, category=self.category,
+            width=10, height=20, depth=10
+        )
+        Product.objects.create(
+            name='水', jan_code='4900000000002', manufacturer=self.maker, category=self.category,
+            width=8, height=25, depth=8, is_active=False
+        )
+        shelf = Shelf.objects.create(name='テスト棚', width=90, depth=45)
+        segment = ShelfSegment.objects.create(shelf=shelf, level=1, height=30)
+        ProductPlacement.objects.create(shelf=shelf, segment=segment, product=product, x_position=0, face_count=2)
+        revision = Shelf.objects.get(pk=shelf.pk).layout_revision
+
+        # TSV（BOM付きUTF-8）、任意列の省略は既存値を維持
+        tsv = (
+            'jan_code\tname\tmanufacturer\tcategory\twidth\theight\tdepth\n'
+            '4900000000001\tお茶 改\t自社\t飲料\t12\t20\t10\n'
+            '4900000000002\t水\t自社\t飲料\t8\t25\t8\n'
+        ).encode('utf-8-sig')
+        result = ProductService.bulk_import_products(io.BytesIO(tsv), self.user)
+        self.assertEqual((result['created'], result['updated'], result['error_count']), (0, 2, 0))
+
+        self.assertTrue(Product.objects.get(jan_code='4900000000002').is_active)
+        self.assertEqual(ProductPlacement.objects.get(product=product).occupied_width, 24)
+        self.assertEqual(ShelfSegment.objects.get(pk=segment.pk).used_width, 24)
+        self.assertGreater(Shelf.objects.get(pk=shelf.pk).layout_revision, revision)
+
+        result = ProductService.bulk_import_products(io.BytesIO(tsv), self.user)
+        self.assertEqual((result['updated'], result['unchanged']), (0, 2))
+
+    def test_import_api(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile('products.csv', (self.HEADER + '4900000000001,お茶,M01,C01,10,20,10,,,\n').encode())
+        response = self.client.post('/products/api/import/', {'file': upload})
+        self.assertEqual(response.json()['created'], 1)
+
+        upload = SimpleUploadedFile('products.csv', '商品名,幅(cm)\nお茶,10\n'.encode())
+        response = self.client.post('/products/api/import/', {'file': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JANコード', response.json()['errors'][0])
+
+    def test_delta_sync(self):
+        from apps.shelves.models import Shelf, ShelfSegment, ProductPlacement
+        from .services import ProductService
+
+        rows = [f'49000000000{index:02d},商品{index},M01,C01,10,20,10,,,\n' for index in range(10)]
+        ProductService.bulk_import_products(self.HEADER + ''.join(rows), self.user)
+        placed = Product.objects.get(jan_code='4900000000009')
+        shelf = Shelf.objects.create(name='テスト棚', width=90, depth=45)
+        segment = ShelfSegment.objects.create(shelf=shelf, level=1, height=30)
+        ProductPlacement.objects.create(shelf=shelf, segment=segment, product=placed, x_position=0)
+        edited = Product.objects.get(jan_code='4900000000001')
+        edited.name = '画面で変更'
+        edited.save()
+        stamp = Product.objects.get(jan_code='4900000000000').updated_at
+
+        # 1件変更、2件（うち1件は配置中）をフィードから除外
+        rows[2] = '4900000000002,商品2 改,M01,C01,10,20,10,,,\n'
+        feed = self.HEADER + ''.join(rows[:8]) + '4900000000010,新商品,M01,C01,10,20,10,,,\n'
+        # メーカー・カテゴリ2件 + ハッシュ照合・変更行の読込2件 + 登録・更新・集計値7件 + 未掲載の削除・集計値7件
+        with self.assertNumQueries(18):
+            result = ProductService.bulk_import_products(
+                feed, self.user, mode='delta', deactivate_missing=True
+            )
+
+        self.assertEqual(
+            (result['created'], result['updated'], result['unchanged'], result['deactivated'], result['retained']),
+            (1, 2, 6, 1, 1)
+        )
+        changes = {change['jan_code']: (change['action'], change['fields']) for change in result['changes']}
+        self.assertEqual(changes['4900000000002'], ('updated', ['name']))
+        self.assertEqual(changes['4900000000001'], ('updated', ['name']))
+        self.assertEqual(changes['4900000000008'], ('deactivated', []))
+        self.assertEqual(changes['4900000000009'], ('retained', []))
+        self.assertEqual(Product.objects.get(jan_code='4900000000000').updated_at, stamp)
+        self.assertFalse(Product.objects.get(jan_code='4900000000008').is_active)
+        self.assertTrue(Product.objects.get(jan_code='4900000000009').is_active)
+
+        result = ProductService.bulk_import_products(feed, self.user, mode='delta')
+        self.assertEqual((result['updated'], result['unchanged']), (0, 9))
+
+
+class ProductSearchIndexTest(TestCase):
+    """商品検索インデックスのテスト"""
+
+    def setUp(self):
+        from .search import product_index
+
+        self.user = User.objects.create_user(username='productuser', password='testpass123')
+        self.category = Category.objects.create(name='飲料', code='C01')
+        self.maker = Manufacturer.objects.create(name='サンプル飲料', code='M01', is_own_company=True)
+        other = Manufacturer.objects.create(name='競合フーズ', code='M02')
+        self.green = self.create('緑茶 500ml', '4901000000001')
+        self.oolong = self.create('ｳｰﾛﾝ茶', '4901000000002')
+        self.tea = self.create('お茶の水', '4902000000003', manufacturer=other)
+        self.create('終売茶', '4901000000004', is_active=False)
+        self.index = product_index
+        # 作り直しを別スレッド（別接続）で実行しないよう同期実行にする
+        self.index.background = False
+        self.index.build()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.index.reset()
+        self.index.background = True
+
+    def create(self, name, jan_code, manufacturer=None, is_active=True):
+        return Product.objects.create(
+            name=name, jan_code=jan_code, manufacturer=manufacturer or self.maker, category=self.category,
+            width=10, height=20, depth=10, is_active=is_active
+        )
+
+    def test_normalized_search(self):
+        # 半角カナ・ひらがな・全角英数字の違いを無視する
+        self.assertEqual(self.index.search('うーろん'), [self.oolong.pk])
+        self.assertEqual(self.index.search('緑茶　５００ＭＬ'), [self.green.pk])
+        # メーカー名とJANコードの前方一致、複数語は AND
+        self.assertEqual(self.index.search('競合'), [self.tea.pk])
+        self.assertEqual(self.index.search('49010'), [self.oolong.pk, self.green.pk])
+        self.assertEqual(self.index.search('サンプル 緑'), [self.green.pk])
+        # 無効な商品は含めず、同点なら商品名の短い順
+        self.assertEqual(self.index.search('49'), [self.tea.pk, self.oolong.pk, self.green.pk])
+        self.assertEqual(self.index.search('49', limit=1), [self.tea.pk])
+
+    def test_incremental_update(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.green.name = '抹茶ラテ'
+            self.green.save()
+            created = self.create('ほうじ茶', '4901000000005')
+        self.assertEqual(self.index.search('まっちゃ'), [])
+        self.assertEqual(self.index.search('抹茶'), [self.green.pk])
+        self.assertEqual(self.index.search('緑茶'), [])
+        self.assertEqual(self.index.search('ほうじ'), [created.pk])
+        # 1文字の語も商品名の部分一致で検索する（同点なら商品名の短い順、登録の古い順）
+        self.assertEqual(
+            self.index.search('茶'), [self.green.pk, self.tea.pk, created.pk, self.oolong.pk]
+        )
+        # 商品名の前方一致を優先する
+        cold = self.create('水出し緑茶', '4901000000006')
+        jelly = self.create('緑茶ゼリー濃いめ', '4901000000007')
+        self.index.update(cold)
+        self.index.update(jelly)
+        self.assertEqual(self.index.search('緑茶'), [jelly.pk, cold.pk])
+        self.assertEqual(self.index.search('緑 茶'), [jelly.pk, cold.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            created.is_active = False
+            created.save()
+        self.assertEqual(self.index.search('ほうじ'), [])
+
+        # 一括更新（save() を通らない変更）は refresh() で取り込む
+        Product.objects.filter(pk=self.oolong.pk).update(name='烏龍茶', updated_at=timezone.now())
+        self.index.refresh()
+        self.assertEqual(self.index.search('烏龍'), [self.oolong.pk])
+        self.assertEqual(self.index.search('うーろん'), [])
+
+    def test_search_api(self):
+        response = self.client.get('/products/api/search/', {'q': '4902'})
+        self.assertEqual([item['id'] for item in response.json()['products']], [self.tea.pk])
+
+        # ORM検索の設定
+        with self.settings(PRODUCT_SEARCH_BACKEND='orm'):
+            response = self.client.get('/products/api/search/', {'q': 'サンプル 緑茶'})
+        self.assertEqual([item['id'] for item in response.json()['products']], [self.green.pk])
+
+
+class DatabaseSearchBackendTest(TestCase):
+    """DBの検索バックエンド（SQLite: FTS5）のテスト"""
+
+    def setUp(self):
+        from .search import get_search_backend
+
+        self.backend = get_search_backend('database')
+        self.backend.install()
+        category = Category.objects.create(name='飲料', code='C01')
+        self.maker = Manufacturer.objects.create(name='サンプル飲料', code='M01')
+        self.oolong = Product.objects.create(
+            name='ｳｰﾛﾝ茶 500ml', jan_code='4901000000001', manufacturer=self.maker, category=category,
+            width=10, height=20, depth=10
+        )
+        self.water = Product.objects.create(
+            name='天然水', jan_code='4902000000002', manufacturer=self.maker, category=category,
+            width=10, height=20, depth=10
+        )
+
+    def search(self, query):
+        return [product.pk for product in self.backend.search(query)]
+
+    def test_search_and_sync(self):
+        self.assertEqual(self.search('うーろん'), [self.oolong.pk])
+        self.assertEqual(self.search('ロン茶 ５００'), [self.oolong.pk])
+        self.assertEqual(self.search('4902'), [self.water.pk])
+        self.assertEqual(self.search('茶'), [self.oolong.pk])
+        self.assertEqual(self.search('ろんう'), [])
+
+        # 商品・メーカーの変更はトリガーで検索用テーブルに反映される
+        Product.objects.filter(pk=self.water.pk).update(name='炭酸水')
+        self.maker.name = '新メーカー'
+        self.maker.save()
+        self.assertEqual(self.search('炭酸'), [self.water.pk])
+        self.assertEqual(self.search('天然'), [])
+        self.assertEqual(self.search('新メーカー'), [self.water.pk, self.oolong.pk])
+
+        # 一覧画面の絞り込み
+        from .services import ProductService
+        with self.settings(PRODUCT_SEARCH_BACKEND='database'):
+            products = ProductService.filter_products(Product.objects.all(), {'search': 'ウーロン'})
+        self.assertEqual(list(products), [self.oolong])
+
+        self.water.is_active = False
+        self.water.save()
+        self.assertEqual(self.search('メーカー'), [self.oolong.pk])
+
+
+class ProductBrowseTest(TestCase):
+    """商品一覧のキーセットページネーションのテスト"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='productuser', password='testpass123')
+        category = Category.objects.create(name='飲料', code='C01')
+        makers = [
+            Manufacturer.objects.create(name='Bメーカー', code='M01', is_own_company=True),
+            Manufacturer.objects.create(name='Aメーカー', code='M02'),
+        ]
+        for index in range(25):
+            # 同名の商品を含めても pk で順序が決まる
+            Product.objects.create(
+                name=f'商品{index % 10:02d}', manufacturer=makers[index % 2], category=category,
+                width=10, height=20, depth=10
+            )
+        self.expected = list(
+            Product.objects.filter(is_active=True).order_by('manufacturer__name', 'name', 'pk')
+            .values_list('pk', flat=True)
+        )
+        self.client.force_login(self.user)
+
+    def test_list_pages(self):
+        seen = []
+        query = ''
+        while query is not None:
+            response = self.client.get('/products/?' + query)
+            page = response.context['page_obj']
+            seen += [product.pk for product in page]
+            query = page.next_query
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(response.context['paginator'].count, 25)
+        self.assertEqual(response.context['stats']['competitor_products'], 12)
+
+        # 最後のページ（末尾の20件）から前へ
+        response = self.client.get('/products/?before=')
+        self.assertEqual([product.pk for product in response.context['page_obj']], self.expected[5:])
+        self.assertFalse(response.context['page_obj'].has_next())
+        response = self.client.get('/products/?' + response.context['page_obj'].previous_query)
+        self.assertEqual([product.pk for product in response.context['page_obj']], self.expected[:5])
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+        self.assertEqual(self.client.get('/products/', {'after': '!!'}).status_code, 404)
+
+    def test_browse_api(self):
+        response = self.client.get('/products/api/browse/', {'limit': 10, 'count': '1', 'is_own': 'true'})
+        data = response.json()
+        self.assertEqual(data['count'], 13)
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(data['results'][0]['manufacturer__name'], 'Bメーカー')
+        self.assertIsNone(data['previous'])
+
+        with self.assertNumQueries(3):
+            data = self.client.get('/products/api/browse/', {'after': data['next'], 'is_own': 'true'}).json()
+        self.assertEqual(len(data['results']), 3)
+        self.assertIsNone(data['next'])
+        self.assertNotIn('count', data)
+
+        response = self.client.get('/products/api/browse/', {'after': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_tampered_cursor(self):
+        from utils.pagination import encode_cursor
+
+        for values in (['a', 'b', 'x'], ['a', 'b', None], ['a', 'b', [1]], ['a', 'b']):
+            cursor = encode_cursor(values)
+            self.assertEqual(self.client.get('/products/', {'after': cursor}).status_code, 404)
+            self.assertEqual(self.client.get('/products/', {'before': cursor}).status_code, 404)
+            response = self.client.get('/products/api/browse/', {'after': cursor})
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response.json()['success'])
+
+        # 型の変換できる値（数値の文字列の pk）は通常どおり扱う
+        response = self.client.get('/products/api/browse/', {'after': encode_cursor(['Aメーカー', '商品00', '0'])})
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_count(self):
+        from utils.pagination import list_count
 
-# Create your tests here.
+        products = Product.objects.filter(is_active=True, manufacturer__is_own_company=True)
+        with self.settings(LIST_COUNT_MODE='cached'):
+            self.assertEqual(list_count(products), (13, False))
+            Product.objects.filter(pk=products.first().pk).update(is_active=False)
+            with self.assertNumQueries(0):
+                self.assertEqual(list_count(products), (13, False))
+        self.assertEqual(list_count(products), (12, False))
@@ -10,8 +10,11 @@ urlpatterns = [
     path('<int:pk>/', views.ProductDetailView.as_view(), name='detail'),
     path('<int:pk>/edit/', views.ProductUpdateView.as_view(), name='update'),
     path('<int:pk>/delete/', views.product_delete, name='delete'),
+    path('export/csv/', views.product_export_csv, name='export_csv'),
     
     # API エンドポイント
     path('api/search/', views.product_search_api, name='search_api'),
+    path('api/browse/', views.product_browse_api, name='browse_api'),
+    path('api/import/', views.product_import_api, name='import_api'),
     path('api/<int:pk>/facing-suggestion/', views.product_facing_suggestion, name='facing_suggestion'),
 ]
\ No newline at end of file
@@ -9,50 +9,34 @@ from django.views.generic import ListView, DetailView, CreateView, UpdateView
 from django.urls import reverse_lazy
 from django.db.models import Q, Count, Sum, Avg, Max
 from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
 
+from apps.core.models import Counter
 from .models import Product, Category, Manufacturer
 from .forms import ProductForm, ProductSearchForm
+from .services import ProductService
+from utils.exporters import export_products_csv
+from utils.pagination import InvalidCursor, KeysetPaginationMixin, browse_payload
 
 
 @method_decorator(login_required, name='dispatch')
-class ProductListView(ListView):
-    """商品一覧ビュー"""
+class ProductListView(KeysetPaginationMixin, ListView):
+    """商品一覧ビュー（キーセットページネーション）"""
     model = Product
     template_name = 'products/list.html'
     context_object_name = 'products'
     paginate_by = 20
+    keyset_ordering = ('manufacturer__name', 'name', 'pk')
 
     def get_queryset(self):
         queryset = Product.objects.filter(is_active=True).select_related(
             'manufacturer', 'category'
-        ).order_by('manufacturer__name', 'name')
+        )
         
-        # 検索フィルタリング
-        search_query = self.request.GET.get('search', '')
-        if search_query:
-            queryset = queryset.filter(
-                Q(name__icontains=search_query) |
-                Q(jan_code__icontains=search_query) |
-                Q(manufacturer__name__icontains=search_query)
-            )
-        
-        # カテゴリフィルタ
-        category_id = self.request.GET.get('category', '')
-        if category_id:
-            queryset = queryset.filter(category_id=category_id)
-        
-        # メーカーフィルタ
-        manufacturer_id = self.request.GET.get('manufacturer', '')
-        if manufacturer_id:
-            queryset = queryset.filter(manufacturer_id=manufacturer_id)
-        
-        # 自社/競合フィルタ
-        is_own = self.request.GET.get('is_own', '')
-        if is_own == 'true':
-            queryset = queryset.filter(manufacturer__is_own_company=True)
-        elif is_own == 'false':
-            queryset = queryset.filter(manufacturer__is_own_company=False)
+        # 検索・カテゴリ・メーカー・自社/競合で絞り込み
+        queryset = ProductService.filter_products(queryset, self.request.GET)
         
         return queryset
 
@@ -62,11 +46,12 @@ class ProductListView(ListView):
         context['categories'] = Category.objects.filter(is_active=True)
         context['manufacturers'] = Manufacturer.objects.filter(is_active=True)
         
-        # 統計情報
+        # 統計情報（集計値から1クエリで取得。競合商品数は総数との差）
+        counters = Counter.values()
         context['stats'] = {
-            'total_products': Product.objects.filter(is_active=True).count(),
-            'own_products': Product.objects.filter(is_active=True, manufacturer__is_own_company=True).count(),
-            'competitor_products': Product.objects.filter(is_active=True, manufacturer__is_own_company=False).count(),
+            'total_products': counters[Counter.PRODUCTS],
+            'own_products': counters[Counter.OWN_PRODUCTS],
+            'competitor_products': counters[Counter.PRODUCTS] - counters[Counter.OWN_PRODUCTS],
         }
         
         return context
@@ -176,16 +161,13 @@ def product_delete(request, pk):
 @login_required
 def product_search_api(request):
     """商品検索API（Ajax用）"""
-    query = request.GET.get('q', '')
-    limit = int(request.GET.get('limit', 20))
+    query = request.GET.get('q', '').strip()
+    limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
     
     if len(query) < 2:
         return JsonResponse({'products': []})
     
-    products = Product.objects.filter(
-        is_active=True,
-        name__icontains=query
-    ).select_related('manufacturer')[:limit]
+    products = ProductService.search_products(query, limit)
     
     data = {
         'products': [{
@@ -224,4 +206,54 @@ def product_facing_suggestion(request, pk):
         'required_width': product.width * optimal_facing,
     }
     
-    return JsonResponse(data)
\ No newline at end of file
+    return JsonResponse(data)
+
+
+@login_required
+def product_export_csv(request):
+    """商品CSVエクスポート（一覧と同じ検索条件、?gzip=1 で圧縮）"""
+    products = ProductService.filter_products(Product.objects.filter(is_active=True), request.GET)
+    return export_products_csv(products, compress=request.GET.get('gzip') == '1')
+
+
+@login_required
+def product_browse_api(request):
+    """商品一覧のJSON API（一覧と同じ検索条件。?after= / ?before= / ?limit= / ?count=1）"""
+    products = ProductService.filter_products(Product.objects.filter(is_active=True), request.GET).values(
+        'id', 'name', 'jan_code', 'width', 'height', 'depth', 'price',
+        'manufacturer_id', 'manufacturer__name', 'manufacturer__is_own_company', 'category_id', 'category__name',
+    )
+    try:
+        payload = browse_payload(products, request.GET, ProductListView.keyset_ordering)
+    except InvalidCursor as e:
+        return JsonResponse({'success': False, 'errors': [str(e)]}, status=400)
+    return JsonResponse(payload)
+
+
+@login_required
+@require_http_methods(["POST"])
+def product_import_api(request):
+    """商品CSV/TSVの一括インポートAPI
+
+    file: 取り込むファイル、delimiter: tab/comma（省略時は自動判定）、
+    mode: full/delta（差分同期）、deactivate_missing=1: ファイルにない商品を論理削除
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'success': False, 'errors': ['ファイルを指定してください']}, status=400)
+
+    delimiter = {'tab': '\t', 'comma': ','}.get(request.POST.get('delimiter', ''))
+    try:
+        result = ProductService.bulk_import_products(
+            upload.file,
+            request.user,
+            delimiter=delimiter,
+            mode=request.POST.get('mode', 'full'),
+            deactivate_missing=request.POST.get('deactivate_missing') == '1',
+        )
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'errors': e.messages}, status=400)
+    except UnicodeDecodeError:
+        return JsonResponse({'success': False, 'errors': ['ファイルはUTF-8で保存してください']}, status=400)
+
+    return JsonResponse({'success': True, 'errors': [], **result})
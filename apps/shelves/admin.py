@@ -2,8 +2,11 @@
 棚管理画面
 """
 from django.contrib import admin
+from django.contrib import messages
+from django.db.models.functions import Length
 from django.utils.html import format_html
-from .models import Shelf, ShelfSegment, ProductPlacement
+from .models import Shelf, ShelfSegment, ProductPlacement, ShelfLayoutSnapshot
+from .services import ShelfService, ShelfSnapshotService
 
 
 class ShelfSegmentInline(admin.TabularInline):
@@ -37,6 +40,21 @@ class ShelfAdmin(admin.ModelAdmin):
     
     inlines = [ShelfSegmentInline]
     
+    def save_formset(self, request, form, formset, change):
+        """段インラインはまとめて保存し、y_positionは最後に一度だけ再計算"""
+        if formset.model is not ShelfSegment:
+            return super().save_formset(request, form, formset, change)
+        
+        segments = formset.save(commit=False)
+        for segment in formset.deleted_objects:
+            segment.is_active = False
+            segment.save(reflow=False)
+        for segment in segments:
+            segment.save(reflow=False)
+        formset.save_m2m()
+        
+        ShelfService.reflow_segment_positions(form.instance)
+    
     def dimensions_display(self, obj):
         """寸法表示"""
         return f"{obj.width}×{obj.depth}cm"
@@ -71,18 +89,19 @@ class ShelfSegmentAdmin(admin.ModelAdmin):
     list_filter = ['shelf', 'is_active']
     ordering = ['shelf', 'level']
     list_editable = ['height', 'is_active']
+    list_select_related = ['shelf']
     
     fieldsets = (
         ('基本情報', {
             'fields': ('shelf', 'level', 'height')
         }),
         ('計算値', {
-            'fields': ('y_position',),
+            'fields': ('y_position', 'used_width', 'active_placement_count'),
             'classes': ('collapse',)
         }),
     )
     
-    readonly_fields = ['y_position']
+    readonly_fields = ['y_position', 'used_width', 'active_placement_count']
     inlines = [ProductPlacementInline]
     
     def y_position_display(self, obj):
@@ -97,7 +116,7 @@ class ShelfSegmentAdmin(admin.ModelAdmin):
     
     def placement_count(self, obj):
         """配置数"""
-        return obj.placements.count()
+        return obj.active_placement_count
     placement_count.short_description = '配置商品数'
 
 
@@ -140,4 +159,38 @@ class ProductPlacementAdmin(admin.ModelAdmin):
     def occupied_width_display(self, obj):
         """占有幅表示"""
         return f"{obj.occupied_width}cm"
-    occupied_width_display.short_description = '占有幅'
\ No newline at end of file
+    occupied_width_display.short_description = '占有幅'
+
+@admin.register(ShelfLayoutSnapshot)
+class ShelfLayoutSnapshotAdmin(admin.ModelAdmin):
+    list_display = [
+        'shelf', 'name', 'revision', 'segment_count', 'placement_count',
+        'data_size_display', 'created_by', 'created_at'
+    ]
+    list_filter = ['shelf']
+    search_fields = ['name', 'shelf__name']
+    list_select_related = ['shelf', 'created_by']
+    readonly_fields = ['revision', 'segment_count', 'placement_count', 'created_by', 'created_at']
+    fields = ['shelf', 'name', 'revision', 'segment_count', 'placement_count', 'created_by', 'created_at']
+    actions = ['restore_snapshot']
+    
+    def get_queryset(self, request):
+        """一覧ではレイアウトデータ本体を読み込まない"""
+        return super().get_queryset(request).defer('data').annotate(data_size=Length('data'))
+    
+    def has_add_permission(self, request):
+        # スナップショットは画面・APIから取得する
+        return False
+    
+    def data_size_display(self, obj):
+        """データサイズ表示"""
+        return f"{obj.data_size / 1024:.1f}KB"
+    data_size_display.short_description = 'サイズ'
+    
+    @admin.action(description='選択したスナップショットを復元')
+    def restore_snapshot(self, request, queryset):
+        if queryset.count() != 1:
+            self.message_user(request, '復元するスナップショットを1件選択してください', messages.WARNING)
+            return
+        result = ShelfSnapshotService.restore(queryset.defer(None).get(), request.user)
+        self.message_user(request, f"{result['placement_count']}件の配置を復元しました")
@@ -2,6 +2,7 @@
 """
 配置制約チェック
 """
+import numpy as np
 from django.core.exceptions import ValidationError
 
 
@@ -29,26 +30,12 @@ class PlacementConstraints:
     @staticmethod
     def check_overlap_constraint(segment, x_position, required_width, exclude_placement=None):
         """重複制約チェック"""
-        from .models import ProductPlacement
-        
         start_pos = x_position
         end_pos = x_position + required_width
+        exclude_id = exclude_placement.id if exclude_placement else None
         
-        overlapping = ProductPlacement.objects.filter(
-            segment=segment,
-            is_active=True
-        )
-        
-        if exclude_placement:
-            overlapping = overlapping.exclude(id=exclude_placement.id)
-        
-        for placement in overlapping:
-            existing_start = placement.x_position
-            existing_end = placement.x_position + placement.occupied_width
-            
-            # 重複判定
-            if not (end_pos <= existing_start or start_pos >= existing_end):
-                raise ValidationError('他の商品と配置が重複しています')
+        if segment.get_interval_index().overlaps(start_pos, end_pos, exclude_id=exclude_id):
+            raise ValidationError('他の商品と配置が重複しています')
         
         return True
     
@@ -66,3 +53,129 @@ class PlacementConstraints:
             )
         
         return True
+
+
+class BatchPlacementChecker:
+    """複数の配置候補を一括チェックする制約カーネル
+
+    棚の段・商品・配置を事前に読み込み、候補全体を NumPy 配列で判定する。
+    判定内容とエラーメッセージは ProductPlacement.clean() に合わせている。
+    """
+
+    def __init__(self, shelf_width, segments, products, indexes):
+        # segments: {段ID: 高さ}
+        # products: {商品ID: (幅, 高さ, 最小フェース, 最大フェース)}
+        # indexes: {段ID: SegmentIntervalIndex}
+        self.shelf_width = shelf_width
+
+        # 値の配列は末尾にNaNを1つ持ち、見つからないIDはそこを参照する
+        self.segment_keys = np.array(sorted(segments), dtype=np.int64)
+        self.segment_heights = np.append(
+            np.array([segments[key] for key in self.segment_keys], dtype=np.float64), np.nan
+        )
+
+        self.product_keys = np.array(sorted(products), dtype=np.int64)
+        product_rows = np.vstack([
+            np.array([products[key] for key in self.product_keys], dtype=np.float64).reshape(-1, 4),
+            np.full((1, 4), np.nan),
+        ])
+        self.product_widths = product_rows[:, 0]
+        self.product_heights = product_rows[:, 1]
+        self.product_min_faces = product_rows[:, 2]
+        self.product_max_faces = product_rows[:, 3]
+
+        self.indexes = {
+            segment_id: (
+                np.array(index.starts, dtype=np.float64),
+                np.array(index._max_end, dtype=np.float64),
+                np.array(index._max_id, dtype=np.int64),
+                np.array(index._second_end, dtype=np.float64),
+            )
+            for segment_id, index in indexes.items() if len(index)
+        }
+
+    @staticmethod
+    def _lookup(keys, values):
+        """IDの配列位置と存在フラグを取得（存在しないIDは末尾のNaNを指す）"""
+        positions = np.searchsorted(keys, values)
+        found = positions < len(keys)
+        found[found] = keys[positions[found]] == values[found]
+        return np.where(found, positions, len(keys)), found
+
+    def check(self, segment_ids, product_ids, x_positions, face_counts, exclude_ids=None):
+        """候補ごとの判定結果（valid, errors, 必要幅, 終了位置）を返す"""
+        segment_ids = np.asarray(segment_ids, dtype=np.int64)
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        x_positions = np.asarray(x_positions, dtype=np.float64)
+        face_counts = np.asarray(face_counts, dtype=np.int64)
+        if exclude_ids is None:
+            exclude_ids = np.full(len(segment_ids), -1, dtype=np.int64)
+        else:
+            exclude_ids = np.asarray(exclude_ids, dtype=np.int64)
+
+        segment_pos, segment_found = self._lookup(self.segment_keys, segment_ids)
+        product_pos, product_found = self._lookup(self.product_keys, product_ids)
+        checkable = segment_found & product_found
+
+        required_widths = self.product_widths[product_pos] * face_counts
+        end_positions = x_positions + required_widths
+
+        # NaNとの比較は常にFalseになるため、未解決の段・商品は各判定から外れる
+        # （X座標のNaN・無限大は比較では検出できないため個別に判定する）
+        non_finite = ~np.isfinite(x_positions)
+        non_positive = face_counts <= 0
+        too_few = face_counts < self.product_min_faces[product_pos]
+        too_many = face_counts > self.product_max_faces[product_pos]
+        too_tall = self.product_heights[product_pos] > self.segment_heights[segment_pos]
+        too_wide = end_positions > self.shelf_width
+
+        overlapping = np.zeros(len(segment_ids), dtype=bool)
+        for segment_id in np.unique(segment_ids[checkable]):
+            arrays = self.indexes.get(int(segment_id))
+            if arrays is None:
+                continue
+            starts, max_end, max_id, second_end = arrays
+            mask = checkable & (segment_ids == segment_id)
+
+            # 開始位置が終了位置より左にある配置の終了位置最大値で判定
+            count = np.searchsorted(starts, end_positions[mask], side='left')
+            last = np.maximum(count - 1, 0)
+            reach = np.where(max_id[last] == exclude_ids[mask], second_end[last], max_end[last])
+            overlapping[mask] = (count > 0) & (reach > x_positions[mask])
+
+        invalid = ~checkable | non_finite | non_positive | too_few | too_many | too_tall | too_wide | overlapping
+
+        results = []
+        for i in range(len(segment_ids)):
+            result = {
+                'valid': not invalid[i],
+                'errors': {},
+                'required_width': float(required_widths[i]) if np.isfinite(required_widths[i]) else None,
+                'end_position': float(end_positions[i]) if np.isfinite(end_positions[i]) else None,
+            }
+            if invalid[i]:
+                errors = {}
+                if not segment_found[i]:
+                    errors['segment'] = ['指定された段は指定された棚に属していません。']
+                if not product_found[i]:
+                    errors['product'] = ['指定された商品が見つかりません。']
+                if non_positive[i]:
+                    errors['face_count'] = ['値は0より大きい必要があります。']
+                elif too_many[i]:
+                    errors['face_count'] = [f'フェース数は{int(self.product_max_faces[product_pos[i]])}以下である必要があります。']
+                elif too_few[i]:
+                    errors['face_count'] = [f'フェース数は{int(self.product_min_faces[product_pos[i]])}以上である必要があります。']
+                if too_tall[i]:
+                    errors['product'] = [
+                        f'商品の高さ（{self.product_heights[product_pos[i]]}cm）が'
+                        f'段の高さ（{self.segment_heights[segment_pos[i]]}cm）を超えています。'
+                    ]
+                if non_finite[i]:
+                    errors['x_position'] = ['X座標は有限の数値である必要があります。']
+                elif overlapping[i]:
+                    errors['x_position'] = ['他の商品と配置が重複しています。']
+                elif too_wide[i]:
+                    errors['x_position'] = [f'配置位置が棚の幅（{self.shelf_width}cm）を超えています。']
+                result['errors'] = errors
+            results.append(result)
+        return results
@@ -264,7 +264,7 @@ class BulkPlacementForm(forms.Form):
     )
     
     target_segment = forms.ModelChoiceField(
-        queryset=ShelfSegment.objects.filter(is_active=True),
+        queryset=ShelfSegment.objects.filter(is_active=True).select_related('shelf'),
         widget=forms.Select(attrs={'class': 'form-select'}),
         label='配置先の段'
     )
@@ -295,7 +295,7 @@ class BulkPlacementForm(forms.Form):
             self.fields['target_segment'].queryset = ShelfSegment.objects.filter(
                 shelf=shelf,
                 is_active=True
-            ).order_by('level')
+            ).select_related('shelf').order_by('level')
 
     def clean(self):
         """一括配置のバリデーション"""
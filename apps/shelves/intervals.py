@@ -0,0 +1,107 @@
+# apps/shelves/intervals.py
+"""
+段内配置の区間インデックス
+"""
+from bisect import bisect_left, bisect_right
+
+# 空き区間の幅判定で許容する誤差(cm)
+GAP_TOLERANCE = 1e-9
+
+
+class SegmentIntervalIndex:
+    """段内の配置区間をx_position順に保持するインデックス
+
+    重複判定は開始位置の二分探索と終了位置の累積最大値で O(log n) で行う。
+    """
+
+    def __init__(self, entries=()):
+        # entries: (配置ID, X座標, 占有幅) のイテラブル
+        rows = sorted(entries, key=lambda entry: (entry[1], entry[0]))
+        self.ids = [row[0] for row in rows]
+        self.starts = [row[1] for row in rows]
+        self.ends = [row[1] + row[2] for row in rows]
+        self._build_prefix()
+
+    def _build_prefix(self):
+        """終了位置の累積最大値（1件除外用に次点も保持）を構築"""
+        self._max_end = []
+        self._max_id = []
+        self._second_end = []
+
+        best = second = float('-inf')
+        best_id = None
+        for placement_id, end in zip(self.ids, self.ends):
+            if end > best:
+                second = best
+                best, best_id = end, placement_id
+            elif end > second:
+                second = end
+            self._max_end.append(best)
+            self._max_id.append(best_id)
+            self._second_end.append(second)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def for_segment(cls, segment):
+        """段の有効な配置からインデックスを作成（1クエリ）"""
+        from .models import ProductPlacement
+
+        entries = ProductPlacement.objects.filter(
+            segment=segment,
+            is_active=True
+        ).order_by('x_position').values_list('id', 'x_position', 'occupied_width')
+        return cls(entries)
+
+    @classmethod
+    def for_shelf(cls, shelf):
+        """棚の全段のインデックスを段IDごとに作成（1クエリ）"""
+        from .models import ProductPlacement
+
+        grouped = {}
+        rows = ProductPlacement.objects.filter(
+            shelf=shelf,
+            is_active=True
+        ).order_by('x_position').values_list('segment_id', 'id', 'x_position', 'occupied_width')
+        for segment_id, placement_id, x_position, occupied_width in rows:
+            grouped.setdefault(segment_id, []).append((placement_id, x_position, occupied_width))
+        return {segment_id: cls(entries) for segment_id, entries in grouped.items()}
+
+    def overlaps(self, start, end, exclude_id=None):
+        """[start, end) が既存配置と重複するか判定"""
+        # 開始位置が end より左にある配置だけが重複候補
+        count = bisect_left(self.starts, end)
+        if count == 0:
+            return False
+
+        i = count - 1
+        if exclude_id is not None and self._max_id[i] == exclude_id:
+            reach = self._second_end[i]
+        else:
+            reach = self._max_end[i]
+        return reach > start
+
+    def has_start_between(self, low, high):
+        """開始位置が開区間 (low, high) に含まれる配置があるか判定"""
+        return bisect_right(self.starts, low) < bisect_left(self.starts, high)
+
+    def free_gaps(self, width, min_width=0.0):
+        """棚幅 width の中で配置のない区間 [(開始, 終了)] をX座標順に取得
+
+        min_width 未満の空き区間は除外する（誤差吸収のため微小な許容幅を持つ）。
+        """
+        gaps = []
+        reach = 0.0
+        for start, end in zip(self.starts, self.ends):
+            if start > reach:
+                gaps.append((reach, min(start, width)))
+            reach = max(reach, end)
+            if reach >= width:
+                break
+        if reach < width:
+            gaps.append((reach, width))
+        return [
+            (start, end) for start, end in gaps
+            if end > start and end - start + GAP_TOLERANCE >= min_width
+        ]
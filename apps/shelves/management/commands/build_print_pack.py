@@ -0,0 +1,57 @@
+# apps/shelves/management/commands/build_print_pack.py
+"""
+棚割り図の印刷パック生成コマンド
+"""
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from apps.shelves.models import Shelf
+from apps.shelves.services import ShelfPrintPackService
+
+
+class Command(BaseCommand):
+    help = '複数の棚の棚割り図を並列に描画し、1つのPDF（またはPNG/SVGのZIP）にまとめます'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='出力先のファイルパス')
+        parser.add_argument(
+            '--format',
+            choices=ShelfPrintPackService.FORMATS,
+            default='pdf',
+            help='出力形式（pdf: 1棚1ページのPDF, png/svg: 棚ごとの画像のZIP）'
+        )
+        parser.add_argument('--location', help='対象とする棚の設置場所')
+        parser.add_argument('--shelves', default='', help='対象とする棚ID（カンマ区切り、省略時は全棚）')
+        parser.add_argument('--workers', type=int, default=None, help='並列数（省略時はCPU数、1で並列化しない）')
+        parser.add_argument('--width', type=int, default=None, help='描画幅(px)')
+        parser.add_argument('--images', action='store_true', help='商品画像を描画する')
+
+    def handle(self, *args, **options):
+        queryset = Shelf.objects.filter(is_active=True)
+        if options['location']:
+            queryset = queryset.filter(location=options['location'])
+        if options['shelves']:
+            try:
+                shelf_ids = [int(value) for value in options['shelves'].split(',') if value.strip()]
+            except ValueError:
+                raise CommandError('棚IDの形式が正しくありません')
+            queryset = queryset.filter(pk__in=shelf_ids)
+
+        def progress(done, total, name):
+            self.stdout.write(f'[{done}/{total}] {name}')
+
+        try:
+            result = ShelfPrintPackService.build(
+                queryset,
+                options['output'],
+                fmt=options['format'],
+                workers=options['workers'],
+                width_px=options['width'],
+                show_images=options['images'],
+                progress=progress,
+            )
+        except ValidationError as e:
+            raise CommandError(' / '.join(e.messages))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['page_count']}棚の印刷パックを作成しました: {result['output']} ({result['size']:,} bytes)"
+        ))
@@ -0,0 +1,88 @@
+# apps/shelves/management/commands/clone_shelf_layout.py
+"""
+棚レイアウトの一括複製コマンド
+"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from apps.shelves.models import Shelf
+from apps.shelves.services import ShelfCloneService
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = '複製元の棚の段・配置を複数の棚へ一括で複製します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', type=int, help='複製元の棚ID')
+        parser.add_argument(
+            '--targets',
+            default='',
+            help='複製先の既存の棚ID（カンマ区切り）'
+        )
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=0,
+            help='新規作成する棚の数'
+        )
+        parser.add_argument(
+            '--name-prefix',
+            default='',
+            help='新規作成する棚の名前の接頭辞（省略時は複製元の棚名）'
+        )
+        parser.add_argument(
+            '--skip-overflow',
+            action='store_true',
+            help='棚幅に収まらない配置を除外して複製する（省略時はその棚への複製を中止）'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='一括作成の件数')
+        parser.add_argument('--user', help='作成者として記録するユーザー名')
+
+    def handle(self, *args, **options):
+        try:
+            source = Shelf.objects.get(pk=options['source'], is_active=True)
+        except Shelf.DoesNotExist:
+            raise CommandError(f"複製元の棚が見つかりません: {options['source']}")
+
+        try:
+            target_ids = [int(value) for value in options['targets'].split(',') if value.strip()]
+        except ValueError:
+            raise CommandError('複製先の棚IDの形式が正しくありません')
+        targets = Shelf.objects.filter(pk__in=target_ids, is_active=True).in_bulk()
+        missing = [target_id for target_id in target_ids if target_id not in targets]
+        if missing:
+            raise CommandError(f'複製先の棚が見つかりません: {missing}')
+
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"ユーザーが見つかりません: {options['user']}")
+
+        prefix = options['name_prefix'] or source.name
+        new_names = [f'{prefix} {number}' for number in range(1, options['count'] + 1)]
+
+        reports = ShelfCloneService.clone(
+            source,
+            user,
+            targets=[targets[target_id] for target_id in target_ids],
+            new_names=new_names,
+            skip_overflow=options['skip_overflow'],
+            batch_size=options['batch_size'],
+        )
+
+        for report in reports:
+            label = f"{report['name']} (ID: {report['shelf_id']}{', 新規' if report['created'] else ''})"
+            if report['success']:
+                message = f"{label}: {report['placement_count']}件を複製"
+                if report['skipped_count']:
+                    message += f"（棚幅超過で{report['skipped_count']}件を除外）"
+                self.stdout.write(message)
+            else:
+                self.stdout.write(self.style.ERROR(f"{label}: {' / '.join(report['errors'])}"))
+
+        succeeded = sum(report['success'] for report in reports)
+        self.stdout.write(
+            self.style.SUCCESS(f'{succeeded}/{len(reports)}棚への複製が完了しました')
+        )
@@ -0,0 +1,68 @@
+# apps/shelves/management/commands/import_shelf_layouts.py
+"""
+棚レイアウトの一括インポートコマンド
+"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from apps.shelves.services import ShelfLayoutImportService
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'エクスポートした棚レイアウト（JSON・NDJSON）を一括で取り込みます'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='取り込むファイル（JSON・NDJSON）')
+        parser.add_argument(
+            '--no-replace',
+            action='store_true',
+            help='棚名・設置場所が同じ棚があっても置き換えずに新規作成する'
+        )
+        parser.add_argument(
+            '--skip-invalid',
+            action='store_true',
+            help='不正な配置を除外して取り込む（省略時はその棚の取り込みを中止）'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='一括作成の件数')
+        parser.add_argument('--user', help='作成者として記録するユーザー名')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"ユーザーが見つかりません: {options['user']}")
+
+        total = succeeded = 0
+        for path in options['paths']:
+            try:
+                with open(path, 'rb') as file:
+                    reports = ShelfLayoutImportService.import_layouts(
+                        file,
+                        user,
+                        replace=not options['no_replace'],
+                        skip_invalid=options['skip_invalid'],
+                        batch_size=options['batch_size'],
+                    )
+            except OSError as e:
+                raise CommandError(f'ファイルを開けません: {e}')
+            except UnicodeDecodeError:
+                raise CommandError(f'ファイルはUTF-8で保存してください: {path}')
+
+            for report in reports:
+                label = f"{path}#{report['index']} {report['name']}"
+                if report['success']:
+                    message = (
+                        f"{label} (ID: {report['shelf_id']}{', 新規' if report['created'] else ''}): "
+                        f"{report['placement_count']}件を取り込み"
+                    )
+                    if report['skipped_count']:
+                        message += f"（不正な配置{report['skipped_count']}件を除外）"
+                    self.stdout.write(message)
+                else:
+                    self.stdout.write(self.style.ERROR(f"{label}: {' / '.join(report['errors'])}"))
+            total += len(reports)
+            succeeded += sum(report['success'] for report in reports)
+
+        self.stdout.write(self.style.SUCCESS(f'{succeeded}/{total}棚のレイアウトを取り込みました'))
@@ -0,0 +1,75 @@
+# apps/shelves/management/commands/repair_segment_counters.py
+"""
+段の配置集計（使用幅・配置数）の検証・修復コマンド
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from apps.shelves.models import Shelf, ShelfSegment, ProductPlacement
+
+# 浮動小数点の誤差として許容する幅(cm)
+TOLERANCE = 1e-6
+
+
+class Command(BaseCommand):
+    help = '段の使用幅・配置数と配置の占有幅のずれを検出して修復します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='ずれの検出のみ行い、修復しない'
+        )
+        parser.add_argument('--shelf', type=int, help='対象の棚ID（省略時は全棚）')
+
+    def handle(self, *args, **options):
+        placements = ProductPlacement.objects.order_by()
+        segments = ShelfSegment.objects.order_by()
+        if options['shelf']:
+            placements = placements.filter(shelf_id=options['shelf'])
+            segments = segments.filter(shelf_id=options['shelf'])
+
+        # 配置の占有幅（商品幅×フェース数）のずれ
+        stale_placements = []
+        rows = placements.select_related('product').only(
+            'id', 'segment', 'face_count', 'occupied_width', 'product__width'
+        )
+        for placement in rows.iterator(chunk_size=2000):
+            expected = placement.product.width * placement.face_count
+            if abs(placement.occupied_width - expected) > TOLERANCE:
+                placement.occupied_width = expected
+                stale_placements.append(placement)
+
+        # 段の集計のずれ
+        actual = {
+            row['segment']: (row['used_width'], row['placement_count'])
+            for row in placements.filter(is_active=True).values('segment').annotate(
+                used_width=Sum('occupied_width'),
+                placement_count=Count('id'),
+            )
+        }
+        drifted = set()
+        for segment_id, used_width, placement_count in segments.values_list(
+            'id', 'used_width', 'active_placement_count'
+        ):
+            expected_width, expected_count = actual.get(segment_id, (0, 0))
+            if abs(used_width - expected_width) > TOLERANCE or placement_count != expected_count:
+                drifted.add(segment_id)
+        drifted |= {placement.segment_id for placement in stale_placements}
+
+        self.stdout.write(f'占有幅のずれ: {len(stale_placements)}件')
+        self.stdout.write(f'集計のずれがある段: {len(drifted)}件')
+
+        if options['check'] or not drifted:
+            return
+
+        with transaction.atomic():
+            ProductPlacement.objects.bulk_update(stale_placements, ['occupied_width'], batch_size=1000)
+            ShelfSegment.refresh_placement_counters(drifted)
+            Shelf.objects.filter(segments__in=drifted).update(
+                layout_revision=F('layout_revision') + 1
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(f'{len(drifted)}段の集計を修復しました')
+        )
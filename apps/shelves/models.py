@@ -1,11 +1,15 @@
 """
 棚・陳列管理モデル
 """
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Func, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
-from apps.core.models import BaseModel
+from apps.core.models import BaseModel, Counter
 from apps.core.validators import validate_dimension, validate_positive_integer
 from apps.products.models import Product
+from .intervals import SegmentIntervalIndex
+from .snapshots import encode_layout, decode_layout
 
 
 class Shelf(BaseModel):
@@ -23,15 +27,60 @@ class Shelf(BaseModel):
     )
     location = models.CharField('設置場所', max_length=200, blank=True)
     description = models.TextField('説明', blank=True)
+    layout_revision = models.PositiveIntegerField(
+        'レイアウト版数',
+        default=0,
+        editable=False,
+        help_text='段・配置の変更ごとに自動で加算'
+    )
+
+    counter_name = Counter.SHELVES
 
     class Meta:
         verbose_name = '棚'
         verbose_name_plural = '棚'
         ordering = ['name']
+        indexes = [
+            # 一覧の棚幅での絞り込み用
+            models.Index(fields=['width']),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.width}×{self.depth}cm)"
 
+    # 棚割り図に描画される項目（変更時はレイアウト版数を加算し、棚割り図のキャッシュ・ETagを更新する）
+    DRAWN_FIELDS = ('name', 'width')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 棚名・幅の変更を検知するため、読み込み時の値を記録
+        instance._loaded_drawn = {name: instance.__dict__.get(name) for name in cls.DRAWN_FIELDS}
+        return instance
+
+    def save(self, *args, **kwargs):
+        """既存の棚の棚名・幅が変わった場合はレイアウト版数を加算"""
+        loaded = getattr(self, '_loaded_drawn', None)
+        update_fields = kwargs.get('update_fields')
+        drawn_changed = (
+            not self._state.adding
+            and loaded is not None
+            and any(
+                loaded[name] is not None and loaded[name] != getattr(self, name)
+                and (update_fields is None or name in update_fields)
+                for name in self.DRAWN_FIELDS
+            )
+        )
+        if drawn_changed:
+            self.layout_revision = models.F('layout_revision') + 1
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'layout_revision'}
+
+        super().save(*args, **kwargs)
+        if drawn_changed:
+            self.refresh_from_db(fields=['layout_revision'])
+        self._loaded_drawn = {name: getattr(self, name) for name in self.DRAWN_FIELDS}
+
     @property
     def total_height(self):
         """棚の総高さ"""
@@ -42,15 +91,28 @@ class Shelf(BaseModel):
         """段数"""
         return self.segments.count()
 
+    @classmethod
+    def bump_layout_revision(cls, shelf_id):
+        """レイアウト版数を加算"""
+        cls.objects.filter(pk=shelf_id).update(layout_revision=models.F('layout_revision') + 1)
+
+    @classmethod
+    def bump_layout_revisions(cls, **placement_filter):
+        """条件に合う有効な配置を持つ棚のレイアウト版数を加算（1クエリ）
+
+        例: Shelf.bump_layout_revisions(product=product)
+        """
+        shelf_ids = ProductPlacement.objects.filter(
+            is_active=True,
+            **placement_filter
+        ).order_by().values('shelf_id')
+        cls.objects.filter(pk__in=shelf_ids).update(layout_revision=models.F('layout_revision') + 1)
+
     def get_available_width(self, segment_level):
         """指定段の利用可能幅を計算"""
         try:
             segment = self.segments.get(level=segment_level)
-            used_width = sum(
-                placement.occupied_width 
-                for placement in segment.placements.all()
-            )
-            return self.width - used_width
+            return self.width - segment.used_width
         except ShelfSegment.DoesNotExist:
             return 0
 
@@ -78,6 +140,23 @@ class ShelfSegment(BaseModel):
         editable=False,
         help_text='自動計算される床からの高さ'
     )
+    used_width = models.FloatField(
+        '使用幅(cm)',
+        default=0,
+        editable=False,
+        help_text='有効な配置の占有幅合計（自動集計）'
+    )
+    active_placement_count = models.PositiveIntegerField(
+        '配置数',
+        default=0,
+        editable=False,
+        help_text='有効な配置の件数（自動集計）'
+    )
+
+    # 配置の保存時にのみ更新する集計フィールド
+    COUNTER_FIELDS = ('used_width', 'active_placement_count')
+
+    counter_name = Counter.SEGMENTS
 
     class Meta:
         verbose_name = '段'
@@ -88,49 +167,72 @@ class ShelfSegment(BaseModel):
     def __str__(self):
         return f"{self.shelf.name} - 段{self.level}"
 
-    def save(self, *args, **kwargs):
-        """保存時にy_positionを自動計算"""
-        if self.level == 1:
+    def save(self, *args, reflow=True, **kwargs):
+        """保存時にy_positionを自動計算し、レイアウト版数を加算
+
+        reflow=False の場合は呼び出し側で同じトランザクション内でまとめて
+        ShelfService.reflow_segment_positions() を実行する
+        """
+        if self.y_position is None:
             self.y_position = 0
-        else:
-            # 下の段までの累積高さを計算
-            lower_segments = ShelfSegment.objects.filter(
-                shelf=self.shelf,
-                level__lt=self.level,
-                is_active=True
-            ).order_by('level')
-            self.y_position = sum(seg.height for seg in lower_segments)
         
-        super().save(*args, **kwargs)
+        # 集計フィールドは古い値で上書きしないよう更新対象から外す
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
         
-        # 上位の段のy_positionも更新
-        self._update_upper_segments()
-
-    def _update_upper_segments(self):
-        """上位段のy_positionを更新"""
-        upper_segments = ShelfSegment.objects.filter(
-            shelf=self.shelf,
-            level__gt=self.level,
+        # 再計算した位置と版数を同じトランザクションで確定し、新しい版数で古い位置がキャッシュされないようにする
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if reflow:
+                from .services import ShelfService
+                positions = ShelfService.reflow_segment_positions(self.shelf)
+                self.y_position = positions.get(self.pk, self.y_position)
+            Shelf.bump_layout_revision(self.shelf_id)
+                    
+    @classmethod
+    def refresh_placement_counters(cls, segment_ids):
+        """指定段の使用幅・配置数を配置から再集計（2クエリ）
+
+        再集計前の配置数との差を配置数の集計値（Counter）に反映するため、
+        配置を作成・論理削除・復元した処理は対象の段を必ずこのメソッドで再集計する。
+        """
+        segment_ids = list(segment_ids)
+        if not segment_ids:
+            return
+        active = ProductPlacement.objects.filter(
+            segment=OuterRef('pk'),
             is_active=True
-        ).order_by('level')
+        ).order_by().values('segment')
         
-        for segment in upper_segments:
-            lower_segments = ShelfSegment.objects.filter(
-                shelf=self.shelf,
-                level__lt=segment.level,
-                is_active=True
-            ).order_by('level')
-            segment.y_position = sum(seg.height for seg in lower_segments)
-            ShelfSegment.objects.filter(id=segment.id).update(y_position=segment.y_position)
-                    
+        # 配置数の増減 = 配置の件数 - 再集計前の段の配置数の合計
+        Counter.add_expression(Counter.PLACEMENTS, Subquery(
+            ProductPlacement.objects.filter(segment_id__in=segment_ids, is_active=True).order_by()
+            .annotate(total=Func('id', function='COUNT')).values('total')
+        ) - Subquery(
+            cls.objects.filter(pk__in=segment_ids).order_by()
+            .annotate(total=Coalesce(Func('active_placement_count', function='SUM'), 0))
+            .values('total')
+        ))
+        cls.objects.filter(pk__in=segment_ids).update(
+            used_width=Coalesce(
+                Subquery(active.annotate(total=Sum('occupied_width')).values('total')),
+                0.0,
+                output_field=models.FloatField()
+            ),
+            active_placement_count=Coalesce(
+                Subquery(active.annotate(total=Count('id')).values('total')),
+                0,
+                output_field=models.IntegerField()
+            ),
+        )
+
     @property
     def available_width(self):
         """利用可能幅"""
-        used_width = sum(
-            placement.occupied_width 
-            for placement in self.placements.all()
-        )
-        return self.shelf.width - used_width
+        return self.shelf.width - self.used_width
 
     def can_place_product(self, product, face_count=1):
         """商品が配置可能かチェック"""
@@ -145,6 +247,16 @@ class ShelfSegment(BaseModel):
         
         return True, "配置可能"
 
+    def get_interval_index(self):
+        """配置区間インデックス（インスタンス単位でキャッシュ）"""
+        if '_interval_index' not in self.__dict__:
+            self.__dict__['_interval_index'] = SegmentIntervalIndex.for_segment(self)
+        return self.__dict__['_interval_index']
+
+    def clear_interval_index(self):
+        """キャッシュ済みの配置区間インデックスを破棄"""
+        self.__dict__.pop('_interval_index', None)
+
 
 class ProductPlacement(BaseModel):
     """商品配置"""
@@ -194,10 +306,36 @@ class ProductPlacement(BaseModel):
     def __str__(self):
         return f"{self.product.name} - {self.segment} ({self.face_count}面)"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 段の移動時に移動元の集計も更新するため、読み込み時の段を記録
+        instance._loaded_segment_id = instance.__dict__.get('segment_id')
+        return instance
+
     def save(self, *args, **kwargs):
-        """保存時に占有幅を自動計算"""
+        """保存時に占有幅を自動計算し、段の集計を更新"""
         self.occupied_width = self.product.width * self.face_count
-        super().save(*args, **kwargs)
+        segment_ids = {self.segment_id, getattr(self, '_loaded_segment_id', None)} - {None}
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            ShelfSegment.refresh_placement_counters(segment_ids)
+            Shelf.bump_layout_revision(self.shelf_id)
+        
+        self._loaded_segment_id = self.segment_id
+        self.segment.clear_interval_index()
+
+    @classmethod
+    def sync_product_width(cls, product):
+        """商品幅の変更を配置の占有幅と段の集計に反映"""
+        placements = cls.objects.filter(product=product).order_by()
+        placements.update(occupied_width=models.F('face_count') * product.width)
+        
+        affected = set(placements.filter(is_active=True).values_list('segment_id', flat=True))
+        if affected:
+            ShelfSegment.refresh_placement_counters(affected)
+            Shelf.bump_layout_revisions(product=product)
 
     def clean(self):
         """モデルレベルのバリデーション"""
@@ -235,27 +373,91 @@ class ProductPlacement(BaseModel):
         new_start = self.x_position
         new_end = self.x_position + (self.product.width * self.face_count)
         
-        # 同じ段の他の配置をチェック
-        other_placements = ProductPlacement.objects.filter(
-            segment=self.segment,
-            is_active=True
+        # 同じ段の配置インデックスで判定（自分自身は除外）
+        return self.segment.get_interval_index().overlaps(
+            new_start, new_end, exclude_id=self.pk
         )
-        
-        # 自分自身を除外
-        if self.pk:
-            other_placements = other_placements.exclude(pk=self.pk)
-        
-        for placement in other_placements:
-            existing_start = placement.x_position
-            existing_end = placement.x_position + placement.occupied_width
-            
-            # 重複判定
-            if not (new_end <= existing_start or new_start >= existing_end):
-                return True
-        
-        return False
 
     @property
     def end_position(self):
         """終了位置（X座標 + 占有幅）"""
-        return self.x_position + self.occupied_width
\ No newline at end of file
+        return self.x_position + self.occupied_width
+
+class ShelfLayoutSnapshot(BaseModel):
+    """棚レイアウトのスナップショット（段・配置を圧縮して1行に保存）"""
+    shelf = models.ForeignKey(
+        Shelf,
+        on_delete=models.CASCADE,
+        related_name='snapshots',
+        verbose_name='棚'
+    )
+    name = models.CharField('名称', max_length=100, blank=True)
+    revision = models.PositiveIntegerField(
+        'レイアウト版数',
+        editable=False,
+        help_text='取得時点の棚のレイアウト版数'
+    )
+    segment_count = models.PositiveIntegerField('段数', editable=False)
+    placement_count = models.PositiveIntegerField('配置数', editable=False)
+    data = models.BinaryField('レイアウトデータ', editable=False)
+
+    class Meta:
+        verbose_name = 'レイアウトスナップショット'
+        verbose_name_plural = 'レイアウトスナップショット'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['shelf', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.shelf.name} - {self.name or self.created_at:%Y/%m/%d %H:%M}"
+
+    @staticmethod
+    def read_layout(shelf):
+        """棚の有効な段・配置を読み込み（段と配置を外部結合した1クエリ）
+
+        戻り値: (棚のレイアウト版数, [(段番号, 高さ)], [(段番号, 商品ID, X座標, フェース数)])
+        """
+        rows = ShelfSegment.objects.filter(
+            shelf=shelf,
+            is_active=True
+        ).annotate(
+            active_placements=models.FilteredRelation(
+                'placements',
+                condition=models.Q(placements__is_active=True)
+            )
+        ).order_by().values_list(
+            'shelf__layout_revision', 'level', 'height',
+            'active_placements__product_id', 'active_placements__x_position',
+            'active_placements__face_count'
+        )
+
+        revision = None
+        segments = {}
+        placements = []
+        for revision, level, height, product_id, x_position, face_count in rows:
+            segments[level] = height
+            if product_id is not None:
+                placements.append((level, product_id, x_position, face_count))
+        if revision is None:
+            revision = shelf.layout_revision
+        return revision, sorted(segments.items()), placements
+
+    @classmethod
+    def capture(cls, shelf, user=None, name=''):
+        """現在のレイアウトのスナップショットを作成"""
+        revision, segments, placements = cls.read_layout(shelf)
+        return cls.objects.create(
+            shelf=shelf,
+            name=name,
+            revision=revision,
+            segment_count=len(segments),
+            placement_count=len(placements),
+            data=encode_layout(segments, placements),
+            created_by=user,
+            updated_by=user
+        )
+
+    def decode(self):
+        """保存したレイアウトを復元（decode_layout の形式）"""
+        return decode_layout(self.data)
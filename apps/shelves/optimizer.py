@@ -0,0 +1,316 @@
+# apps/shelves/optimizer.py
+"""
+棚レイアウト最適化エンジン
+
+DBアクセスを行わず、棚幅・段・商品の数値データのみで配置を探索する。
+"""
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# 段幅の丸め誤差で棚幅を超えないようにするための余裕(cm)
+WIDTH_MARGIN = 1e-6
+
+# フェース配分の評価重み
+FACING_WEIGHTS = {
+    'fill': 1.0,    # 空き幅の充填率
+    'under': 1.0,   # 推奨フェース数を下回る場合のペナルティ（推奨数比）
+    'over': 0.05,   # 推奨フェース数を上回る場合のペナルティ（推奨数比）
+    'drop': 10.0,   # 最小フェース数も置けず配置できない場合のペナルティ
+}
+
+
+class LayoutOptimizer:
+    """商品の段割り当てとフェース数を焼きなまし法で探索するエンジン
+
+    segments: [(段ID, 高さ)]
+    products: [(商品ID, 幅, 高さ, 最小フェース, 最大フェース, 推奨フェース, 自社商品)]
+    """
+
+    DEFAULT_WEIGHTS = {
+        'fill': 1.0,         # 棚の充填率
+        'recommended': 0.3,  # 推奨フェース数への近さ
+        'own': 0.2,          # 自社商品の棚占有率
+    }
+    # 評価重みの上限（負の重みは焼きなましの温度を負にし、過大な重みは評価値を無限大にする）
+    MAX_WEIGHT = 100.0
+
+    def __init__(self, shelf_width, segments, products, weights=None):
+        self.shelf_width = float(shelf_width)
+        self.capacity = self.shelf_width - WIDTH_MARGIN
+        self.segments = list(segments)
+        self.products = list(products)
+        self.weights = dict(self.DEFAULT_WEIGHTS, **(weights or {}))
+        if not all(math.isfinite(w) and 0 <= w <= self.MAX_WEIGHT for w in self.weights.values()):
+            raise ValueError(f'評価重みは0以上{self.MAX_WEIGHT:g}以下の値である必要があります')
+
+        total_width = self.shelf_width * max(len(self.segments), 1)
+        product_count = max(len(self.products), 1)
+
+        # 商品ごとの配置可能な段と、フェース数ごとの評価値
+        self.eligible = []
+        self.values = []
+        for _, width, height, min_faces, max_faces, recommended, is_own in self.products:
+            self.eligible.append([
+                s for s, (_, segment_height) in enumerate(self.segments)
+                if height <= segment_height and min_faces <= max_faces
+                and width * min_faces <= self.capacity
+            ])
+            values = {}
+            for faces in range(min_faces, max_faces + 1):
+                share = width * faces / total_width
+                deviation = min(abs(faces - recommended) / max(recommended, 1), 1.0)
+                values[faces] = (
+                    self.weights['fill'] * share
+                    + (self.weights['own'] * share if is_own else 0.0)
+                    + self.weights['recommended'] * (1.0 - deviation) / product_count
+                )
+            self.values.append(values)
+
+    def run(self, time_budget=1.0, seed=None):
+        """時間予算内で探索し、最良の配置結果を返す"""
+        if not math.isfinite(time_budget) or time_budget < 0:
+            # NaN・無限大では探索の終了時刻に到達しないため受け付けない
+            raise ValueError('時間予算は0以上の有限の値である必要があります')
+        rng = random.Random(seed)
+        deadline = time.perf_counter() + time_budget
+
+        assign, faces, used = self._initial_state(rng)
+        score = sum(self.values[i][faces[i]] for i in range(len(self.products)) if assign[i] >= 0)
+        best = (score, list(assign), list(faces))
+
+        placeable = [i for i in range(len(self.products)) if self.eligible[i]]
+        if not placeable:
+            return self._build_result(*best, iterations=0)
+
+        # 初期温度は商品1件あたりの平均評価値を目安にする
+        temperature0 = 0.5 * sum(max(v.values(), default=0.0) for v in self.values) / len(self.values)
+        temperature = temperature0 + 1e-12
+        started = time.perf_counter()
+        iterations = 0
+
+        while True:
+            iterations += 1
+            if iterations % 256 == 0:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                progress = (now - started) / max(deadline - started, 1e-9)
+                temperature = temperature0 * (1.0 - progress) + 1e-12
+
+            delta = self._random_move(rng, placeable, assign, faces, used, temperature)
+            if delta is None:
+                continue
+            score += delta
+            if score > best[0] + 1e-12:
+                best = (score, list(assign), list(faces))
+
+        return self._build_result(*best, iterations=iterations)
+
+    def _initial_state(self, rng):
+        """評価値の高い順に貪欲に詰めた初期解"""
+        count = len(self.products)
+        assign = [-1] * count
+        faces = [0] * count
+        used = [0.0] * len(self.segments)
+
+        order = sorted(
+            range(count),
+            key=lambda i: -max(self.values[i].values(), default=0.0) * (0.9 + 0.2 * rng.random())
+        )
+        for i in order:
+            _, width, _, min_faces, max_faces, recommended, _ = self.products[i]
+            segments = sorted(self.eligible[i], key=lambda s: used[s])
+            for s in segments:
+                room = self.capacity - used[s]
+                fit = min(max(recommended, min_faces), max_faces, int(room // width))
+                if fit >= min_faces:
+                    assign[i], faces[i] = s, fit
+                    used[s] += width * fit
+                    break
+        return assign, faces, used
+
+    def _accept(self, rng, delta, temperature):
+        return delta >= 0 or rng.random() < math.exp(delta / temperature)
+
+    def _random_move(self, rng, placeable, assign, faces, used, temperature):
+        """近傍操作を1つ試し、採用した場合は評価値の差分を返す"""
+        i = rng.choice(placeable)
+        _, width, _, min_faces, max_faces, _, _ = self.products[i]
+        s = assign[i]
+        move = rng.random()
+
+        if s < 0:
+            # 未配置商品の挿入
+            target = rng.choice(self.eligible[i])
+            if used[target] + width * min_faces > self.capacity:
+                return None
+            delta = self.values[i][min_faces]
+            if not self._accept(rng, delta, temperature):
+                return None
+            assign[i], faces[i] = target, min_faces
+            used[target] += width * min_faces
+            return delta
+
+        if move < 0.5:
+            # フェース数の増減
+            new_faces = faces[i] + (1 if rng.random() < 0.5 else -1)
+            if not min_faces <= new_faces <= max_faces:
+                return None
+            diff = width * (new_faces - faces[i])
+            if used[s] + diff > self.capacity:
+                return None
+            delta = self.values[i][new_faces] - self.values[i][faces[i]]
+            if not self._accept(rng, delta, temperature):
+                return None
+            faces[i] = new_faces
+            used[s] += diff
+            return delta
+
+        if move < 0.65:
+            # 配置の取り外し
+            delta = -self.values[i][faces[i]]
+            if not self._accept(rng, delta, temperature):
+                return None
+            used[s] -= width * faces[i]
+            assign[i], faces[i] = -1, 0
+            return delta
+
+        if move < 0.85:
+            # 別の段への移動（評価値は変わらない）
+            target = rng.choice(self.eligible[i])
+            occupied = width * faces[i]
+            if target == s or used[target] + occupied > self.capacity:
+                return None
+            used[s] -= occupied
+            used[target] += occupied
+            assign[i] = target
+            return 0.0
+
+        # 別の段の商品との入れ替え（評価値は変わらない）
+        j = rng.choice(placeable)
+        t = assign[j]
+        if t < 0 or t == s or t not in self.eligible[i] or s not in self.eligible[j]:
+            return None
+        occupied_i = width * faces[i]
+        occupied_j = self.products[j][1] * faces[j]
+        if used[s] - occupied_i + occupied_j > self.capacity or used[t] - occupied_j + occupied_i > self.capacity:
+            return None
+        used[s] += occupied_j - occupied_i
+        used[t] += occupied_i - occupied_j
+        assign[i], assign[j] = t, s
+        return 0.0
+
+    def _build_result(self, score, assign, faces, iterations):
+        """段ごとに商品リスト順で左詰めしたX座標を付けて結果を返す"""
+        placements = []
+        used_width = 0.0
+        for s, (segment_id, _) in enumerate(self.segments):
+            x_position = 0.0
+            for i, product in enumerate(self.products):
+                if assign[i] != s:
+                    continue
+                placements.append({
+                    'segment_id': segment_id,
+                    'product_id': product[0],
+                    'x_position': x_position,
+                    'face_count': faces[i],
+                })
+                x_position += product[1] * faces[i]
+            used_width += x_position
+
+        total_width = self.shelf_width * max(len(self.segments), 1)
+        return {
+            'score': score,
+            'fill_ratio': used_width / total_width,
+            'placements': placements,
+            'unplaced_product_ids': [p[0] for i, p in enumerate(self.products) if assign[i] < 0],
+            'iterations': iterations,
+        }
+
+
+def _run_start(args):
+    """プロセスプール用の1試行"""
+    shelf_width, segments, products, weights, time_budget, seed = args
+    return LayoutOptimizer(shelf_width, segments, products, weights).run(time_budget, seed)
+
+
+def optimize_layout(shelf_width, segments, products, weights=None, time_budget=2.0,
+                    starts=1, workers=None, seed=None):
+    """棚レイアウトを最適化（starts > 1 の場合はプロセスプールで多点探索）"""
+    seeds = [None if seed is None else seed + n for n in range(max(starts, 1))]
+    if len(seeds) == 1:
+        return _run_start((shelf_width, segments, products, weights, time_budget, seeds[0]))
+
+    workers = min(len(seeds), workers or os.cpu_count() or 1)
+    # 全試行が時間予算内に終わるよう、ワーカー数に応じて1試行あたりの時間を配分
+    rounds = math.ceil(len(seeds) / workers)
+    tasks = [
+        (shelf_width, segments, products, weights, time_budget / rounds, s)
+        for s in seeds
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_run_start, tasks))
+    return max(results, key=lambda result: result['score'])
+
+
+def allocate_facings(free_width, products, weights=None):
+    """段の空き幅に対して全商品のフェース数をまとめて決定（有界ナップサックDP）
+
+    幅はミリ単位の整数に変換して扱う。products の並び順は優先度を表し、
+    最小フェース数の合計が空き幅を超える場合は後ろの商品から配置対象外にする。
+
+    products: [(商品ID, 幅cm, 最小フェース, 最大フェース, 推奨フェース)]
+    戻り値: {'facings': [(商品ID, フェース数)], 'used_width': cm, 'free_width': cm}
+    """
+    weights = dict(FACING_WEIGHTS, **(weights or {}))
+    capacity = max(int(math.floor(free_width * 10 + 1e-9)), 0)
+    count = len(products)
+
+    # dp[c]: 使用幅 c mm 以内で得られる最大評価値
+    dp = np.zeros(capacity + 1)
+    choices = np.zeros((count, capacity + 1), dtype=np.int16)
+
+    for i, (_, width, min_faces, max_faces, recommended) in enumerate(products):
+        width_mm = max(int(math.ceil(width * 10 - 1e-9)), 1)
+        recommended = max(recommended, 1)
+
+        # 配置しない場合（優先度の低い商品ほどペナルティを小さくする）
+        best = dp - weights['drop'] * (1.0 + (count - i) / count)
+        choice = np.zeros(capacity + 1, dtype=np.int16)
+
+        for faces in range(max(min_faces, 1), max_faces + 1):
+            required = width_mm * faces
+            if required > capacity:
+                break
+            value = (
+                weights['fill'] * required / max(capacity, 1)
+                - weights['under'] * max(recommended - faces, 0) / recommended
+                - weights['over'] * max(faces - recommended, 0) / recommended
+            )
+            candidate = np.full(capacity + 1, -np.inf)
+            candidate[required:] = dp[:capacity + 1 - required] + value
+            improved = candidate > best
+            best = np.where(improved, candidate, best)
+            choice[improved] = faces
+
+        dp = best
+        choices[i] = choice
+
+    # 復元
+    facings = [0] * count
+    remaining = capacity
+    for i in range(count - 1, -1, -1):
+        faces = int(choices[i][remaining])
+        facings[i] = faces
+        remaining -= max(int(math.ceil(products[i][1] * 10 - 1e-9)), 1) * faces
+
+    return {
+        'facings': [(product[0], faces) for product, faces in zip(products, facings)],
+        'used_width': sum(product[1] * faces for product, faces in zip(products, facings)),
+        'free_width': free_width,
+    }
@@ -0,0 +1,142 @@
+# apps/shelves/printing.py
+"""
+印刷パック用のPDF書き出し
+
+ページ（画像1枚）を受け取るたびにファイルへ書き出すため、ページ数によらずメモリ使用量は一定。
+Pillow の PDF 保存は全ページを保持するか、追記のたびに既存ファイルを解析し直すため使用しない。
+"""
+import zlib
+
+# A4横(pt)
+PAGE_SIZE = (842, 595)
+PAGE_MARGIN = 28
+
+
+def _pdf_text(value):
+    """PDFのテキスト文字列（UTF-16BE、日本語のしおり名に対応）"""
+    return '<FEFF' + value.encode('utf-16-be').hex().upper() + '>'
+
+
+def encode_page(image):
+    """ページ画像を (幅, 高さ, Flate圧縮したRGB) に変換（ワーカープロセス側で実行できる）"""
+    image = image.convert('RGB')
+    return image.width, image.height, zlib.compress(image.tobytes(), 6)
+
+
+class PdfImageWriter:
+    """画像を1ページずつ追記するPDFライター
+
+    with PdfImageWriter(file) as writer:
+        writer.add_page(image, title='棚A')
+    """
+
+    # 1: カタログ, 2: ページツリー, 3: しおり（close() で書き出す）
+    CATALOG, PAGES, OUTLINES = 1, 2, 3
+
+    def __init__(self, file, page_size=PAGE_SIZE, margin=PAGE_MARGIN):
+        self.file = file
+        self.page_size = page_size
+        self.margin = margin
+        self.offsets = {}
+        self.pages = []
+        self.titles = []
+        self.position = 0
+        self.next_number = 4
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+
+    def _write(self, data):
+        self.file.write(data)
+        self.position += len(data)
+
+    def _allocate(self):
+        number = self.next_number
+        self.next_number += 1
+        return number
+
+    def _object(self, number, body, stream=None):
+        self.offsets[number] = self.position
+        self._write(f'{number} 0 obj\n'.encode())
+        self._write(body.encode() if isinstance(body, str) else body)
+        if stream is not None:
+            self._write(b'\nstream\n')
+            self._write(stream)
+            self._write(b'\nendstream')
+        self._write(b'\nendobj\n')
+
+    def add_page(self, image, title=''):
+        """画像を余白付きでページ中央に収めて追記"""
+        self.add_encoded_page(*encode_page(image), title=title)
+
+    def add_encoded_page(self, image_width, image_height, data, title=''):
+        """encode_page() で変換済みの画像をページとして追記"""
+        page_width, page_height = self.page_size
+        scale = min(
+            (page_width - self.margin * 2) / image_width,
+            (page_height - self.margin * 2) / image_height,
+        )
+        width, height = image_width * scale, image_height * scale
+        x, y = (page_width - width) / 2, (page_height - height) / 2
+
+        image_number, content_number, page_number = self._allocate(), self._allocate(), self._allocate()
+        self._object(
+            image_number,
+            f'<< /Type /XObject /Subtype /Image /Width {image_width} /Height {image_height} '
+            f'/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode /Length {len(data)} >>',
+            data
+        )
+        content = f'q {width:.2f} 0 0 {height:.2f} {x:.2f} {y:.2f} cm /Im0 Do Q'.encode()
+        self._object(content_number, f'<< /Length {len(content)} >>', content)
+        self._object(
+            page_number,
+            f'<< /Type /Page /Parent {self.PAGES} 0 R /MediaBox [0 0 {page_width} {page_height}] '
+            f'/Resources << /XObject << /Im0 {image_number} 0 R >> >> /Contents {content_number} 0 R >>'
+        )
+        self.pages.append(page_number)
+        self.titles.append(title)
+
+    def _write_outlines(self):
+        """ページごとのしおり（目次）を書き出す"""
+        items = [self._allocate() for _ in self.pages]
+        for index, (number, page, title) in enumerate(zip(items, self.pages, self.titles)):
+            links = ''
+            if index:
+                links += f' /Prev {items[index - 1]} 0 R'
+            if index < len(items) - 1:
+                links += f' /Next {items[index + 1]} 0 R'
+            self._object(
+                number,
+                f'<< /Title {_pdf_text(title or str(index + 1))} /Parent {self.OUTLINES} 0 R'
+                f'{links} /Dest [{page} 0 R /Fit] >>'
+            )
+        if items:
+            self._object(
+                self.OUTLINES,
+                f'<< /Type /Outlines /First {items[0]} 0 R /Last {items[-1]} 0 R /Count {len(items)} >>'
+            )
+        else:
+            self._object(self.OUTLINES, '<< /Type /Outlines /Count 0 >>')
+
+    def close(self):
+        """ページツリー・しおり・相互参照表を書き出してPDFを完成させる"""
+        kids = ' '.join(f'{number} 0 R' for number in self.pages)
+        self._object(self.PAGES, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>')
+        self._write_outlines()
+        self._object(
+            self.CATALOG,
+            f'<< /Type /Catalog /Pages {self.PAGES} 0 R /Outlines {self.OUTLINES} 0 R /PageMode /UseOutlines >>'
+        )
+
+        xref = self.position
+        lines = [f'xref\n0 {self.next_number}\n', '0000000000 65535 f \n']
+        lines += [f'{self.offsets[number]:010d} 00000 n \n' for number in range(1, self.next_number)]
+        self._write(''.join(lines).encode())
+        self._write(
+            f'trailer\n<< /Size {self.next_number} /Root {self.CATALOG} 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+        )
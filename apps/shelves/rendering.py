@@ -0,0 +1,195 @@
+# apps/shelves/rendering.py
+"""
+棚割り図（プラノグラム）のサーバーサイド描画
+
+ShelfService.get_layout_payload() の結果から描画するため、DBアクセスを行わない。
+"""
+import io
+from xml.sax.saxutils import escape, quoteattr
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageDraw, ImageFont
+
+# 配色（static/css/shelf-layout.css と合わせる）
+COLORS = {
+    'background': '#f8f9fa',
+    'segment': '#ffffff',
+    'segment_border': '#adb5bd',
+    'own': '#d4edda',
+    'own_border': '#28a745',
+    'competitor': '#fff3cd',
+    'competitor_border': '#e0a800',
+    'text': '#212529',
+    'face_line': '#6c757d',
+}
+
+# 段と段の間に描く棚板の厚さ(cm)
+BOARD_THICKNESS = 1.0
+
+# PNGの最大幅(px)
+MAX_PNG_WIDTH = 4000
+
+
+def _iter_boxes(payload, total_height):
+    """段・配置の描画位置(cm、左上原点)を順に返す"""
+    for data in payload['segments']:
+        segment = data['segment']
+        floor = total_height - segment['y_position']
+        top = floor - segment['height']
+        placements = []
+        for placement in data['placements']:
+            product = placement['product']
+            height = min(product['height'], segment['height'])
+            placements.append((placement, floor - height, height))
+        yield segment, top, floor, placements
+
+
+def _label(placement, width, font_size):
+    """配置幅に収まるよう商品名を切り詰める（全角1文字を font_size 幅として概算）"""
+    name = placement['product']['name']
+    limit = max(int(width / font_size), 0)
+    if len(name) <= limit:
+        return name
+    return name[:max(limit - 1, 0)] + '…' if limit > 1 else ''
+
+
+def render_svg(shelf, payload, show_labels=True, show_images=False):
+    """棚割り図をSVG文字列で描画（座標の単位はcm）"""
+    width = shelf.width
+    total_height = payload['total_height'] + BOARD_THICKNESS
+    font_size = 2.4
+
+    parts = [
+        '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+        f'viewBox="0 0 {width:g} {total_height:g}" preserveAspectRatio="xMidYMid meet">',
+        f'<title>{escape(shelf.name)}</title>',
+        f'<rect width="{width:g}" height="{total_height:g}" fill="{COLORS["background"]}"/>',
+    ]
+    for segment, top, floor, placements in _iter_boxes(payload, total_height - BOARD_THICKNESS):
+        parts.append(
+            f'<rect x="0" y="{top:g}" width="{width:g}" height="{segment["height"]:g}" '
+            f'fill="{COLORS["segment"]}" stroke="{COLORS["segment_border"]}" stroke-width="0.2"/>'
+        )
+        parts.append(
+            f'<rect x="0" y="{floor:g}" width="{width:g}" height="{BOARD_THICKNESS:g}" '
+            f'fill="{COLORS["segment_border"]}"/>'
+        )
+        for placement, y, height in placements:
+            product = placement['product']
+            kind = 'own' if product['is_own_product'] else 'competitor'
+            x = placement['x_position']
+            occupied = placement['occupied_width']
+            parts.append(
+                f'<g><title>{escape(product["name"])} ({placement["face_count"]}面)</title>'
+                f'<rect x="{x:g}" y="{y:g}" width="{occupied:g}" height="{height:g}" '
+                f'fill="{COLORS[kind]}" stroke="{COLORS[kind + "_border"]}" stroke-width="0.3"/>'
+            )
+            for face in range(placement['face_count']):
+                face_x = x + product['width'] * face
+                if show_images and product['image']:
+                    parts.append(
+                        f'<image x="{face_x:g}" y="{y:g}" width="{product["width"]:g}" height="{height:g}" '
+                        f'preserveAspectRatio="xMidYMax meet" href={quoteattr(product["image"]["url"])}/>'
+                    )
+                if face:
+                    parts.append(
+                        f'<line x1="{face_x:g}" y1="{y:g}" x2="{face_x:g}" y2="{floor:g}" '
+                        f'stroke="{COLORS["face_line"]}" stroke-width="0.1"/>'
+                    )
+            label = _label(placement, occupied, font_size) if show_labels else ''
+            if label:
+                parts.append(
+                    f'<text x="{x + occupied / 2:g}" y="{floor - 0.8:g}" font-size="{font_size:g}" '
+                    f'text-anchor="middle" fill="{COLORS["text"]}">{escape(label)}</text>'
+                )
+            parts.append('</g>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def _load_font(size):
+    """ラベル用フォント（PLANOGRAM_FONT_PATH 未設定時は日本語を描画できないため None）"""
+    path = getattr(settings, 'PLANOGRAM_FONT_PATH', None)
+    if not path:
+        return None
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        return None
+
+
+def _load_image(image, size):
+    """商品画像を読み込んでリサイズ（読み込めない場合は None）"""
+    try:
+        with default_storage.open(image['name']) as file:
+            picture = Image.open(file)
+            picture.thumbnail(size)
+            return picture.convert('RGBA')
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def draw_planogram(shelf, payload, width_px=600, show_labels=True, show_images=False):
+    """棚割り図をPillowの画像(RGB)で描画"""
+    width_px = max(min(int(width_px), MAX_PNG_WIDTH), 1)
+    scale = width_px / shelf.width
+    total_height = payload['total_height'] + BOARD_THICKNESS
+    height_px = max(int(round(total_height * scale)), 1)
+
+    canvas = Image.new('RGB', (width_px, height_px), COLORS['background'])
+    draw = ImageDraw.Draw(canvas)
+    font_size = max(int(2.4 * scale), 1)
+    font = _load_font(font_size) if show_labels and font_size >= 8 else None
+    images = {}
+
+    def px(value):
+        return int(round(value * scale))
+
+    for segment, top, floor, placements in _iter_boxes(payload, total_height - BOARD_THICKNESS):
+        draw.rectangle(
+            [0, px(top), width_px - 1, px(floor)],
+            fill=COLORS['segment'], outline=COLORS['segment_border']
+        )
+        draw.rectangle([0, px(floor), width_px - 1, px(floor + BOARD_THICKNESS)], fill=COLORS['segment_border'])
+        for placement, y, height in placements:
+            product = placement['product']
+            kind = 'own' if product['is_own_product'] else 'competitor'
+            x = placement['x_position']
+            box = [px(x), px(y), max(px(x + placement['occupied_width']) - 1, px(x)), px(floor)]
+            draw.rectangle(box, fill=COLORS[kind], outline=COLORS[kind + '_border'])
+
+            face_size = (max(px(product['width']) - 2, 1), max(px(height) - 2, 1))
+            for face in range(placement['face_count']):
+                face_x = px(x + product['width'] * face)
+                if show_images and product['image']:
+                    key = (product['image']['name'], face_size)
+                    if key not in images:
+                        images[key] = _load_image(product['image'], face_size)
+                    picture = images[key]
+                    if picture is not None:
+                        canvas.paste(
+                            picture,
+                            (face_x + 1 + (face_size[0] - picture.width) // 2, px(floor) - picture.height - 1),
+                            picture
+                        )
+                if face:
+                    draw.line([face_x, px(y), face_x, px(floor)], fill=COLORS['face_line'])
+
+            if font:
+                label = _label(placement, placement['occupied_width'], 2.4)
+                if label:
+                    draw.text(
+                        (px(x + placement['occupied_width'] / 2), px(floor - 0.8)),
+                        label, fill=COLORS['text'], font=font, anchor='ms'
+                    )
+
+    return canvas
+
+
+def render_png(shelf, payload, width_px=600, show_labels=True, show_images=False):
+    """棚割り図をPNGバイト列で描画"""
+    canvas = draw_planogram(shelf, payload, width_px, show_labels, show_images)
+    buffer = io.BytesIO()
+    canvas.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
@@ -0,0 +1,194 @@
+# apps/shelves/scoring.py
+"""
+棚レイアウト評価（NumPyによる一括計算）
+
+複数棚の段・配置を列指向の配列に読み込み、段ごと・棚ごとの指標をまとめて計算する。
+"""
+import numpy as np
+
+from .models import Shelf, ShelfSegment, ProductPlacement
+
+# この幅(cm)以下の隙間は隙間として数えない
+DEFAULT_MIN_GAP = 0.1
+
+
+class LayoutColumns:
+    """複数棚の段・配置を保持する列指向データ"""
+
+    def __init__(self, shelf_ids, shelf_widths, segment_ids, segment_shelf_ids,
+                 placement_segment_ids, x_positions, occupied_widths, face_counts,
+                 recommended_faces, is_own):
+        self.shelf_ids = np.asarray(shelf_ids, dtype=np.int64)
+        self.shelf_widths = np.asarray(shelf_widths, dtype=np.float64)
+        self.segment_ids = np.asarray(segment_ids, dtype=np.int64)
+        self.segment_shelf_ids = np.asarray(segment_shelf_ids, dtype=np.int64)
+        self.placement_segment_ids = np.asarray(placement_segment_ids, dtype=np.int64)
+        self.x_positions = np.asarray(x_positions, dtype=np.float64)
+        self.occupied_widths = np.asarray(occupied_widths, dtype=np.float64)
+        self.face_counts = np.asarray(face_counts, dtype=np.float64)
+        self.recommended_faces = np.asarray(recommended_faces, dtype=np.float64)
+        self.is_own = np.asarray(is_own, dtype=bool)
+
+    @classmethod
+    def load(cls, shelves=None):
+        """有効な棚・段・配置を読み込む（3クエリ）"""
+        if shelves is None:
+            shelves = Shelf.objects.filter(is_active=True)
+        shelf_ids = shelves.values('id')
+
+        shelf_rows = np.array(
+            list(shelves.order_by('id').values_list('id', 'width')), dtype=np.float64
+        ).reshape(-1, 2)
+        segment_rows = np.array(
+            list(ShelfSegment.objects.filter(shelf__in=shelf_ids, is_active=True).order_by(
+                'shelf_id', 'level'
+            ).values_list('id', 'shelf_id')), dtype=np.int64
+        ).reshape(-1, 2)
+        placement_rows = np.array(
+            list(ProductPlacement.objects.filter(
+                shelf__in=shelf_ids,
+                segment__is_active=True,
+                is_active=True
+            ).order_by().values_list(
+                'segment_id', 'x_position', 'occupied_width', 'face_count',
+                'product__recommended_faces', 'product__manufacturer__is_own_company'
+            )), dtype=np.float64
+        ).reshape(-1, 6)
+
+        return cls(
+            shelf_rows[:, 0], shelf_rows[:, 1],
+            segment_rows[:, 0], segment_rows[:, 1],
+            placement_rows[:, 0], placement_rows[:, 1], placement_rows[:, 2],
+            placement_rows[:, 3], placement_rows[:, 4], placement_rows[:, 5],
+        )
+
+
+class LayoutScores:
+    """段ごと・棚ごとの評価指標（各属性は配列）"""
+
+    METRICS = ('fill_ratio', 'gap_count', 'largest_gap', 'own_share', 'facing_deviation', 'placement_count')
+
+    def __init__(self, shelf_ids, segment_ids, segment_shelf_ids, shelf_metrics, segment_metrics):
+        self.shelf_ids = shelf_ids
+        self.segment_ids = segment_ids
+        self.segment_shelf_ids = segment_shelf_ids
+        self.shelf = shelf_metrics
+        self.segment = segment_metrics
+
+    def for_shelf(self, shelf_id):
+        """1棚分の指標を辞書で取得"""
+        i = int(np.searchsorted(self.shelf_ids, shelf_id))
+        if i >= len(self.shelf_ids) or self.shelf_ids[i] != shelf_id:
+            raise KeyError(shelf_id)
+        return {name: self.shelf[name][i].item() for name in self.METRICS}
+
+    def shelf_records(self):
+        """棚ごとの指標を辞書のリストで取得"""
+        return [
+            {'shelf_id': int(shelf_id), **{name: self.shelf[name][i].item() for name in self.METRICS}}
+            for i, shelf_id in enumerate(self.shelf_ids)
+        ]
+
+
+def _ratio(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator, dtype=np.float64), where=denominator > 0)
+
+
+def score_layouts(columns, min_gap=DEFAULT_MIN_GAP):
+    """充填率・隙間数・最大隙間・自社占有率・推奨フェース乖離を一括計算"""
+    shelf_order = np.argsort(columns.shelf_ids, kind='stable')
+    shelf_ids = columns.shelf_ids[shelf_order]
+    shelf_widths = columns.shelf_widths[shelf_order]
+    shelf_count = len(shelf_ids)
+
+    # 段 -> 棚の位置、配置 -> 段の位置
+    segment_shelf = np.searchsorted(shelf_ids, columns.segment_shelf_ids)
+    segment_count = len(columns.segment_ids)
+    segment_widths = shelf_widths[segment_shelf] if segment_count else np.zeros(0)
+
+    segment_sorter = np.argsort(columns.segment_ids, kind='stable')
+    positions = np.searchsorted(columns.segment_ids[segment_sorter], columns.placement_segment_ids)
+    positions = np.minimum(positions, max(segment_count - 1, 0))
+    placement_segment = segment_sorter[positions] if segment_count else positions
+    known = (
+        columns.segment_ids[placement_segment] == columns.placement_segment_ids
+        if segment_count else np.zeros(len(positions), dtype=bool)
+    )
+
+    seg = placement_segment[known]
+    x = columns.x_positions[known]
+    width = columns.occupied_widths[known]
+    ends = x + width
+    deviation = (
+        np.abs(columns.face_counts[known] - columns.recommended_faces[known])
+        / np.maximum(columns.recommended_faces[known], 1)
+    )
+
+    placement_count = np.bincount(seg, minlength=segment_count).astype(np.float64)
+    used = np.bincount(seg, weights=width, minlength=segment_count)
+    own_used = np.bincount(seg, weights=width * columns.is_own[known], minlength=segment_count)
+    deviation_sum = np.bincount(seg, weights=deviation, minlength=segment_count)
+
+    # 段ごとにX座標順へ並べ、直前までの終了位置の最大値との差を隙間とする
+    order = np.lexsort((x, seg))
+    seg, x, ends = seg[order], x[order], ends[order]
+    # 段ごとに十分大きいオフセットを加えて累積最大を段内に閉じ込める
+    span = 2.0 * max(
+        np.abs(x).max(initial=0.0), np.abs(ends).max(initial=0.0), segment_widths.max(initial=0.0)
+    ) + 1.0
+    offset = seg * span
+    running_end = np.maximum.accumulate(ends + offset) - offset if len(seg) else ends
+
+    first = np.ones(len(seg), dtype=bool)
+    first[1:] = seg[1:] != seg[:-1]
+    previous_end = np.zeros(len(seg))
+    previous_end[1:] = running_end[:-1]
+    previous_end[first] = 0.0
+    gaps = x - previous_end
+
+    last = np.ones(len(seg), dtype=bool)
+    last[:-1] = seg[:-1] != seg[1:]
+    trailing = segment_widths.copy()
+    trailing[seg[last]] = segment_widths[seg[last]] - running_end[last]
+
+    gap_count = (
+        np.bincount(seg, weights=(gaps > min_gap).astype(np.float64), minlength=segment_count)
+        + (trailing > min_gap)
+    )
+    largest_gap = np.maximum(trailing, 0.0)
+    if len(seg):
+        starts = np.flatnonzero(first)
+        largest_gap[seg[starts]] = np.maximum(largest_gap[seg[starts]], np.maximum.reduceat(gaps, starts))
+
+    segment_metrics = {
+        'fill_ratio': _ratio(used, segment_widths),
+        'gap_count': gap_count,
+        'largest_gap': largest_gap,
+        'own_share': _ratio(own_used, used),
+        'facing_deviation': _ratio(deviation_sum, placement_count),
+        'placement_count': placement_count,
+    }
+
+    shelf_capacity = np.bincount(segment_shelf, weights=segment_widths, minlength=shelf_count)
+    shelf_used = np.bincount(segment_shelf, weights=used, minlength=shelf_count)
+    shelf_own = np.bincount(segment_shelf, weights=own_used, minlength=shelf_count)
+    shelf_placements = np.bincount(segment_shelf, weights=placement_count, minlength=shelf_count)
+    shelf_deviation = np.bincount(segment_shelf, weights=deviation_sum, minlength=shelf_count)
+    shelf_largest = np.zeros(shelf_count)
+    np.maximum.at(shelf_largest, segment_shelf, largest_gap)
+
+    shelf_metrics = {
+        'fill_ratio': _ratio(shelf_used, shelf_capacity),
+        'gap_count': np.bincount(segment_shelf, weights=gap_count, minlength=shelf_count),
+        'largest_gap': shelf_largest,
+        'own_share': _ratio(shelf_own, shelf_used),
+        'facing_deviation': _ratio(shelf_deviation, shelf_placements),
+        'placement_count': shelf_placements,
+    }
+
+    return LayoutScores(shelf_ids, columns.segment_ids, columns.segment_shelf_ids, shelf_metrics, segment_metrics)
+
+
+def score_shelves(shelves=None, min_gap=DEFAULT_MIN_GAP):
+    """棚のクエリセット（省略時は全有効棚）を読み込んで評価"""
+    return score_layouts(LayoutColumns.load(shelves), min_gap=min_gap)
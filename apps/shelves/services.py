@@ -2,9 +2,47 @@
 """
 棚管理ビジネスロジック
 """
-from django.db import transaction
+import io
+import json
+import logging
+import math
+import os
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections, transaction
+from django.db.models import Exists, F, Func, OuterRef, Prefetch, Q, Subquery, prefetch_related_objects
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
-from .models import Shelf, ShelfSegment, ProductPlacement
+from django.utils import timezone
+from apps.core.models import Counter
+from apps.products.models import Product
+from .models import Shelf, ShelfSegment, ProductPlacement, ShelfLayoutSnapshot
+from .constraints import BatchPlacementChecker
+from .intervals import SegmentIntervalIndex
+from .optimizer import optimize_layout, allocate_facings
+from .printing import PdfImageWriter, encode_page
+from .rendering import draw_planogram, render_png, render_svg
+from .snapshots import diff_layouts
+
+logger = logging.getLogger(__name__)
+
+# キャッシュ未設定（DummyCache）時に使用するプロセス内キャッシュ
+_fallback_layout_cache = LocMemCache('shelf-layout', {})
+
+
+def _layout_cache():
+    cache = caches['default']
+    if isinstance(cache, DummyCache):
+        return _fallback_layout_cache
+    return cache
 
 
 class ShelfService:
@@ -20,17 +58,255 @@ class ShelfService:
                 created_by=user
             )
             
-            # 段作成
+            # 段作成（y_positionは段の高さの累積和）
+            segments = []
+            y_position = 0
             for level, segment_data in enumerate(segments_data, 1):
-                ShelfSegment.objects.create(
+                segments.append(ShelfSegment(
                     shelf=shelf,
                     level=level,
                     height=segment_data['height'],
+                    y_position=y_position,
                     created_by=user
-                )
+                ))
+                y_position += segment_data['height']
+            ShelfSegment.objects.bulk_create(segments)
+            Counter.add(**{Counter.SEGMENTS: len(segments)})
             
             return shelf
     
+    @staticmethod
+    def filter_shelves(queryset, params):
+        """一覧・一覧API・エクスポート共通の検索条件で絞り込み
+
+        search: 棚名・設置場所の部分一致、location: 設置場所の完全一致、
+        has_placements: 'true'/'false'（有効な配置の有無）、min_width/max_width: 棚幅(cm)の範囲。
+        形式が正しくない条件は無視する。
+        """
+        from .forms import ShelfSearchForm
+
+        form = ShelfSearchForm(params)
+        form.is_valid()
+        data = form.cleaned_data
+
+        search_query = (data.get('search') or '').strip()
+        if search_query:
+            queryset = queryset.filter(Q(name__icontains=search_query) | Q(location__icontains=search_query))
+        if params.get('location'):
+            queryset = queryset.filter(location=params['location'])
+        if data.get('min_width') is not None:
+            queryset = queryset.filter(width__gte=data['min_width'])
+        if data.get('max_width') is not None:
+            queryset = queryset.filter(width__lte=data['max_width'])
+
+        # 段の配置数（集計フィールド）で判定し、配置テーブルを走査しない
+        has_placements = data.get('has_placements')
+        if has_placements in ('true', 'false'):
+            placed = Exists(ShelfSegment.objects.filter(shelf=OuterRef('pk'), active_placement_count__gt=0))
+            queryset = queryset.filter(placed if has_placements == 'true' else ~placed)
+        return queryset
+
+    @staticmethod
+    def list_queryset(queryset=None):
+        """一覧表示用に段数・配置数を付与した棚のクエリセット（1クエリ）
+
+        段・配置は読み込まず、段の件数と段の配置数（集計フィールド）の合計を相関サブクエリで取得する。
+        """
+        if queryset is None:
+            queryset = Shelf.objects.filter(is_active=True)
+        segments = ShelfSegment.objects.filter(shelf=OuterRef('pk')).order_by()
+        return queryset.annotate(
+            annotated_segment_count=Coalesce(
+                Subquery(
+                    segments.filter(is_active=True)
+                    .annotate(total=Func('id', function='COUNT')).values('total')
+                ),
+                0
+            ),
+            annotated_placement_count=Coalesce(
+                Subquery(
+                    segments.annotate(total=Func('active_placement_count', function='SUM')).values('total')
+                ),
+                0
+            ),
+        )
+
+    @staticmethod
+    def layout_queryset(queryset=None):
+        """段→配置→商品・メーカーをまとめて取得する棚のクエリセット（棚・段・配置の3クエリ）"""
+        if queryset is None:
+            queryset = Shelf.objects.filter(is_active=True)
+        return queryset.prefetch_related(*ShelfService._layout_prefetches())
+
+    @staticmethod
+    def _layout_prefetches():
+        return [
+            Prefetch(
+                'segments',
+                queryset=ShelfSegment.objects.filter(is_active=True).order_by('level')
+            ),
+            Prefetch(
+                'segments__placements',
+                queryset=ProductPlacement.objects.filter(is_active=True).select_related(
+                    'product__manufacturer'
+                ).order_by('x_position')
+            ),
+        ]
+
+    @staticmethod
+    def get_layout(shelf):
+        """棚の段ごとの配置と統計情報を取得
+
+        layout_queryset() で取得した棚はクエリを追加せず、それ以外は段・配置を2クエリで読み込む。
+        戻り値: {'segments': [{'segment', 'placements', 'used_width', 'utilization',
+        'available_width'}], 'stats': 統計情報（配置がない場合は None）}
+        """
+        if 'segments' not in getattr(shelf, '_prefetched_objects_cache', {}):
+            prefetch_related_objects([shelf], *ShelfService._layout_prefetches())
+
+        segments_data = []
+        total_products = total_faces = own_products = 0
+        for segment in shelf.segments.all():
+            placements = list(segment.placements.all())
+            used_width = sum(placement.occupied_width for placement in placements)
+            segments_data.append({
+                'segment': segment,
+                'placements': placements,
+                'used_width': used_width,
+                'utilization': (used_width / shelf.width * 100) if placements else 0,
+                'available_width': shelf.width - used_width,
+            })
+            total_products += len(placements)
+            total_faces += sum(placement.face_count for placement in placements)
+            own_products += sum(placement.product.is_own_product for placement in placements)
+
+        stats = None
+        if total_products:
+            stats = {
+                'total_products': total_products,
+                'total_faces': total_faces,
+                'avg_utilization': sum(data['utilization'] for data in segments_data) / len(segments_data),
+                'own_products': own_products,
+                'competitor_products': total_products - own_products,
+            }
+
+        return {'segments': segments_data, 'stats': stats}
+
+    @staticmethod
+    def get_layout_payload(shelf):
+        """get_layout() の結果をシリアライズ可能な辞書にしてレイアウト版数ごとにキャッシュ
+
+        キーに棚のレイアウト版数と幅を含むため、段・配置・商品・メーカーの変更後は
+        必ず再構築される。キャッシュヒット時はDBアクセスを行わない。
+        """
+        key = f'shelves:layout:{shelf.pk}:{shelf.layout_revision}:{shelf.width}'
+        cache = _layout_cache()
+        payload = cache.get(key)
+        if payload is None:
+            payload = ShelfService._build_layout_payload(shelf)
+            cache.set(key, payload, getattr(settings, 'SHELF_LAYOUT_CACHE_TIMEOUT', 60 * 60 * 24))
+        return payload
+
+    @staticmethod
+    def planogram_etag(shelf, fmt, width_px=None, show_images=False):
+        """棚割り図のETag（レイアウト版数と描画条件から決まる。棚名・幅の変更でも版数は加算される）"""
+        return f'"planogram-{shelf.pk}-{shelf.layout_revision}-{shelf.width:g}-{fmt}-{width_px or 0}-{int(show_images)}"'
+
+    @staticmethod
+    def render_planogram(shelf, fmt, width_px=None, show_images=False):
+        """棚割り図をSVG/PNGで描画し、レイアウト版数ごとにキャッシュ
+
+        戻り値: (内容, Content-Type)
+        """
+        key = 'shelves:planogram:' + ShelfService.planogram_etag(shelf, fmt, width_px, show_images).strip('"')
+        cache = _layout_cache()
+        content = cache.get(key)
+        if content is None:
+            payload = ShelfService.get_layout_payload(shelf)
+            if fmt == 'png':
+                content = render_png(shelf, payload, width_px=width_px or 600, show_images=show_images)
+            else:
+                content = render_svg(shelf, payload, show_images=show_images)
+            cache.set(key, content, getattr(settings, 'SHELF_LAYOUT_CACHE_TIMEOUT', 60 * 60 * 24))
+        return content, 'image/png' if fmt == 'png' else 'image/svg+xml'
+
+    @staticmethod
+    def _build_layout_payload(shelf):
+        layout = ShelfService.get_layout(shelf)
+        segments = []
+        for data in layout['segments']:
+            segment = data['segment']
+            placements = []
+            for placement in data['placements']:
+                product = placement.product
+                placements.append({
+                    'id': placement.id,
+                    'product_id': product.id,
+                    'x_position': placement.x_position,
+                    'face_count': placement.face_count,
+                    'occupied_width': placement.occupied_width,
+                    'end_position': placement.end_position,
+                    # テンプレートからモデルと同じ属性名で参照できる形にする
+                    'product': {
+                        'id': product.id,
+                        'pk': product.pk,
+                        'name': product.name,
+                        'jan_code': product.jan_code,
+                        'width': product.width,
+                        'height': product.height,
+                        'image': {'url': product.image.url, 'name': product.image.name} if product.image else None,
+                        'is_own_product': product.is_own_product,
+                        'manufacturer': {'name': product.manufacturer.name},
+                    },
+                })
+            segments.append({
+                'segment': {
+                    'id': segment.id,
+                    'level': segment.level,
+                    'height': segment.height,
+                    'y_position': segment.y_position,
+                },
+                'placements': placements,
+                'used_width': data['used_width'],
+                'utilization': data['utilization'],
+                'available_width': data['available_width'],
+            })
+
+        return {
+            'revision': shelf.layout_revision,
+            'segment_count': len(segments),
+            'total_height': sum(data['segment']['height'] for data in segments),
+            'segments': segments,
+            'stats': layout['stats'],
+        }
+
+    @staticmethod
+    def reflow_segment_positions(shelf):
+        """棚の全段のy_positionを再計算（1回の取得と1回の一括更新）
+
+        有効な段を段番号順に並べ、高さの累積和を床からの位置とする。
+        戻り値は {段ID: y_position}
+        """
+        segments = ShelfSegment.objects.filter(
+            shelf=shelf,
+            is_active=True
+        ).order_by('level').only('id', 'level', 'height', 'y_position')
+        
+        positions = {}
+        changed = []
+        y_position = 0
+        for segment in segments:
+            positions[segment.id] = y_position
+            if segment.y_position != y_position:
+                segment.y_position = y_position
+                changed.append(segment)
+            y_position += segment.height
+        
+        if changed:
+            ShelfSegment.objects.bulk_update(changed, ['y_position'])
+        
+        return positions
+    
     @staticmethod
     def validate_placement(shelf, segment, product, x_position, face_count):
         """配置バリデーション"""
@@ -45,23 +321,1264 @@ class ShelfService:
         if x_position + required_width > shelf.width:
             errors.append(f'配置位置が棚の幅を超えます（必要幅: {required_width}cm）')
         
-        # 重複チェック
-        overlapping = ProductPlacement.objects.filter(
-            segment=segment,
-            is_active=True
-        ).exclude(
-            x_position__gte=x_position + required_width
-        ).exclude(
-            x_position__lte=x_position - product.width
-        )
-        
-        if overlapping.exists():
+        # 重複チェック（既存配置の開始位置のみで判定する従来仕様を維持）
+        if segment.get_interval_index().has_start_between(
+            x_position - product.width,
+            x_position + required_width
+        ):
             errors.append('他の商品と配置が重複します')
         
         return errors
     
     @staticmethod
-    def optimize_shelf_layout(shelf):
-        """棚レイアウト最適化"""
-        # 将来の実装用
-        raise NotImplementedError('レイアウト最適化機能は今後実装予定です')
+    def validate_placements_batch(shelf, candidates):
+        """配置候補の一括バリデーション
+
+        candidates: segment_id, product_id, x_position, face_count,
+        placement_id（任意）を持つ辞書のリスト
+        """
+        segments = dict(
+            ShelfSegment.objects.filter(shelf=shelf, is_active=True).values_list('id', 'height')
+        )
+        product_ids = {candidate['product_id'] for candidate in candidates}
+        products = {
+            row[0]: row[1:]
+            for row in Product.objects.filter(id__in=product_ids, is_active=True).values_list(
+                'id', 'width', 'height', 'min_faces', 'max_faces'
+            )
+        }
+        checker = BatchPlacementChecker(
+            shelf.width, segments, products, SegmentIntervalIndex.for_shelf(shelf)
+        )
+        return checker.check(
+            [candidate['segment_id'] for candidate in candidates],
+            [candidate['product_id'] for candidate in candidates],
+            [candidate['x_position'] for candidate in candidates],
+            [candidate['face_count'] for candidate in candidates],
+            [candidate.get('placement_id') or -1 for candidate in candidates],
+        )
+    
+    @staticmethod
+    def get_free_gaps(shelf, product=None, face_count=1, segment_id=None):
+        """段ごとの空き区間とスナップ位置を取得（ドラッグ中のホバー用）
+
+        配置は棚単位で1回だけ取得する。product を指定した場合は、
+        高さが収まる段で product × face_count の幅が入る空き区間のみ返す。
+        """
+        segments = shelf.segments.filter(is_active=True).order_by('level')
+        if segment_id is not None:
+            segments = segments.filter(id=segment_id)
+        indexes = SegmentIntervalIndex.for_shelf(shelf)
+        required_width = product.width * face_count if product else 0.0
+
+        results = []
+        for segment in segments:
+            fits_height = product is None or product.height <= segment.height
+            gaps = []
+            if fits_height:
+                index = indexes.get(segment.id) or SegmentIntervalIndex()
+                for start, end in index.free_gaps(shelf.width, min_width=required_width):
+                    gap = {'start': start, 'end': end, 'width': end - start}
+                    if product:
+                        # 空き区間の左詰め・右詰め位置
+                        right = max(end - required_width, start)
+                        gap['snap_positions'] = [start] if right == start else [start, right]
+                    gaps.append(gap)
+            results.append({
+                'segment_id': segment.id,
+                'level': segment.level,
+                'height': segment.height,
+                'fits_height': fits_height,
+                'gaps': gaps,
+            })
+
+        return {
+            'shelf_id': shelf.id,
+            'revision': shelf.layout_revision,
+            'required_width': required_width,
+            'segments': results,
+        }
+
+    @staticmethod
+    def allocate_segment_facings(segment, product_ids):
+        """段内の商品群のフェース数を一括で配分
+
+        指定商品の既存配置は配分し直す対象とし、それ以外の配置の占有幅を除いた幅を空き幅とする。
+        """
+        product_ids = list(dict.fromkeys(product_ids))
+        targets = set(product_ids)
+        fixed_width = sum(
+            occupied_width
+            for product_id, occupied_width in ProductPlacement.objects.filter(
+                segment=segment,
+                is_active=True
+            ).order_by().values_list('product_id', 'occupied_width')
+            if product_id not in targets
+        )
+        free_width = max(segment.shelf.width - fixed_width, 0)
+        
+        rows = {
+            row[0]: row
+            for row in Product.objects.filter(id__in=product_ids, is_active=True).values_list(
+                'id', 'width', 'min_faces', 'max_faces', 'recommended_faces'
+            )
+        }
+        products = [rows[product_id] for product_id in product_ids if product_id in rows]
+        
+        result = allocate_facings(free_width, products)
+        
+        return {
+            'segment_id': segment.id,
+            'free_width': free_width,
+            'used_width': result['used_width'],
+            'facings': [
+                {
+                    'product_id': product[0],
+                    'face_count': face_count,
+                    'required_width': product[1] * face_count,
+                    'recommended_faces': product[4],
+                    'placed': face_count > 0,
+                }
+                for product, (_, face_count) in zip(products, result['facings'])
+            ],
+        }
+    
+    @staticmethod
+    def optimize_shelf_layout(shelf, product_ids=None, time_budget=2.0, starts=1, weights=None, seed=None):
+        """棚レイアウト最適化
+
+        商品の段割り当て・X座標・フェース数を求め、DBには書き込まずに
+        PlacementChangesetService.apply() にそのまま渡せる変更セットとして返す。
+        product_ids を省略した場合は現在配置されている商品を対象とする。
+        """
+        # 提案の基準となる版数は配置の読み込み前に取得する
+        base_revision = Shelf.objects.values_list('layout_revision', flat=True).get(pk=shelf.pk)
+        segments = list(
+            ShelfSegment.objects.filter(shelf=shelf, is_active=True).order_by('level').values_list('id', 'height')
+        )
+        current = list(
+            ProductPlacement.objects.filter(shelf=shelf, is_active=True).order_by('id').values_list('id', 'product_id')
+        )
+        
+        if product_ids is None:
+            product_ids = list(dict.fromkeys(product_id for _, product_id in current))
+        rows = {
+            row[0]: row
+            for row in Product.objects.filter(id__in=product_ids, is_active=True).values_list(
+                'id', 'width', 'height', 'min_faces', 'max_faces', 'recommended_faces',
+                'manufacturer__is_own_company'
+            )
+        }
+        # 指定順を保つ（段内の並び順になる）
+        products = [rows[product_id] for product_id in dict.fromkeys(product_ids) if product_id in rows]
+        
+        result = optimize_layout(
+            shelf.width, segments, products, weights=weights,
+            time_budget=time_budget, starts=starts, seed=seed
+        )
+        
+        # 既存配置は同じ商品の提案配置に更新し、余った配置は削除する
+        reusable = {}
+        for placement_id, product_id in current:
+            reusable.setdefault(product_id, []).append(placement_id)
+        
+        operations = []
+        for proposal in result['placements']:
+            existing = reusable.get(proposal['product_id'])
+            if existing:
+                operations.append({'op': 'update', 'placement_id': existing.pop(0), **proposal})
+            else:
+                operations.append({'op': 'create', **proposal})
+        for placement_ids in reusable.values():
+            operations.extend({'op': 'delete', 'placement_id': placement_id} for placement_id in placement_ids)
+        
+        return {
+            'base_revision': base_revision,
+            'operations': operations,
+            'summary': {
+                'score': result['score'],
+                'fill_ratio': result['fill_ratio'],
+                'placed_count': len(result['placements']),
+                'unplaced_product_ids': result['unplaced_product_ids'],
+                'iterations': result['iterations'],
+            },
+        }
+
+
+class PlacementChangesetService:
+    """配置変更セット（作成・更新・削除の一括適用）サービス"""
+
+    OPERATIONS = ('create', 'update', 'delete')
+    UPDATE_FIELDS = [
+        'segment', 'x_position', 'face_count', 'occupied_width',
+        'is_active', 'updated_by', 'updated_at',
+    ]
+
+    @classmethod
+    def apply(cls, shelf, operations, user, base_revision=None):
+        """変更セットを検証し、すべて有効なら1トランザクションで適用
+
+        戻り値: success, conflict, revision, results を持つ辞書
+        """
+        with transaction.atomic():
+            shelf = Shelf.objects.select_for_update().get(pk=shelf.pk)
+            if base_revision is not None and base_revision != shelf.layout_revision:
+                return {
+                    'success': False,
+                    'conflict': True,
+                    'revision': shelf.layout_revision,
+                    'results': [],
+                }
+
+            segments = dict(
+                ShelfSegment.objects.filter(shelf=shelf, is_active=True).values_list('id', 'height')
+            )
+            placements = {
+                placement.id: placement
+                for placement in ProductPlacement.objects.filter(shelf=shelf, is_active=True).order_by()
+            }
+
+            # 既存配置と作成操作の商品をまとめて取得
+            product_ids = {placement.product_id for placement in placements.values()}
+            for operation in operations:
+                if isinstance(operation, dict) and operation.get('op') == 'create':
+                    try:
+                        product_ids.add(int(operation['product_id']))
+                    except (KeyError, TypeError, ValueError):
+                        pass
+            products = Product.objects.in_bulk(product_ids)
+            for placement in placements.values():
+                placement.product = products[placement.product_id]
+
+            state = cls._apply_in_memory(shelf, operations, user, segments, placements, products)
+            results = state['results']
+
+            if all(result['valid'] for result in results):
+                cls._check_constraints(shelf, segments, products, placements, state)
+
+            if not all(result['valid'] for result in results):
+                return {
+                    'success': False,
+                    'conflict': False,
+                    'revision': shelf.layout_revision,
+                    'results': results,
+                }
+
+            cls._write(shelf, placements, state, user)
+            revision = Shelf.objects.filter(pk=shelf.pk).values_list('layout_revision', flat=True).get()
+
+            for index, placement in state['owners'].values():
+                results[index]['placement'] = {
+                    'id': placement.id,
+                    'segment_id': placement.segment_id,
+                    'x_position': placement.x_position,
+                    'face_count': placement.face_count,
+                    'occupied_width': placement.occupied_width,
+                    'end_position': placement.end_position,
+                }
+
+            return {
+                'success': True,
+                'conflict': False,
+                'revision': revision,
+                'results': results,
+            }
+
+    @classmethod
+    def _apply_in_memory(cls, shelf, operations, user, segments, placements, products):
+        """操作を順にメモリ上の状態へ適用"""
+        results = []
+        created = {}
+        deleted = set()
+        # 配置キー -> (最後に変更した操作番号, 配置)。新規配置は負のキーを使う
+        owners = {}
+
+        for index, operation in enumerate(operations):
+            op = operation.get('op') if isinstance(operation, dict) else None
+            result = {'index': index, 'op': op, 'valid': True, 'errors': {}}
+            results.append(result)
+
+            if op not in cls.OPERATIONS:
+                result['valid'] = False
+                result['errors'] = {'op': ['操作はcreate・update・deleteのいずれかを指定してください']}
+                continue
+
+            try:
+                if op == 'create':
+                    segment_id = int(operation['segment_id'])
+                    product = products.get(int(operation['product_id']))
+                    if segment_id not in segments:
+                        result['errors']['segment'] = ['指定された段は指定された棚に属していません。']
+                    if product is None or not product.is_active:
+                        result['errors']['product'] = ['指定された商品が見つかりません。']
+                    if result['errors']:
+                        result['valid'] = False
+                        continue
+
+                    key = -(index + 1)
+                    created[key] = ProductPlacement(
+                        shelf=shelf,
+                        segment_id=segment_id,
+                        product=product,
+                        x_position=float(operation.get('x_position', 0)),
+                        face_count=int(operation.get('face_count', 1)),
+                        created_by=user,
+                        updated_by=user,
+                    )
+                    owners[key] = (index, created[key])
+                    continue
+
+                placement_id = int(operation['placement_id'])
+                placement = placements.get(placement_id)
+                if placement is None or placement_id in deleted:
+                    result['valid'] = False
+                    result['errors'] = {'placement': ['指定された配置が見つかりません。']}
+                    continue
+
+                if op == 'delete':
+                    deleted.add(placement_id)
+                    owners.pop(placement_id, None)
+                    continue
+
+                if 'segment_id' in operation:
+                    segment_id = int(operation['segment_id'])
+                    if segment_id not in segments:
+                        result['valid'] = False
+                        result['errors'] = {'segment': ['指定された段は指定された棚に属していません。']}
+                        continue
+                    placement.segment_id = segment_id
+                if 'x_position' in operation:
+                    placement.x_position = float(operation['x_position'])
+                if 'face_count' in operation:
+                    placement.face_count = int(operation['face_count'])
+                owners[placement_id] = (index, placement)
+
+            except (KeyError, TypeError, ValueError):
+                result['valid'] = False
+                result['errors'] = {'__all__': ['操作データの形式が正しくありません']}
+
+        return {'results': results, 'created': created, 'deleted': deleted, 'owners': owners}
+
+    @staticmethod
+    def _check_constraints(shelf, segments, products, placements, state):
+        """変更後の状態に対して、変更された配置の制約をチェック"""
+        owners = state['owners']
+        if not owners:
+            return
+
+        # 変更後の配置状態から段ごとの区間インデックスを作成
+        entries = {}
+        for placement_id, placement in placements.items():
+            if placement_id in state['deleted']:
+                continue
+            width = (
+                placement.product.width * placement.face_count
+                if placement_id in owners else placement.occupied_width
+            )
+            entries.setdefault(placement.segment_id, []).append((placement_id, placement.x_position, width))
+        for key, placement in state['created'].items():
+            entries.setdefault(placement.segment_id, []).append(
+                (key, placement.x_position, placement.product.width * placement.face_count)
+            )
+        indexes = {segment_id: SegmentIntervalIndex(rows) for segment_id, rows in entries.items()}
+
+        keys = list(owners)
+        touched = [owners[key][1] for key in keys]
+        checker = BatchPlacementChecker(
+            shelf.width,
+            segments,
+            {
+                placement.product_id: (
+                    placement.product.width, placement.product.height,
+                    placement.product.min_faces, placement.product.max_faces,
+                )
+                for placement in touched
+            },
+            indexes,
+        )
+        checks = checker.check(
+            [placement.segment_id for placement in touched],
+            [placement.product_id for placement in touched],
+            [placement.x_position for placement in touched],
+            [placement.face_count for placement in touched],
+            keys,
+        )
+        for key, check in zip(keys, checks):
+            if not check['valid']:
+                result = state['results'][owners[key][0]]
+                result['valid'] = False
+                result['errors'] = check['errors']
+
+    @classmethod
+    def _write(cls, shelf, placements, state, user):
+        """検証済みの変更を一括で書き込み"""
+        now = timezone.now()
+
+        new_placements = list(state['created'].values())
+        for placement in new_placements:
+            placement.occupied_width = placement.product.width * placement.face_count
+        if new_placements:
+            ProductPlacement.objects.bulk_create(new_placements)
+
+        changed = []
+        for placement_id, placement in placements.items():
+            if placement_id in state['deleted']:
+                placement.is_active = False
+            elif placement_id not in state['owners']:
+                continue
+            placement.occupied_width = placement.product.width * placement.face_count
+            placement.updated_by = user
+            placement.updated_at = now
+            changed.append(placement)
+        if changed:
+            ProductPlacement.objects.bulk_update(changed, cls.UPDATE_FIELDS)
+
+        if new_placements or changed:
+            segment_ids = {placement.segment_id for placement in new_placements + changed}
+            segment_ids |= {getattr(placement, '_loaded_segment_id', None) for placement in changed} - {None}
+            ShelfSegment.refresh_placement_counters(segment_ids)
+            Shelf.bump_layout_revision(shelf.pk)
+
+
+class SegmentAlignmentService:
+    """段内配置の整列（左詰め・右詰め・均等配置・隙間詰め）サービス"""
+
+    OPERATIONS = ('compact_left', 'compact_right', 'distribute', 'close_gap')
+    UPDATE_FIELDS = ['x_position', 'updated_by', 'updated_at']
+    # 座標の丸め桁数（浮動小数点の累積誤差を除く）
+    PRECISION = 6
+
+    @classmethod
+    def apply(cls, shelf, operation, user, segment_id=None, x_position=None, base_revision=None):
+        """棚全体（segment_id 指定時は1段）の配置を整列し、1回の bulk_update で書き込み
+
+        close_gap は x_position を含む空き区間を詰める（右側の配置を左へ移動）。
+        戻り値: success, conflict, revision, moved, errors を持つ辞書
+        """
+        if operation not in cls.OPERATIONS:
+            raise ValidationError(f'不明な整列操作です: {operation}')
+        if operation == 'close_gap' and x_position is None:
+            raise ValidationError('詰める隙間の位置を指定してください')
+
+        with transaction.atomic():
+            shelf = Shelf.objects.select_for_update().get(pk=shelf.pk)
+            outcome = {
+                'success': False,
+                'conflict': False,
+                'revision': shelf.layout_revision,
+                'moved': [],
+                'errors': [],
+            }
+            if base_revision is not None and base_revision != shelf.layout_revision:
+                outcome['conflict'] = True
+                return outcome
+
+            placements = ProductPlacement.objects.filter(
+                shelf=shelf,
+                is_active=True,
+                segment__is_active=True
+            ).order_by('segment_id', 'x_position', 'id').only(
+                'id', 'segment_id', 'x_position', 'occupied_width'
+            )
+            if segment_id is not None:
+                placements = placements.filter(segment_id=segment_id)
+
+            grouped = {}
+            for placement in placements:
+                grouped.setdefault(placement.segment_id, []).append(placement)
+
+            changed = []
+            for rows in grouped.values():
+                positions = cls.aligned_positions(
+                    operation,
+                    shelf.width,
+                    [placement.occupied_width for placement in rows],
+                    [placement.x_position for placement in rows],
+                    x_position,
+                )
+                if positions is None:
+                    outcome['errors'].append(
+                        f'段の配置幅の合計が棚幅を超えているため整列できません（段ID: {rows[0].segment_id}）'
+                    )
+                    continue
+                for placement, new_x in zip(rows, positions):
+                    new_x = round(new_x, cls.PRECISION)
+                    if new_x != placement.x_position:
+                        placement.x_position = new_x
+                        changed.append(placement)
+
+            if outcome['errors']:
+                return outcome
+
+            if changed:
+                now = timezone.now()
+                for placement in changed:
+                    placement.updated_by = user
+                    placement.updated_at = now
+                ProductPlacement.objects.bulk_update(changed, cls.UPDATE_FIELDS)
+                Shelf.bump_layout_revision(shelf.pk)
+                outcome['revision'] += 1
+
+            outcome['success'] = True
+            outcome['moved'] = [
+                {
+                    'id': placement.id,
+                    'segment_id': placement.segment_id,
+                    'x_position': placement.x_position,
+                }
+                for placement in changed
+            ]
+            return outcome
+
+    @staticmethod
+    def aligned_positions(operation, width, widths, x_positions, x_position=None):
+        """X座標順に並んだ配置の整列後の座標を計算（棚幅に収まらない場合は None）"""
+        total = sum(widths)
+        count = len(widths)
+
+        if operation == 'close_gap':
+            # x_position を含む空き区間より右の配置を隙間の幅だけ左へ移動
+            reach = 0.0
+            for i, (start, occupied) in enumerate(zip(x_positions, widths)):
+                if reach <= x_position <= start and start > reach:
+                    shift = start - reach
+                    return list(x_positions[:i]) + [x - shift for x in x_positions[i:]]
+                reach = max(reach, start + occupied)
+            return list(x_positions)
+
+        if total > width:
+            return None
+
+        if operation == 'compact_left':
+            start, spacing = 0.0, 0.0
+        elif operation == 'compact_right':
+            start, spacing = width - total, 0.0
+        else:
+            # 両端を含めて隙間を均等にする
+            spacing = (width - total) / (count + 1)
+            start = spacing
+
+        positions = []
+        for occupied in widths:
+            positions.append(start)
+            start += occupied + spacing
+        return positions
+
+
+class ShelfSnapshotService:
+    """レイアウトスナップショットの復元・比較サービス"""
+
+    @staticmethod
+    def restore(snapshot, user):
+        """スナップショットのレイアウトで現在の段・配置を置き換え（1トランザクション）
+
+        段は段番号、配置は (段番号, 商品ID) で既存行（論理削除済みを含む）と対応付けて再利用し、
+        不足分のみ作成・余剰分は論理削除する。無効になった商品の配置は復元しない。
+        """
+        layout = snapshot.decode()
+        now = timezone.now()
+
+        with transaction.atomic():
+            shelf = Shelf.objects.select_for_update().get(pk=snapshot.shelf_id)
+
+            # 段（論理削除済みの段も段番号が一意のため再利用する）
+            existing_segments = {
+                segment.level: segment
+                for segment in ShelfSegment.objects.filter(shelf=shelf).order_by()
+            }
+            levels = dict(layout['segments'])
+            changed_segments = []
+            new_segments = []
+            activated = 0
+            for level, segment in existing_segments.items():
+                height = levels.get(level, segment.height)
+                is_active = level in levels
+                activated += int(is_active) - int(segment.is_active)
+                if segment.height != height or segment.is_active != is_active:
+                    segment.height = height
+                    segment.is_active = is_active
+                    segment.updated_by = user
+                    segment.updated_at = now
+                    changed_segments.append(segment)
+            for level, height in layout['segments']:
+                if level not in existing_segments:
+                    segment = ShelfSegment(
+                        shelf=shelf, level=level, height=height, y_position=0,
+                        created_by=user, updated_by=user
+                    )
+                    existing_segments[level] = segment
+                    new_segments.append(segment)
+            if changed_segments:
+                ShelfSegment.objects.bulk_update(
+                    changed_segments, ['height', 'is_active', 'updated_by', 'updated_at']
+                )
+            if new_segments:
+                ShelfSegment.objects.bulk_create(new_segments)
+            Counter.add(**{Counter.SEGMENTS: activated + len(new_segments)})
+
+            # 配置
+            products = Product.objects.filter(is_active=True).in_bulk(
+                {row[1] for row in layout['placements']}
+            )
+            segment_levels = {segment.id: level for level, segment in existing_segments.items()}
+            # 論理削除済みの配置も再利用し、復元を繰り返しても行が増え続けないようにする
+            reusable = {}
+            for placement in ProductPlacement.objects.filter(
+                shelf=shelf
+            ).order_by('-is_active', 'segment_id', 'x_position', 'id'):
+                key = (segment_levels.get(placement.segment_id), placement.product_id)
+                reusable.setdefault(key, []).append(placement)
+
+            changed = []
+            created = []
+            skipped = set()
+            restored = 0
+            for level, product_id, x_position, face_count in layout['placements']:
+                product = products.get(product_id)
+                if product is None:
+                    skipped.add(product_id)
+                    continue
+                restored += 1
+                queue = reusable.get((level, product_id))
+                if queue:
+                    placement = queue.pop(0)
+                    changed.append(placement)
+                else:
+                    placement = ProductPlacement(shelf=shelf, product=product, created_by=user)
+                    created.append(placement)
+                placement.segment = existing_segments[level]
+                placement.is_active = True
+                placement.x_position = x_position
+                placement.face_count = face_count
+                placement.occupied_width = product.width * face_count
+                placement.updated_by = user
+                placement.updated_at = now
+            for queue in reusable.values():
+                for placement in queue:
+                    if not placement.is_active:
+                        continue
+                    placement.is_active = False
+                    placement.updated_by = user
+                    placement.updated_at = now
+                    changed.append(placement)
+
+            if changed:
+                ProductPlacement.objects.bulk_update(changed, PlacementChangesetService.UPDATE_FIELDS)
+            if created:
+                ProductPlacement.objects.bulk_create(created)
+
+            ShelfSegment.refresh_placement_counters(list(segment_levels))
+            ShelfService.reflow_segment_positions(shelf)
+            Shelf.bump_layout_revision(shelf.pk)
+
+        return {
+            'revision': shelf.layout_revision + 1,
+            'segment_count': len(levels),
+            'placement_count': restored,
+            'skipped_product_ids': sorted(skipped),
+        }
+
+    @staticmethod
+    def diff(snapshot, other=None):
+        """スナップショット間の差分（other 省略時は現在のレイアウトと比較）"""
+        if other is None:
+            _, segments, placements = ShelfLayoutSnapshot.read_layout(snapshot.shelf)
+            current = {'segments': segments, 'placements': placements}
+        else:
+            current = other.decode()
+        return diff_layouts(snapshot.decode(), current)
+
+
+class ShelfCloneService:
+    """棚レイアウト（段・配置）を複数の棚へ一括複製するサービス"""
+
+    # 1トランザクションで処理する複製先の棚数
+    TARGET_CHUNK_SIZE = 50
+
+    @classmethod
+    def clone(cls, source, user, targets=(), new_names=(), skip_overflow=False, batch_size=1000):
+        """複製元の棚の段・配置を既存の棚 targets と新規作成する棚 new_names へ複製
+
+        既存の棚は段を複製元に合わせ、有効な配置をすべて論理削除してから複製する（重複した棚は1回のみ）。
+        skip_overflow=True の場合は棚幅に収まらない配置を除外し、
+        False の場合はその棚への複製を行わずエラーとして報告する。
+        戻り値: 複製先ごとの結果（shelf_id, name, created, success, placement_count, skipped_count, errors）
+        """
+        _, segments, placements = ShelfLayoutSnapshot.read_layout(source)
+        products = Product.objects.in_bulk({row[1] for row in placements})
+        rows = [
+            (level, products[product_id], x_position, face_count)
+            for level, product_id, x_position, face_count in placements
+        ]
+
+        reports = []
+        # 同じ棚を重複して指定された場合は1回だけ複製する（同じ棚への二重書き込みを防ぐ）
+        jobs = [(shelf, False) for shelf in dict.fromkeys(targets)] + [
+            (Shelf(name=name, width=source.width, depth=source.depth, location=source.location,
+                   description=source.description, created_by=user, updated_by=user), True)
+            for name in new_names
+        ]
+        for start in range(0, len(jobs), cls.TARGET_CHUNK_SIZE):
+            chunk = jobs[start:start + cls.TARGET_CHUNK_SIZE]
+            reports.extend(cls._clone_chunk(source, user, chunk, segments, rows, skip_overflow, batch_size))
+        return reports
+
+    @classmethod
+    def _clone_chunk(cls, source, user, jobs, segments, rows, skip_overflow, batch_size):
+        """複製先の一部をまとめて1トランザクションで複製"""
+        reports = []
+        plans = []
+
+        # 棚ごとに複製する配置を決定（DBアクセスなし）
+        for shelf, created in jobs:
+            report = {
+                'shelf_id': shelf.pk,
+                'name': shelf.name,
+                'created': created,
+                'success': False,
+                'placement_count': 0,
+                'skipped_count': 0,
+                'errors': [],
+            }
+            reports.append(report)
+            if shelf.pk is not None and shelf.pk == source.pk:
+                report['errors'].append('複製元と同じ棚には複製できません')
+                continue
+
+            fitting = [
+                row for row in rows
+                if row[2] + row[1].width * row[3] <= shelf.width
+            ]
+            report['skipped_count'] = len(rows) - len(fitting)
+            if report['skipped_count'] and not skip_overflow:
+                report['errors'].append(
+                    f"{report['skipped_count']}件の配置が棚幅（{shelf.width}cm）に収まりません"
+                )
+                continue
+            plans.append((shelf, segments, fitting, report))
+
+        cls.write_layouts(user, plans, batch_size)
+        return reports
+
+    @staticmethod
+    def write_layouts(user, plans, batch_size=1000):
+        """検証済みのレイアウトを複数の棚へまとめて書き込む（1トランザクション、複製・インポート共通）
+
+        plans: [(棚, [(段番号, 高さ)], [(段番号, 商品, X座標, フェース数)], 結果)]
+        結果の created が True の棚は新規作成し、それ以外の既存の棚は有効な配置を
+        すべて論理削除した上で段を段番号で再利用する（レイアウトにない段は無効化）。
+        書き込み後、結果の shelf_id・placement_count・success を設定する。
+        """
+        if not plans:
+            return
+        now = timezone.now()
+
+        with transaction.atomic():
+            new_shelves = [shelf for shelf, _, _, report in plans if report['created']]
+            Shelf.objects.bulk_create(new_shelves, batch_size=batch_size)
+            existing_ids = [shelf.pk for shelf, _, _, report in plans if not report['created']]
+            # 集計値の増減（save() を経由しないためここで計算する）
+            counts = {Counter.SHELVES: len(new_shelves), Counter.SEGMENTS: 0, Counter.PLACEMENTS: 0}
+
+            # 既存の棚: 有効な配置を論理削除し、段は段番号で再利用
+            existing_segments = {}
+            if existing_ids:
+                list(Shelf.objects.select_for_update().filter(pk__in=existing_ids).values_list('pk', flat=True))
+                counts[Counter.PLACEMENTS] -= ProductPlacement.objects.filter(
+                    shelf_id__in=existing_ids, is_active=True
+                ).update(is_active=False, updated_by=user, updated_at=now)
+                for segment in ShelfSegment.objects.filter(shelf_id__in=existing_ids).order_by():
+                    existing_segments[(segment.shelf_id, segment.level)] = segment
+
+            # 段の位置と集計値はメモリ上で計算して書き込む
+            new_segments = []
+            changed_segments = []
+            layouts = []
+            levels = set()
+            for shelf, segments, rows, report in plans:
+                used = {}
+                for level, product, _, face_count in rows:
+                    width, count = used.get(level, (0.0, 0))
+                    used[level] = (width + product.width * face_count, count + 1)
+
+                segment_map = {}
+                y_position = 0
+                for level, height in segments:
+                    used_width, placement_count = used.get(level, (0.0, 0))
+                    segment = existing_segments.get((shelf.pk, level))
+                    if segment is None:
+                        segment = ShelfSegment(shelf_id=shelf.pk, level=level, created_by=user)
+                        new_segments.append(segment)
+                        counts[Counter.SEGMENTS] += 1
+                    else:
+                        changed_segments.append(segment)
+                        counts[Counter.SEGMENTS] += int(not segment.is_active)
+                    segment.height = height
+                    segment.y_position = y_position
+                    segment.used_width = used_width
+                    segment.active_placement_count = placement_count
+                    segment.is_active = True
+                    segment.updated_by = user
+                    segment.updated_at = now
+                    segment_map[level] = segment
+                    levels.add((shelf.pk, level))
+                    y_position += height
+
+                layouts.append((shelf, segment_map, rows))
+                report['shelf_id'] = shelf.pk
+                report['placement_count'] = len(rows)
+                report['success'] = True
+
+            # レイアウトにない段は無効化
+            for key, segment in existing_segments.items():
+                if key not in levels and segment.is_active:
+                    counts[Counter.SEGMENTS] -= 1
+                    segment.is_active = False
+                    segment.used_width = 0
+                    segment.active_placement_count = 0
+                    segment.updated_by = user
+                    segment.updated_at = now
+                    changed_segments.append(segment)
+
+            ShelfSegment.objects.bulk_create(new_segments, batch_size=batch_size)
+            ShelfSegment.objects.bulk_update(
+                changed_segments,
+                ['height', 'y_position', 'used_width', 'active_placement_count',
+                 'is_active', 'updated_by', 'updated_at'],
+                batch_size=batch_size
+            )
+
+            # 段IDの確定後に配置を作成（インスタンスではなくIDを渡して生成コストを抑える）
+            user_id = user.pk if user else None
+            counts[Counter.PLACEMENTS] += sum(len(rows) for _, _, rows in layouts)
+            ProductPlacement.objects.bulk_create(
+                [
+                    ProductPlacement(
+                        shelf_id=shelf.pk,
+                        segment_id=segment_map[level].pk,
+                        product_id=product.pk,
+                        x_position=x_position,
+                        face_count=face_count,
+                        occupied_width=product.width * face_count,
+                        created_by_id=user_id,
+                        updated_by_id=user_id
+                    )
+                    for shelf, segment_map, rows in layouts
+                    for level, product, x_position, face_count in rows
+                ],
+                batch_size=batch_size
+            )
+            if existing_ids:
+                Shelf.objects.filter(pk__in=existing_ids).update(
+                    layout_revision=F('layout_revision') + 1
+                )
+            Counter.add(**counts)
+
+
+class ShelfLayoutImportService:
+    """棚レイアウトのエクスポート形式（export_shelf_layout_json）を一括で取り込むサービス"""
+
+    # 1トランザクションで取り込む棚数
+    DOCUMENT_CHUNK_SIZE = 50
+    # 棚ごとの結果に含めるエラーの上限
+    MAX_DOCUMENT_ERRORS = 20
+
+    @classmethod
+    def import_layouts(cls, source, user, replace=True, skip_invalid=False, batch_size=1000):
+        """JSON（1件またはその配列）・NDJSON（1行1棚）の棚レイアウトを取り込む
+
+        source はファイル（テキスト・バイナリ）または文字列。
+        棚名・設置場所が一致する既存の棚があればそのレイアウトを置き換え、なければ
+        （replace=False の場合は常に）棚を新規作成する。商品は DOCUMENT_CHUNK_SIZE 件の棚ごとに
+        JANコードでまとめて解決し、配置はメモリ上で検証してから一括で書き込む。
+        不正な配置がある棚は取り込まず、skip_invalid=True の場合は不正な配置を除外して取り込む
+        （除外した配置のエラーも errors に含める）。
+        戻り値: 棚ごとの結果（index, shelf_id, name, created, success, placement_count, skipped_count, errors）
+        """
+        if isinstance(source, str):
+            source = io.StringIO(source)
+        elif isinstance(source, bytes):
+            source = io.BytesIO(source)
+        if not isinstance(source, io.TextIOBase):
+            source = io.TextIOWrapper(source, encoding='utf-8-sig')
+
+        reports = []
+        chunk = []
+        for index, document in enumerate(cls._iter_documents(source), 1):
+            if isinstance(document, str):
+                reports.append(cls._report(index, '', errors=[document]))
+                continue
+            chunk.append((index, document))
+            if len(chunk) >= cls.DOCUMENT_CHUNK_SIZE:
+                reports.extend(cls._import_chunk(chunk, user, replace, skip_invalid, batch_size))
+                chunk = []
+        if chunk:
+            reports.extend(cls._import_chunk(chunk, user, replace, skip_invalid, batch_size))
+        reports.sort(key=lambda report: report['index'])
+        return reports
+
+    @staticmethod
+    def _iter_documents(stream):
+        """レイアウトを1件ずつ返す（解析できない行はエラーメッセージの文字列を返す）"""
+        first = stream.readline()
+        while first and not first.strip():
+            first = stream.readline()
+        if not first:
+            return
+
+        try:
+            document = json.loads(first)
+        except ValueError:
+            document = None
+        if isinstance(document, dict):
+            # NDJSON
+            yield document
+            for line_number, line in enumerate(stream, 2):
+                if not line.strip():
+                    continue
+                try:
+                    document = json.loads(line)
+                except ValueError as e:
+                    yield f'{line_number}行目のJSONを解析できません: {e}'
+                    continue
+                yield document if isinstance(document, dict) else f'{line_number}行目が棚レイアウトではありません'
+            return
+
+        # 整形されたJSON（1件または配列）
+        try:
+            data = json.loads(first + stream.read())
+        except ValueError as e:
+            yield f'JSONを解析できません: {e}'
+            return
+        for document in data if isinstance(data, list) else [data]:
+            yield document if isinstance(document, dict) else '棚レイアウトではありません'
+
+    @staticmethod
+    def _report(index, name, created=False, errors=None):
+        return {
+            'index': index,
+            'shelf_id': None,
+            'name': name,
+            'created': created,
+            'success': False,
+            'placement_count': 0,
+            'skipped_count': 0,
+            'errors': errors or [],
+        }
+
+    @staticmethod
+    def _parse_document(document):
+        """レイアウトを (棚の値, [(段番号, 高さ)], [(段番号, JANコード, X座標, フェース数)]) に変換
+
+        形式が正しくない場合は ValidationError
+        """
+        try:
+            shelf_data = document['shelf']
+            shelf = {
+                'name': str(shelf_data['name']).strip(),
+                'width': float(shelf_data['width']),
+                'depth': float(shelf_data['depth']),
+                'location': str(shelf_data.get('location') or '').strip(),
+            }
+            segments = sorted(
+                (int(segment['level']), float(segment['height']))
+                for segment in document.get('segments', [])
+            )
+            placements = [
+                (int(placement['segment_level']), str(placement.get('product_jan') or ''),
+                 float(placement['x_position']), int(placement['face_count']))
+                for placement in document.get('placements', [])
+            ]
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValidationError(f'レイアウトの形式が正しくありません: {e}')
+
+        # float() は 'nan'・'inf' も受け付けるため、有限の値かを確認（比較では検出できない）
+        numbers = [shelf['width'], shelf['depth']]
+        numbers += [height for _, height in segments]
+        numbers += [x_position for _, _, x_position, _ in placements]
+        if not all(math.isfinite(value) for value in numbers):
+            raise ValidationError('棚の幅・奥行、段の高さ、X座標は有限の数値である必要があります')
+        if not shelf['name']:
+            raise ValidationError('棚名がありません')
+        if shelf['width'] <= 0 or shelf['depth'] <= 0:
+            raise ValidationError('棚の幅・奥行は0cmより大きい必要があります')
+        levels = [level for level, _ in segments]
+        if len(set(levels)) != len(levels):
+            raise ValidationError('段番号が重複しています')
+        if any(height <= 0 for _, height in segments):
+            raise ValidationError('段の高さは0cmより大きい必要があります')
+        return shelf, segments, placements
+
+    @classmethod
+    def _validate_placements(cls, shelf_width, segments, placements, products):
+        """配置をメモリ上で一括検証
+
+        戻り値: (取り込む配置 [(段番号, 商品, X座標, フェース数)], エラーメッセージの一覧)
+        """
+        errors = []
+        resolved = []
+        for level, jan_code, x_position, face_count in placements:
+            label = f'{level}段目 {jan_code or "JANなし"}'
+            product = products.get(jan_code)
+            if product is None:
+                errors.append(f'{label}: JANコードの商品が見つかりません')
+            elif x_position < 0:
+                errors.append(f'{label}: X座標は0以上である必要があります')
+            else:
+                resolved.append((level, product, x_position, face_count, label))
+        if not resolved:
+            return [], errors
+
+        # レイアウト内の配置同士の重なりは、段番号を段IDとみなした区間インデックスで判定
+        indexes = {}
+        for level, _ in segments:
+            indexes[level] = SegmentIntervalIndex(
+                (number, x_position, product.width * face_count)
+                for number, (row_level, product, x_position, face_count, _) in enumerate(resolved)
+                if row_level == level
+            )
+        checker = BatchPlacementChecker(
+            shelf_width,
+            dict(segments),
+            {
+                product.pk: (product.width, product.height, product.min_faces, product.max_faces)
+                for _, product, _, _, _ in resolved
+            },
+            indexes,
+        )
+        results = checker.check(
+            [row[0] for row in resolved],
+            [row[1].pk for row in resolved],
+            [row[2] for row in resolved],
+            [row[3] for row in resolved],
+            exclude_ids=range(len(resolved)),
+        )
+
+        valid = []
+        for row, result in zip(resolved, results):
+            if result['valid']:
+                valid.append(row[:4])
+                continue
+            messages = [message for field_messages in result['errors'].values() for message in field_messages]
+            if 'segment' in result['errors']:
+                messages = ['段がありません']
+            errors.append(f"{row[4]}: {' / '.join(messages)}")
+        return valid, errors
+
+    @classmethod
+    def _import_chunk(cls, chunk, user, replace, skip_invalid, batch_size):
+        """レイアウトの一部をまとめて検証し、1トランザクションで書き込む"""
+        reports = []
+        parsed = []
+        for index, document in chunk:
+            shelf_data = document.get('shelf')
+            report = cls._report(index, str(shelf_data.get('name', '')) if isinstance(shelf_data, dict) else '')
+            reports.append(report)
+            try:
+                parsed.append((report, *cls._parse_document(document)))
+            except ValidationError as e:
+                report['errors'].extend(e.messages)
+
+        jan_codes = {jan_code for _, _, _, placements in parsed for _, jan_code, _, _ in placements if jan_code}
+        products = Product.objects.filter(is_active=True, jan_code__in=jan_codes).in_bulk(field_name='jan_code')
+
+        existing = {}
+        if replace:
+            for shelf in Shelf.objects.filter(is_active=True, name__in={shelf['name'] for _, shelf, _, _ in parsed}):
+                existing.setdefault((shelf.name, shelf.location), []).append(shelf)
+
+        now = timezone.now()
+        plans = []
+        changed_shelves = []
+        targets = set()
+        for report, shelf_data, segments, placements in parsed:
+            key = (shelf_data['name'], shelf_data['location'])
+            if key in targets:
+                report['errors'].append('同じ棚のレイアウトが重複しています')
+                continue
+            targets.add(key)
+
+            matches = existing.get(key, [])
+            if len(matches) > 1:
+                report['errors'].append('棚名・設置場所が同じ棚が複数あります')
+                continue
+
+            rows, errors = cls._validate_placements(shelf_data['width'], segments, placements, products)
+            report['errors'].extend(errors[:cls.MAX_DOCUMENT_ERRORS])
+            if len(errors) > cls.MAX_DOCUMENT_ERRORS:
+                report['errors'].append(f'ほか{len(errors) - cls.MAX_DOCUMENT_ERRORS}件のエラー')
+            if errors and not skip_invalid:
+                continue
+            report['skipped_count'] = len(errors)
+
+            if matches:
+                shelf = matches[0]
+                if (shelf.width, shelf.depth) != (shelf_data['width'], shelf_data['depth']):
+                    shelf.width = shelf_data['width']
+                    shelf.depth = shelf_data['depth']
+                    shelf.updated_by = user
+                    shelf.updated_at = now
+                    changed_shelves.append(shelf)
+            else:
+                shelf = Shelf(**shelf_data, created_by=user, updated_by=user)
+                report['created'] = True
+            plans.append((shelf, segments, rows, report))
+
+        with transaction.atomic():
+            Shelf.objects.bulk_update(changed_shelves, ['width', 'depth', 'updated_by', 'updated_at'])
+            ShelfCloneService.write_layouts(user, plans, batch_size)
+        return reports
+
+
+def _init_print_worker():
+    """印刷パックのワーカープロセスの初期化（spawn で起動した場合は Django を初期化）"""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def _render_print_chunk(shelf_ids, fmt, width_px, show_images):
+    """印刷パックのページをまとめて描画（ワーカープロセスで実行）
+
+    棚・段・配置を3クエリで読み込み、shelf_ids の順に描画する（削除済みの棚は除外）。
+    戻り値: [(棚名, 設置場所, ページ)]。ページは PDF の場合 encode_page() の結果、
+    それ以外は PNG/SVG のバイト列
+    """
+    shelves = {
+        shelf.pk: shelf
+        for shelf in ShelfService.layout_queryset(Shelf.objects.filter(pk__in=shelf_ids, is_active=True))
+    }
+    pages = []
+    for shelf_id in shelf_ids:
+        shelf = shelves.get(shelf_id)
+        if shelf is None:
+            continue
+        payload = ShelfService.get_layout_payload(shelf)
+        if fmt == 'pdf':
+            page = encode_page(draw_planogram(shelf, payload, width_px, show_images=show_images))
+        elif fmt == 'png':
+            page = render_png(shelf, payload, width_px, show_images=show_images)
+        else:
+            page = render_svg(shelf, payload, show_images=show_images).encode()
+        pages.append((shelf.name, shelf.location, page))
+    return pages
+
+
+class ShelfPrintPackService:
+    """複数の棚の棚割り図をまとめた印刷パック（PDF/ZIP）を生成するサービス"""
+
+    FORMATS = ('pdf', 'png', 'svg')
+    # ワーカーへ1回で渡す棚数
+    CHUNK_SIZE = 10
+    # 描画幅(px)の既定値（A4横で約150dpi）
+    DEFAULT_WIDTH = 1600
+
+    @classmethod
+    def build(cls, queryset, output_path, fmt='pdf', workers=None, width_px=None, show_images=False,
+              progress=None):
+        """queryset の棚の印刷パックを output_path へ書き出す
+
+        fmt='pdf' は1棚1ページ（しおり付き）のPDF、'png'/'svg' は棚ごとの画像をまとめたZIP。
+        棚は設置場所・棚名順にプロセスプールで CHUNK_SIZE 件ずつ並列に描画し、
+        描画中のチャンクをワーカー数の2倍までに制限して順にファイルへ書き出すため、
+        メモリに保持するのは棚IDの一覧と描画中のページのみ。
+        workers=1 の場合は現在のプロセスで描画する。
+        progress(完了数, 総数, 棚名) は1棚書き出すごとに呼ばれる。
+        戻り値: {'output', 'format', 'shelf_count', 'page_count', 'size'}
+        """
+        if fmt not in cls.FORMATS:
+            raise ValidationError(f'未対応の形式です: {fmt}')
+
+        shelf_ids = list(
+            queryset.filter(is_active=True).order_by('location', 'name', 'pk').values_list('pk', flat=True)
+        )
+        chunks = [shelf_ids[start:start + cls.CHUNK_SIZE] for start in range(0, len(shelf_ids), cls.CHUNK_SIZE)]
+        workers = max(min(workers or os.cpu_count() or 1, len(chunks)), 1)
+
+        temp_path = f'{output_path}.part'
+        done = 0
+        try:
+            with open(temp_path, 'wb') as file, cls._page_writer(file, fmt) as write_page:
+                for pages in cls._render(chunks, fmt, width_px or cls.DEFAULT_WIDTH, show_images, workers):
+                    for name, location, page in pages:
+                        done += 1
+                        write_page(done, name, location, page)
+                        if progress:
+                            progress(done, len(shelf_ids), name)
+            os.replace(temp_path, output_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return {
+            'output': str(output_path),
+            'format': fmt,
+            'shelf_count': len(shelf_ids),
+            'page_count': done,
+            'size': os.path.getsize(output_path),
+        }
+
+    @staticmethod
+    def _render(chunks, fmt, width_px, show_images, workers):
+        """チャンクごとの描画結果を順に返す"""
+        if workers <= 1:
+            for chunk in chunks:
+                yield _render_print_chunk(chunk, fmt, width_px, show_images)
+            return
+
+        # 子プロセスへDB接続を引き継がないよう閉じておく（必要になれば再接続される）
+        connections.close_all()
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_print_worker) as executor:
+            try:
+                for chunk in chunks:
+                    pending.append(executor.submit(_render_print_chunk, chunk, fmt, width_px, show_images))
+                    if len(pending) >= workers * 2:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    @staticmethod
+    @contextmanager
+    def _page_writer(file, fmt):
+        """ページを1件ずつ書き出す関数 write_page(番号, 棚名, 設置場所, ページ) を返す"""
+        if fmt == 'pdf':
+            with PdfImageWriter(file) as writer:
+                yield lambda number, name, location, page: writer.add_encoded_page(
+                    *page, title=f'{location} {name}'.strip()
+                )
+            return
+
+        compression = zipfile.ZIP_STORED if fmt == 'png' else zipfile.ZIP_DEFLATED
+        with zipfile.ZipFile(file, 'w') as archive:
+            def write_page(number, name, location, page):
+                filename = re.sub(r'[\\/:*?"<>|\s]+', '_', f'{location} {name}'.strip())
+                archive.writestr(f'{number:04d}_{filename}.{fmt}', page, compress_type=compression)
+            yield write_page
+
+    @classmethod
+    def run_job(cls, output_path, fmt='pdf', location=None, shelf_ids=None, workers=None, width_px=None,
+                show_images=False):
+        """ジョブキュー・cron から呼び出すエントリポイント（引数・戻り値はJSONに変換できる値のみ）
+
+        location・shelf_ids で対象の棚を絞り込み（省略時は全棚）、進捗はログへ出力する。
+        """
+        queryset = Shelf.objects.filter(is_active=True)
+        if location:
+            queryset = queryset.filter(location=location)
+        if shelf_ids:
+            queryset = queryset.filter(pk__in=shelf_ids)
+
+        def progress(done, total, name):
+            if done % cls.CHUNK_SIZE == 0 or done == total:
+                logger.info('印刷パック生成中: %d/%d (%s)', done, total, name)
+
+        return cls.build(
+            queryset, output_path, fmt=fmt, workers=workers, width_px=width_px,
+            show_images=show_images, progress=progress
+        )
@@ -0,0 +1,129 @@
+# apps/shelves/snapshots.py
+"""
+棚レイアウトスナップショットの符号化
+
+段・配置を列ごとの整数配列（座標は固定小数点）に変換し、差分符号化した上でzlib圧縮する。
+"""
+import struct
+import zlib
+
+import numpy as np
+
+FORMAT_VERSION = 1
+# 座標・寸法の固定小数点の倍率（小数点以下6桁まで保持）
+SCALE = 10 ** 6
+HEADER = struct.Struct('<BII')
+
+
+def _to_fixed(values):
+    return np.rint(np.asarray(values, dtype=np.float64) * SCALE).astype(np.int64)
+
+
+def _from_fixed(values):
+    return (values / SCALE).tolist()
+
+
+def _delta(values):
+    """先頭値と隣接差分の配列に変換"""
+    values = np.asarray(values, dtype=np.int64)
+    return np.diff(values, prepend=np.int64(0))
+
+
+def _undelta(values):
+    return np.cumsum(values, dtype=np.int64)
+
+
+def encode_layout(segments, placements):
+    """レイアウトを圧縮バイト列に符号化
+
+    segments: [(段番号, 高さ)]
+    placements: [(段番号, 商品ID, X座標, フェース数)]
+    """
+    segments = sorted(segments)
+    placements = sorted(placements, key=lambda row: (row[0], row[2], row[1]))
+
+    columns = [
+        _delta([level for level, _ in segments]),
+        _to_fixed([height for _, height in segments]),
+        _delta([row[0] for row in placements]),
+        _delta([row[1] for row in placements]),
+        # 段内はX座標順のため差分は小さい正の値になる
+        _delta(_to_fixed([row[2] for row in placements])),
+        np.asarray([row[3] for row in placements], dtype=np.int64),
+    ]
+    body = b''.join(column.astype('<i8').tobytes() for column in columns)
+    return HEADER.pack(FORMAT_VERSION, len(segments), len(placements)) + zlib.compress(body, 9)
+
+
+def decode_layout(data):
+    """圧縮バイト列からレイアウトを復元
+
+    戻り値: {'segments': [(段番号, 高さ)], 'placements': [(段番号, 商品ID, X座標, フェース数)]}
+    """
+    version, segment_count, placement_count = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'未対応のスナップショット形式です: {version}')
+
+    body = np.frombuffer(zlib.decompress(bytes(data[HEADER.size:])), dtype='<i8')
+    sizes = [segment_count, segment_count] + [placement_count] * 4
+    columns = np.split(body, np.cumsum(sizes)[:-1])
+
+    levels = _undelta(columns[0]).tolist()
+    heights = _from_fixed(columns[1])
+    placement_levels = _undelta(columns[2]).tolist()
+    product_ids = _undelta(columns[3]).tolist()
+    x_positions = _from_fixed(_undelta(columns[4]))
+    face_counts = columns[5].tolist()
+
+    return {
+        'segments': list(zip(levels, heights)),
+        'placements': list(zip(placement_levels, product_ids, x_positions, face_counts)),
+    }
+
+
+def diff_layouts(before, after):
+    """2つのレイアウト（decode_layout の形式）の差分
+
+    配置は (段番号, 商品ID, 同一段内での出現順) で対応付ける。
+    """
+    def keyed(placements):
+        counts = {}
+        rows = {}
+        for level, product_id, x_position, face_count in placements:
+            ordinal = counts[(level, product_id)] = counts.get((level, product_id), 0) + 1
+            rows[(level, product_id, ordinal)] = (x_position, face_count)
+        return rows
+
+    before_segments = dict(before['segments'])
+    after_segments = dict(after['segments'])
+    before_rows = keyed(before['placements'])
+    after_rows = keyed(after['placements'])
+
+    def placement(key, values):
+        return {'level': key[0], 'product_id': key[1], 'x_position': values[0], 'face_count': values[1]}
+
+    return {
+        'segments': {
+            'added': sorted(set(after_segments) - set(before_segments)),
+            'removed': sorted(set(before_segments) - set(after_segments)),
+            'resized': [
+                {'level': level, 'before': before_segments[level], 'after': after_segments[level]}
+                for level in sorted(set(before_segments) & set(after_segments))
+                if before_segments[level] != after_segments[level]
+            ],
+        },
+        'placements': {
+            'added': [placement(key, after_rows[key]) for key in sorted(after_rows.keys() - before_rows.keys())],
+            'removed': [placement(key, before_rows[key]) for key in sorted(before_rows.keys() - after_rows.keys())],
+            'changed': [
+                {
+                    'level': key[0],
+                    'product_id': key[1],
+                    'before': {'x_position': before_rows[key][0], 'face_count': before_rows[key][1]},
+                    'after': {'x_position': after_rows[key][0], 'face_count': after_rows[key][1]},
+                }
+                for key in sorted(before_rows.keys() & after_rows.keys())
+                if before_rows[key] != after_rows[key]
+            ],
+        },
+    }
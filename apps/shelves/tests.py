@@ -1,3 +1,1227 @@
+# apps/shelves/tests.py
+"""
+棚管理機能のテスト
+"""
+import json
+import random
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+from apps.core.models import Counter
+from apps.products.models import Category, Manufacturer, Product
+from .models import Shelf, ShelfSegment, ProductPlacement, ShelfLayoutSnapshot
+from .constraints import PlacementConstraints
+from .intervals import SegmentIntervalIndex
+from .services import ShelfService
+
+User = get_user_model()
+
+
+class ShelfTestMixin:
+    """棚テスト用の共通データ作成"""
+
+    def create_base_data(self):
+        # テスト間でIDが再利用されるため、レイアウトのキャッシュを消去
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='shelfuser',
+            email='shelf@example.com',
+            password='testpass123'
+        )
+        self.category = Category.objects.create(name='飲料', code='C01')
+        self.own_maker = Manufacturer.objects.create(name='自社', code='M01', is_own_company=True)
+        self.other_maker = Manufacturer.objects.create(name='競合', code='M02')
+        self.shelf = Shelf.objects.create(name='テスト棚', width=90, depth=45)
+        self.segment = ShelfSegment.objects.create(shelf=self.shelf, level=1, height=30)
+
+    def create_product(self, name, width=10, height=20, manufacturer=None, **kwargs):
+        return Product.objects.create(
+            name=name,
+            manufacturer=manufacturer or self.own_maker,
+            category=self.category,
+            width=width,
+            height=height,
+            depth=10,
+            **kwargs
+        )
+
+    def place(self, product, x_position, face_count=1, segment=None):
+        segment = segment or self.segment
+        return ProductPlacement.objects.create(
+            shelf=segment.shelf,
+            segment=segment,
+            product=product,
+            x_position=x_position,
+            face_count=face_count
+        )
+
+
+class SegmentIntervalIndexTest(TestCase):
+    """区間インデックスのテスト"""
+
+    @staticmethod
+    def legacy_overlaps(entries, start, end, exclude_id=None):
+        for placement_id, x_position, width in entries:
+            if placement_id == exclude_id:
+                continue
+            if not (end <= x_position or start >= x_position + width):
+                return True
+        return False
+
+    @staticmethod
+    def legacy_start_between(entries, low, high):
+        return any(low < x_position < high for _, x_position, _ in entries)
+
+    def test_matches_linear_scan(self):
+        """線形走査と同じ判定結果になること"""
+        rng = random.Random(42)
+        for _ in range(200):
+            entries = [
+                (i + 1, float(rng.randint(0, 80)), float(rng.randint(1, 20)))
+                for i in range(rng.randint(0, 15))
+            ]
+            index = SegmentIntervalIndex(entries)
+            for _ in range(20):
+                start = float(rng.randint(-5, 90))
+                end = start + rng.randint(1, 25)
+                exclude_id = rng.choice([None] + [e[0] for e in entries])
+                self.assertEqual(
+                    index.overlaps(start, end, exclude_id=exclude_id),
+                    self.legacy_overlaps(entries, start, end, exclude_id)
+                )
+                self.assertEqual(
+                    index.has_start_between(start - 5, end),
+                    self.legacy_start_between(entries, start - 5, end)
+                )
+
+    def test_touching_intervals_do_not_overlap(self):
+        """端が接するだけの配置は重複にならないこと"""
+        index = SegmentIntervalIndex([(1, 0.0, 10.0), (2, 20.0, 10.0)])
+        self.assertFalse(index.overlaps(10.0, 20.0))
+        self.assertTrue(index.overlaps(9.5, 20.0))
+        self.assertFalse(SegmentIntervalIndex().overlaps(0.0, 100.0))
+
+    def test_free_gaps(self):
+        """重なりのある配置を含めて空き区間を求められること"""
+        index = SegmentIntervalIndex([(1, 5.0, 10.0), (2, 10.0, 20.0), (3, 40.0, 10.0), (4, 40.0, 5.0)])
+        self.assertEqual(index.free_gaps(90.0), [(0.0, 5.0), (30.0, 40.0), (50.0, 90.0)])
+        self.assertEqual(index.free_gaps(90.0, min_width=10.0), [(30.0, 40.0), (50.0, 90.0)])
+        self.assertEqual(SegmentIntervalIndex().free_gaps(60.0), [(0.0, 60.0)])
+        self.assertEqual(SegmentIntervalIndex([(1, 0.0, 60.0)]).free_gaps(60.0), [])
+
+
+class PlacementOverlapTest(ShelfTestMixin, TestCase):
+    """配置重複チェックのテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        self.product = self.create_product('お茶', width=10)
+        self.existing = self.place(self.product, 20, face_count=2)
+
+    def test_model_clean_detects_overlap(self):
+        placement = ProductPlacement(
+            shelf=self.shelf, segment=self.segment, product=self.product,
+            x_position=35, face_count=1
+        )
+        self.assertTrue(placement._check_overlap())
+
+        placement.x_position = 40
+        self.assertFalse(placement._check_overlap())
+
+    def test_model_excludes_itself(self):
+        self.assertFalse(self.existing._check_overlap())
+
+    def test_constraint_check(self):
+        with self.assertRaises(ValidationError):
+            PlacementConstraints.check_overlap_constraint(self.segment, 15, 10)
+        self.assertTrue(PlacementConstraints.check_overlap_constraint(
+            self.segment, 15, 10, exclude_placement=self.existing
+        ))
+
+    def test_service_validation_keeps_start_based_check(self):
+        errors = ShelfService.validate_placement(self.shelf, self.segment, self.product, 12, 1)
+        self.assertIn('他の商品と配置が重複します', errors)
+
+        # 既存配置の開始位置より右側は従来仕様どおり重複扱いにならない
+        errors = ShelfService.validate_placement(self.shelf, self.segment, self.product, 30, 1)
+        self.assertEqual(errors, [])
+
+    def test_index_is_refreshed_after_save(self):
+        self.assertTrue(PlacementConstraints.check_overlap_constraint(self.segment, 60, 10))
+        self.place(self.product, 60)
+        with self.assertRaises(ValidationError):
+            PlacementConstraints.check_overlap_constraint(self.segment, 60, 10)
+
+
+class BatchPlacementValidationTest(ShelfTestMixin, TestCase):
+    """配置一括バリデーションのテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        self.upper = ShelfSegment.objects.create(shelf=self.shelf, level=2, height=15)
+        self.products = [
+            self.create_product('お茶', width=10, height=20, max_faces=4),
+            self.create_product('水', width=7.5, height=12, min_faces=2),
+            self.create_product('ジュース', width=6, height=14, manufacturer=self.other_maker),
+        ]
+        self.existing = [
+            self.place(self.products[0], 0, face_count=2),
+            self.place(self.products[2], 40),
+            self.place(self.products[1], 10, face_count=2, segment=self.upper),
+        ]
+
+    def full_clean_errors(self, candidate):
+        placement = ProductPlacement(
+            shelf=self.shelf,
+            segment=ShelfSegment.objects.get(pk=candidate['segment_id']),
+            product=Product.objects.get(pk=candidate['product_id']),
+            x_position=candidate['x_position'],
+            face_count=candidate['face_count'],
+        )
+        if candidate.get('placement_id'):
+            placement.pk = candidate['placement_id']
+        try:
+            placement.clean()
+        except ValidationError as e:
+            return e.message_dict
+        return {}
+
+    def test_matches_model_clean(self):
+        """ProductPlacement.clean() と同じ判定になること"""
+        rng = random.Random(7)
+        candidates = []
+        for _ in range(300):
+            candidates.append({
+                'segment_id': rng.choice([self.segment.pk, self.upper.pk]),
+                'product_id': rng.choice(self.products).pk,
+                'x_position': float(rng.randint(0, 90)),
+                'face_count': rng.randint(1, 5),
+                'placement_id': rng.choice([None] + [p.pk for p in self.existing]),
+            })
+
+        results = ShelfService.validate_placements_batch(self.shelf, candidates)
+
+        self.assertEqual(len(results), len(candidates))
+        for candidate, result in zip(candidates, results):
+            self.assertEqual(result['errors'], self.full_clean_errors(candidate))
+            self.assertEqual(result['valid'], not result['errors'])
+
+    def test_unknown_segment_and_product(self):
+        other_shelf = Shelf.objects.create(name='別棚', width=60, depth=30)
+        other_segment = ShelfSegment.objects.create(shelf=other_shelf, level=1, height=30)
+
+        results = ShelfService.validate_placements_batch(self.shelf, [
+            {'segment_id': other_segment.pk, 'product_id': self.products[0].pk, 'x_position': 0, 'face_count': 1},
+            {'segment_id': self.segment.pk, 'product_id': 999999, 'x_position': 60, 'face_count': 1},
+        ])
+
+        self.assertIn('segment', results[0]['errors'])
+        self.assertIn('product', results[1]['errors'])
+        self.assertFalse(any(result['valid'] for result in results))
+        self.assertIsNone(results[1]['required_width'])
+
+        # APIの応答は NaN を含まない厳密なJSONであること
+        def reject_constant(name):
+            raise ValueError(f'JSONに {name} が含まれています')
+
+        self.client.force_login(self.user)
+        response = self.client.post(
+            f'/shelves/api/{self.shelf.pk}/placement/validate-batch/',
+            data={'candidates': [
+                {'segment_id': self.segment.pk, 'product_id': 999999, 'x_position': 60, 'face_count': 1},
+            ]},
+            content_type='application/json'
+        )
+        data = json.loads(response.content, parse_constant=reject_constant)
+        self.assertIsNone(data['results'][0]['required_width'])
+
+    def test_non_finite_x_position(self):
+        results = ShelfService.validate_placements_batch(self.shelf, [
+            {'segment_id': self.segment.pk, 'product_id': self.products[0].pk, 'x_position': value, 'face_count': 1}
+            for value in (float('nan'), float('inf'), float('-inf'))
+        ])
+
+        self.assertFalse(any(result['valid'] for result in results))
+        self.assertTrue(all(
+            result['errors']['x_position'] == ['X座標は有限の数値である必要があります。'] for result in results
+        ))
+        self.assertIsNone(results[0]['end_position'])
+
+    def test_api(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            f'/shelves/api/{self.shelf.pk}/placement/validate-batch/',
+            data={'candidates': [
+                {'segment_id': self.segment.pk, 'product_id': self.products[0].pk, 'x_position': 60, 'face_count': 1},
+                {'segment_id': self.segment.pk, 'product_id': self.products[0].pk, 'x_position': 5, 'face_count': 1},
+            ]},
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([r['valid'] for r in data['results']], [True, False])
+        self.assertEqual(data['valid_count'], 1)
+
+
+class PlacementChangesetTest(ShelfTestMixin, TestCase):
+    """配置変更セットのテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        self.product = self.create_product('お茶', width=10)
+        self.first = self.place(self.product, 0)
+        self.second = self.place(self.product, 10)
+        self.url = f'/shelves/api/{self.shelf.pk}/placement/changeset/'
+        self.client.force_login(self.user)
+
+    def post(self, operations, **extra):
+        return self.client.post(
+            self.url, data={'operations': operations, **extra}, content_type='application/json'
+        )
+
+    def test_rearrange_validated_against_final_state(self):
+        """変更後の状態で重複しなければ途中の重複は許容されること"""
+        revision = Shelf.objects.get(pk=self.shelf.pk).layout_revision
+        response = self.post([
+            {'op': 'update', 'placement_id': self.first.pk, 'x_position': 10},
+            {'op': 'update', 'placement_id': self.second.pk, 'x_position': 20},
+            {'op': 'create', 'segment_id': self.segment.pk, 'product_id': self.product.pk, 'x_position': 0},
+        ], base_revision=revision)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['revision'], revision + 1)
+        self.assertTrue(all(result['valid'] for result in data['results']))
+        self.assertEqual(
+            list(ProductPlacement.objects.filter(segment=self.segment, is_active=True)
+                 .order_by('x_position').values_list('x_position', flat=True)),
+            [0, 10, 20]
+        )
+        self.assertIsNotNone(data['results'][2]['placement']['id'])
+
+    def test_invalid_changeset_is_not_applied(self):
+        response = self.post([
+            {'op': 'delete', 'placement_id': self.first.pk},
+            {'op': 'update', 'placement_id': self.second.pk, 'x_position': 85},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertTrue(results[0]['valid'])
+        self.assertIn('x_position', results[1]['errors'])
+        self.assertTrue(ProductPlacement.objects.get(pk=self.first.pk).is_active)
+        self.assertEqual(ProductPlacement.objects.get(pk=self.second.pk).x_position, 10)
+
+    def test_stale_revision_conflicts(self):
+        response = self.post([{'op': 'delete', 'placement_id': self.first.pk}], base_revision=0)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(ProductPlacement.objects.get(pk=self.first.pk).is_active)
+
+
+class SegmentReflowTest(ShelfTestMixin, TestCase):
+    """段のy_position再計算のテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        self.segments = [self.segment] + [
+            ShelfSegment.objects.create(shelf=self.shelf, level=level, height=height)
+            for level, height in [(2, 25), (3, 20), (4, 15)]
+        ]
+
+    def positions(self):
+        return list(
+            ShelfSegment.objects.filter(shelf=self.shelf, is_active=True)
+            .order_by('level').values_list('y_position', flat=True)
+        )
+
+    def test_positions_are_prefix_sums(self):
+        self.assertEqual(self.positions(), [0, 30, 55, 75])
+
+    def test_height_change_reflows_upper_segments_in_constant_queries(self):
+        segment = self.segments[1]
+        segment.height = 40
+        # 保存・版数加算（セーブポイント2件を含む）+ 段の取得・一括更新
+        with self.assertNumQueries(6):
+            segment.save()
+        self.assertEqual(self.positions(), [0, 30, 70, 90])
+
+    def test_delete_reflows(self):
+        self.segments[0].delete()
+        self.assertEqual(self.positions(), [0, 25, 45])
+
+    def test_height_api_returns_reflowed_position(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            f'/shelves/api/segment/{self.segments[0].pk}/height/', {'height': 35}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['segment']['y_position'], 0)
+        self.assertEqual(self.positions(), [0, 35, 60, 80])
+
+
+class SegmentCounterTest(ShelfTestMixin, TestCase):
+    """段の使用幅・配置数集計のテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        self.upper = ShelfSegment.objects.create(shelf=self.shelf, level=2, height=30)
+        self.product = self.create_product('お茶', width=10)
+
+    def counters(self, segment):
+        segment.refresh_from_db()
+        return segment.used_width, segment.active_placement_count
+
+    def test_create_update_delete(self):
+        placement = self.place(self.product, 0, face_count=2)
+        self.place(self.product, 30)
+        self.assertEqual(self.counters(self.segment), (30, 2))
+
+        placement.face_count = 3
+        placement.save()
+        self.assertEqual(self.counters(self.segment), (40, 2))
+
+        placement.segment = self.upper
+        placement.save()
+        self.assertEqual(self.counters(self.segment), (10, 1))
+        self.assertEqual(self.counters(self.upper), (30, 1))
+
+        placement.delete()
+        self.assertEqual(self.counters(self.upper), (0, 0))
+
+    def test_product_width_change(self):
+        self.place(self.product, 0, face_count=2)
+        product = Product.objects.get(pk=self.product.pk)
+        product.width = 12.5
+        product.save()
+
+        self.assertEqual(self.counters(self.segment), (25, 1))
+        self.assertEqual(ProductPlacement.objects.get().occupied_width, 25)
+
+    def test_segment_save_keeps_counters(self):
+        stale = ShelfSegment.objects.get(pk=self.segment.pk)
+        self.place(self.product, 0)
+        stale.height = 35
+        stale.save()
+        self.assertEqual(self.counters(self.segment), (10, 1))
+
+    def test_available_width_without_queries(self):
+        self.place(self.product, 0, face_count=3)
+        segment = ShelfSegment.objects.select_related('shelf').get(pk=self.segment.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(segment.available_width, 60)
+
+    def test_repair_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        self.place(self.product, 0, face_count=2)
+        ShelfSegment.objects.filter(pk=self.segment.pk).update(used_width=5, active_placement_count=7)
+
+        out = StringIO()
+        call_command('repair_segment_counters', '--check', stdout=out)
+        self.assertIn('集計のずれがある段: 1件', out.getvalue())
+        self.assertEqual(self.counters(self.segment), (5, 7))
+
+        call_command('repair_segment_counters', stdout=StringIO())
+        self.assertEqual(self.counters(self.segment), (20, 1))
+
+
+class LayoutOptimizerTest(ShelfTestMixin, TestCase):
+    """レイアウト最適化のテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        self.low = ShelfSegment.objects.create(shelf=self.shelf, level=2, height=15)
+        self.tall = self.create_product('2Lボトル', width=11, height=28, max_faces=3, recommended_faces=2)
+        self.products = [self.tall] + [
+            self.create_product(f'商品{i}', width=6 + i, height=12, max_faces=4, recommended_faces=2,
+                                manufacturer=self.other_maker if i % 2 else self.own_maker)
+            for i in range(8)
+        ]
+        self.existing = self.place(self.tall, 0)
+
+    def test_engine_respects_constraints(self):
+        from .optimizer import LayoutOptimizer
+
+        segments = [(1, 30), (2, 15)]
+        products = [
+            (p.pk, p.width, p.height, p.min_faces, p.max_faces, p.recommended_faces, p.is_own_product)
+            for p in self.products
+        ]
+        result = LayoutOptimizer(90, segments, products).run(time_budget=0.2, seed=1)
+
+        ends = {}
+        for placement in result['placements']:
+            product = next(p for p in self.products if p.pk == placement['product_id'])
+            self.assertLessEqual(product.height, dict(segments)[placement['segment_id']])
+            self.assertTrue(product.min_faces <= placement['face_count'] <= product.max_faces)
+            self.assertEqual(placement['x_position'], ends.get(placement['segment_id'], 0))
+            ends[placement['segment_id']] = placement['x_position'] + product.width * placement['face_count']
+        self.assertTrue(all(end <= 90 for end in ends.values()))
+        self.assertGreater(result['fill_ratio'], 0.8)
+
+    def test_rejects_non_finite_time_budget(self):
+        from .optimizer import LayoutOptimizer
+
+        with self.assertRaises(ValueError):
+            LayoutOptimizer(90, [(1, 30)], []).run(time_budget=float('nan'))
+
+        self.client.force_login(self.user)
+        for value in ('nan', 'inf', '-1'):
+            response = self.client.post(
+                f'/shelves/api/{self.shelf.pk}/optimize/',
+                data={'time_budget': value},
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400, value)
+
+    def test_rejects_out_of_range_weights(self):
+        from .optimizer import LayoutOptimizer
+
+        for weights in ({'fill': -1}, {'own': float('nan')}, {'recommended': 1e308}):
+            with self.assertRaises(ValueError):
+                LayoutOptimizer(90, [(1, 30)], [], weights=weights)
+
+        self.client.force_login(self.user)
+        for weights in ({'fill': -1, 'recommended': -1, 'own': -1}, {'fill': 1e308}, {'own': 'inf'}):
+            response = self.client.post(
+                f'/shelves/api/{self.shelf.pk}/optimize/',
+                data={'time_budget': 0.1, 'weights': weights},
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400, weights)
+            self.assertFalse(response.json()['success'])
+
+    def test_proposal_is_a_valid_changeset(self):
+        from .services import PlacementChangesetService
+
+        proposal = ShelfService.optimize_shelf_layout(
+            self.shelf, product_ids=[p.pk for p in self.products], time_budget=0.2, seed=1
+        )
+        # 提案だけではDBは変わらない
+        self.assertEqual(ProductPlacement.objects.filter(is_active=True).count(), 1)
+        self.assertIn(
+            {'op': 'update', 'placement_id': self.existing.pk},
+            [{'op': op['op'], 'placement_id': op.get('placement_id')} for op in proposal['operations']]
+        )
+
+        outcome = PlacementChangesetService.apply(
+            self.shelf, proposal['operations'], self.user, proposal['base_revision']
+        )
+        self.assertTrue(outcome['success'], outcome['results'])
+        self.assertEqual(
+            ProductPlacement.objects.filter(is_active=True).count(),
+            proposal['summary']['placed_count']
+        )
+
+
+class FacingAllocationTest(ShelfTestMixin, TestCase):
+    """段内フェース配分のテスト"""
+
+    def test_solver_respects_bounds_and_width(self):
+        from .optimizer import allocate_facings
+
+        products = [(1, 10, 1, 5, 2), (2, 7.5, 1, 4, 2), (3, 5, 2, 6, 3)]
+        result = allocate_facings(90, products)
+        facings = dict(result['facings'])
+
+        self.assertLessEqual(result['used_width'], 90)
+        for product_id, _, min_faces, max_faces, recommended in products:
+            self.assertTrue(min_faces <= facings[product_id] <= max_faces)
+            self.assertGreaterEqual(facings[product_id], recommended)
+
+    def test_lowest_priority_dropped_when_infeasible(self):
+        from .optimizer import allocate_facings
+
+        result = allocate_facings(20, [(1, 10, 1, 5, 2), (2, 7.5, 1, 4, 2), (3, 5, 2, 6, 3)])
+        self.assertEqual(dict(result['facings']), {1: 1, 2: 1, 3: 0})
+
+    def test_api_rebalances_listed_products(self):
+        self.create_base_data()
+        tea = self.create_product('お茶', width=10, max_faces=6, recommended_faces=2)
+        water = self.create_product('水', width=5, max_faces=6, recommended_faces=2)
+        other = self.create_product('その他', width=30)
+        self.place(tea, 0, face_count=5)
+        self.place(other, 60)
+
+        self.client.force_login(self.user)
+        response = self.client.get(
+            f'/shelves/api/segment/{self.segment.pk}/facings/',
+            {'product_ids': f'{tea.pk},{water.pk}'}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['free_width'], 60)
+        self.assertLessEqual(data['used_width'], 60)
+        self.assertTrue(all(f['face_count'] >= 2 for f in data['facings']))
+
+
+class FreeGapTest(ShelfTestMixin, TestCase):
+    """空き区間APIのテスト"""
+
+    def test_api_filters_by_product(self):
+        self.create_base_data()
+        upper = ShelfSegment.objects.create(shelf=self.shelf, level=2, height=15)
+        small = self.create_product('小', width=10)
+        tall = self.create_product('大', width=10, height=25)
+        self.place(small, 10, face_count=2)  # 10-30
+        self.place(small, 45)                # 45-55
+
+        self.client.force_login(self.user)
+        # 認証2件 + 棚・商品・段・配置（配置は棚単位で1回）
+        with self.assertNumQueries(6):
+            response = self.client.get(
+                f'/shelves/api/{self.shelf.pk}/gaps/',
+                {'product_id': tall.pk, 'face_count': 2}
+            )
+
+        data = response.json()
+        lower, upper_data = data['segments']
+        self.assertEqual(upper_data['segment_id'], upper.pk)
+        self.assertFalse(upper_data['fits_height'])
+        self.assertEqual(upper_data['gaps'], [])
+        self.assertEqual(
+            [(gap['start'], gap['end'], gap['snap_positions']) for gap in lower['gaps']],
+            [(55.0, 90.0, [55.0, 70.0])]
+        )
+
+        response = self.client.get(f'/shelves/api/{self.shelf.pk}/gaps/')
+        lower, upper_data = response.json()['segments']
+        self.assertEqual([gap['width'] for gap in lower['gaps']], [10.0, 15.0, 35.0])
+        self.assertEqual([gap['width'] for gap in upper_data['gaps']], [90.0])
+
+
+class SegmentAlignmentTest(ShelfTestMixin, TestCase):
+    """配置整列のテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        product = self.create_product('お茶', width=10)
+        self.placements = [self.place(product, x) for x in (5, 30, 50)]
+
+    def positions(self):
+        return [
+            ProductPlacement.objects.get(pk=placement.pk).x_position
+            for placement in self.placements
+        ]
+
+    def test_operations(self):
+        from .services import SegmentAlignmentService
+
+        expected = {
+            'compact_left': [0, 10, 20],
+            'compact_right': [60, 70, 80],
+            'distribute': [15, 40, 65],
+        }
+        for operation, positions in expected.items():
+            outcome = SegmentAlignmentService.apply(self.shelf, operation, self.user)
+            self.assertTrue(outcome['success'])
+            self.assertEqual(self.positions(), positions)
+
+        # 2番目と3番目の間の隙間(50-65)を詰める
+        SegmentAlignmentService.apply(self.shelf, 'close_gap', self.user, x_position=55)
+        self.assertEqual(self.positions(), [15, 40, 50])
+        self.assertEqual(ShelfSegment.objects.get(pk=self.segment.pk).used_width, 30)
+
+    def test_api_single_bulk_update(self):
+        self.client.force_login(self.user)
+        revision = Shelf.objects.get(pk=self.shelf.pk).layout_revision
+
+        # 認証2件 + 棚取得・行ロック・配置取得・一括更新・版数更新 + セーブポイント2件
+        with self.assertNumQueries(9):
+            response = self.client.post(
+                f'/shelves/api/{self.shelf.pk}/align/',
+                data={'operation': 'compact_left', 'segment_id': self.segment.pk, 'base_revision': revision},
+                content_type='application/json'
+            )
+
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['revision'], revision + 1)
+        self.assertEqual(len(data['moved']), 3)
+
+        response = self.client.post(
+            f'/shelves/api/{self.shelf.pk}/align/',
+            data={'operation': 'compact_left', 'base_revision': revision},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 409)
+
+
+class LayoutSnapshotTest(ShelfTestMixin, TestCase):
+    """レイアウトスナップショットのテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        self.upper = ShelfSegment.objects.create(shelf=self.shelf, level=2, height=25)
+        self.tea = self.create_product('お茶', width=7.5)
+        self.water = self.create_product('水', width=6.25)
+        self.place(self.tea, 0.125, face_count=2)
+        self.place(self.water, 40, face_count=3)
+        self.place(self.tea, 10, segment=self.upper)
+
+    def test_encode_round_trip(self):
+        from .snapshots import encode_layout, decode_layout
+
+        segments = [(1, 30.5), (2, 25.0), (4, 12.333333)]
+        placements = [(2, 99, 80.1, 1), (1, 5, 0.0, 2), (1, 3, 33.3, 4), (4, 7, 12.000001, 1)]
+        data = encode_layout(segments, placements)
+
+        layout = decode_layout(data)
+        self.assertEqual(layout['segments'], segments)
+        self.assertEqual(layout['placements'], sorted(placements, key=lambda row: (row[0], row[2])))
+
+    def test_capture_and_restore(self):
+        from .services import ShelfSnapshotService
+
+        with self.assertNumQueries(2):  # 段・配置の読み込み + 保存
+            snapshot = ShelfLayoutSnapshot.capture(self.shelf, self.user, '初期')
+        self.assertEqual((snapshot.segment_count, snapshot.placement_count), (2, 3))
+
+        # レイアウトを変更
+        ProductPlacement.objects.filter(product=self.water).update(x_position=60, face_count=1)
+        ProductPlacement.objects.get(segment=self.upper).delete()
+        self.upper.is_active = False
+        self.upper.save()
+        diff = ShelfSnapshotService.diff(snapshot)
+        self.assertEqual(diff['segments']['removed'], [2])
+        self.assertEqual(len(diff['placements']['removed']), 1)
+        self.assertEqual(diff['placements']['changed'][0]['after'], {'x_position': 60, 'face_count': 1})
+
+        placement_rows = ProductPlacement.objects.count()
+        result = ShelfSnapshotService.restore(snapshot, self.user)
+
+        self.assertEqual(result['placement_count'], 3)
+        self.assertEqual(ShelfSnapshotService.diff(snapshot)['placements'], {'added': [], 'removed': [], 'changed': []})
+        # 既存行を再利用するため配置の行数は増えない
+        self.assertEqual(ProductPlacement.objects.count(), placement_rows)
+        upper = ShelfSegment.objects.get(pk=self.upper.pk)
+        self.assertTrue(upper.is_active)
+        self.assertEqual((upper.active_placement_count, upper.y_position), (1, 30))
+        self.assertEqual(Shelf.objects.get(pk=self.shelf.pk).layout_revision, result['revision'])
+
+    def test_api(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            f'/shelves/api/{self.shelf.pk}/snapshots/',
+            data={'name': '初期'},
+            content_type='application/json'
+        )
+        snapshot_id = response.json()['snapshot']['id']
+        self.place(self.water, 70, segment=self.upper)
+
+        data = self.client.get(f'/shelves/api/{self.shelf.pk}/snapshots/').json()
+        self.assertEqual([snapshot['id'] for snapshot in data['snapshots']], [snapshot_id])
+
+        data = self.client.get(f'/shelves/api/snapshot/{snapshot_id}/diff/').json()
+        self.assertEqual(data['diff']['placements']['added'][0]['x_position'], 70)
+
+        response = self.client.post(f'/shelves/api/snapshot/{snapshot_id}/restore/')
+        self.assertTrue(response.json()['success'])
+        self.assertFalse(ProductPlacement.objects.filter(x_position=70, is_active=True).exists())
+
+
+class ShelfCloneTest(ShelfTestMixin, TestCase):
+    """棚レイアウト複製のテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        ShelfSegment.objects.create(shelf=self.shelf, level=2, height=25)
+        product = self.create_product('お茶', width=10)
+        self.place(product, 0, face_count=2)
+        self.place(product, 70, face_count=2)  # 70-90
+
+    def test_clone_to_new_and_existing(self):
+        from .services import ShelfCloneService
+
+        narrow = Shelf.objects.create(name='狭い棚', width=60, depth=45)
+        ShelfSegment.objects.create(shelf=narrow, level=3, height=40)
+
+        reports = ShelfCloneService.clone(
+            self.shelf, self.user, targets=[narrow], new_names=['店舗1', '店舗2']
+        )
+        self.assertEqual([report['success'] for report in reports], [False, True, True])
+        self.assertEqual(reports[0]['skipped_count'], 1)
+
+        clone = Shelf.objects.get(name='店舗1')
+        segments = list(clone.segments.order_by('level').values_list('level', 'y_position', 'used_width'))
+        self.assertEqual(segments, [(1, 0, 40), (2, 30, 0)])
+        self.assertEqual(clone.placements.filter(is_active=True).count(), 2)
+
+        reports = ShelfCloneService.clone(self.shelf, self.user, targets=[narrow, narrow], skip_overflow=True)
+        self.assertEqual(len(reports), 1)
+        self.assertTrue(reports[0]['success'])
+        self.assertEqual(narrow.placements.filter(is_active=True).count(), 1)
+        self.assertEqual(
+            list(narrow.segments.filter(is_active=True).values_list('level', 'active_placement_count')),
+            [(1, 1), (2, 0)]
+        )
+        self.assertFalse(ShelfSegment.objects.get(shelf=narrow, level=3).is_active)
+
+    def test_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command('clone_shelf_layout', self.shelf.pk, count=3, name_prefix='店舗', stdout=out)
+        self.assertIn('3/3棚', out.getvalue())
+        self.assertEqual(ProductPlacement.objects.filter(shelf__name__startswith='店舗').count(), 6)
+
+
+class ShelfLayoutLoaderTest(ShelfTestMixin, TestCase):
+    """レイアウト読み込みのクエリ数のテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        self.product = self.create_product('お茶', width=5)
+        self.competitor = self.create_product('競合茶', width=5, manufacturer=self.other_maker)
+
+    def add_segment(self, level):
+        segment = ShelfSegment.objects.create(shelf=self.shelf, level=level, height=30)
+        for i in range(4):
+            self.place(self.product if i % 2 else self.competitor, i * 10, segment=segment)
+
+    def test_constant_queries(self):
+        self.add_segment(2)
+        with self.assertNumQueries(3):
+            shelf = ShelfService.layout_queryset().get(pk=self.shelf.pk)
+            layout = ShelfService.get_layout(shelf)
+            self.assertEqual(shelf.segment_count, 2)
+            self.assertEqual(layout['segments'][0]['segment'].available_width, 90)
+
+        self.assertEqual(layout['stats']['total_products'], 4)
+        self.assertEqual(layout['stats']['own_products'], 2)
+        self.assertEqual(layout['stats']['avg_utilization'], 20 / 90 * 100 / 2)
+
+    def test_views_do_not_grow_with_segments(self):
+        from django.test import RequestFactory
+        from .views import ShelfDetailView, ShelfEditView
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        counts = []
+        for level in (2, 3, 4):
+            self.add_segment(level)
+            for view_class in (ShelfDetailView, ShelfEditView):
+                view = view_class()
+                view.setup(request, pk=self.shelf.pk)
+                with CaptureQueriesContext(connection) as queries:
+                    view.object = view.get_object()
+                    context = view.get_context_data()
+                # 編集画面の商品一覧は遅延評価のため含まれない
+                counts.append(len(queries))
+        # 変更後の初回は棚・段・配置の3クエリ、同じ版数の2回目はキャッシュから取得
+        self.assertEqual(counts, [3, 1] * 3)
+        self.assertEqual(context['segments_json'][1]['available_width'], 70)
+        self.assertEqual(context['total_height'], 120)
+
+    def test_payload_is_never_stale(self):
+        self.add_segment(2)
+        payload = ShelfService.get_layout_payload(Shelf.objects.get(pk=self.shelf.pk))
+        self.assertEqual(payload['segments'][1]['placements'][0]['product']['name'], '競合茶')
+
+        # 商品・メーカー・段・配置の変更はいずれもレイアウト版数を進める
+        changes = [
+            lambda: Product.objects.get(pk=self.competitor.pk).save(),
+            lambda: Manufacturer.objects.get(pk=self.other_maker.pk).save(),
+            lambda: ShelfSegment.objects.get(pk=self.segment.pk).save(),
+            lambda: ProductPlacement.objects.filter(is_active=True).first().delete(),
+        ]
+        for change in changes:
+            revision = Shelf.objects.get(pk=self.shelf.pk).layout_revision
+            change()
+            self.assertGreater(Shelf.objects.get(pk=self.shelf.pk).layout_revision, revision)
+
+        self.competitor.name = '新しい競合茶'
+        self.competitor.save()
+        payload = ShelfService.get_layout_payload(Shelf.objects.get(pk=self.shelf.pk))
+        names = {placement['product']['name'] for placement in payload['segments'][1]['placements']}
+        self.assertEqual(names, {'お茶', '新しい競合茶'})
+
+
+class PlanogramRenderingTest(ShelfTestMixin, TestCase):
+    """棚割り図描画のテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        self.place(self.create_product('自社<お茶>', width=10), 0, face_count=2)
+        self.place(self.create_product('競合茶', width=10, manufacturer=self.other_maker), 40)
+
+    def test_svg_and_png(self):
+        import io
+        from PIL import Image
+
+        shelf = Shelf.objects.get(pk=self.shelf.pk)
+        svg, content_type = ShelfService.render_planogram(shelf, 'svg')
+        self.assertEqual(content_type, 'image/svg+xml')
+        self.assertIn('自社&lt;お茶&gt;', svg)
+        self.assertIn('#d4edda', svg)
+        self.assertIn('#fff3cd', svg)
+
+        png, content_type = ShelfService.render_planogram(shelf, 'png', width_px=300)
+        image = Image.open(io.BytesIO(png))
+        self.assertEqual(image.size, (300, round(31 * 300 / 90)))
+
+    def test_etag_and_cache(self):
+        self.client.force_login(self.user)
+        url = f'/shelves/{self.shelf.pk}/planogram.svg'
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # 認証2件 + 棚1件のみ（レイアウトは読み込まない）
+        with self.assertNumQueries(3):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        # 配置を変更すると版数が変わり、新しい内容になる
+        ProductPlacement.objects.filter(x_position=40).first().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('競合茶', response.content.decode())
+
+    def test_rename_invalidates_cache(self):
+        self.client.force_login(self.user)
+        url = f'/shelves/{self.shelf.pk}/planogram.svg'
+        shelf = Shelf.objects.get(pk=self.shelf.pk)
+        revision = shelf.layout_revision
+        response = self.client.get(url, {'v': revision})
+        self.assertIn('max-age', response['Cache-Control'])
+        etag = response['ETag']
+
+        # 棚名の変更で版数が変わり、古いETag・?v= では長期キャッシュされない
+        shelf.name = '改名した棚'
+        shelf.save()
+        self.assertEqual(shelf.layout_revision, revision + 1)
+        self.assertEqual(Shelf.objects.get(pk=shelf.pk).layout_revision, revision + 1)
+        response = self.client.get(url, {'v': revision}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('<title>改名した棚</title>', response.content.decode())
+        self.assertNotIn('max-age', response['Cache-Control'])
+
+        # 描画されない項目の変更では版数を変えない
+        shelf.location = '本店'
+        shelf.save()
+        self.assertEqual(Shelf.objects.get(pk=shelf.pk).layout_revision, revision + 1)
+
+    def test_print_pack(self):
+        import os
+        import tempfile
+        import zipfile
+        from .services import ShelfPrintPackService
+
+        second = Shelf.objects.create(name='棚/B', width=60, depth=30, location='本店')
+        ShelfSegment.objects.create(shelf=second, level=1, height=30)
+        Shelf.objects.filter(pk=self.shelf.pk).update(location='本店')
+        Shelf.objects.create(name='別店舗の棚', width=60, depth=30, location='支店')
+
+        with tempfile.TemporaryDirectory() as directory:
+            progress = []
+            path = os.path.join(directory, 'pack.pdf')
+            result = ShelfPrintPackService.build(
+                Shelf.objects.filter(location='本店'), path, workers=1, width_px=400,
+                progress=lambda done, total, name: progress.append((done, total, name))
+            )
+            self.assertEqual(result['page_count'], 2)
+            self.assertEqual(progress, [(1, 2, self.shelf.name), (2, 2, '棚/B')])
+            with open(path, 'rb') as file:
+                data = file.read()
+            self.assertTrue(data.startswith(b'%PDF-') and data.rstrip().endswith(b'%%EOF'))
+            self.assertEqual(data.count(b'/Type /Page '), 2)
+            self.assertFalse(os.path.exists(path + '.part'))
+
+            path = os.path.join(directory, 'pack.zip')
+            ShelfPrintPackService.build(Shelf.objects.filter(location='本店'), path, fmt='svg', workers=1)
+            with zipfile.ZipFile(path) as archive:
+                names = archive.namelist()
+                self.assertEqual(names[1], '0002_本店_棚_B.svg')
+                self.assertIn('自社&lt;お茶&gt;', archive.read(names[0]).decode())
+
+        with self.assertRaises(ValidationError):
+            ShelfPrintPackService.build(Shelf.objects.all(), 'unused', fmt='tiff')
+
+
+class LayoutExportTest(ShelfTestMixin, TestCase):
+    """棚レイアウトのエクスポートのテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        product = self.create_product('お茶')
+        self.place(product, 0, face_count=2)
+        self.shelves = [self.shelf]
+        for index in range(3):
+            shelf = Shelf.objects.create(name=f'棚{index}', width=60, depth=30, location='本店')
+            segment = ShelfSegment.objects.create(shelf=shelf, level=1, height=30)
+            self.place(product, 10 * index, segment=segment)
+            self.shelves.append(shelf)
+        self.client.force_login(self.user)
+
+    def read_lines(self, response):
+        import json
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_ndjson_export(self):
+        import gzip
+
+        response = self.client.get('/shelves/export/layouts.ndjson')
+        self.assertTrue(response.streaming)
+        # 送出時のクエリは棚の件数によらず棚・段・配置の3件
+        with self.assertNumQueries(3):
+            lines = self.read_lines(response)
+        self.assertEqual([line['shelf']['id'] for line in lines], [shelf.pk for shelf in self.shelves])
+        self.assertEqual(lines[0]['placements'][0]['face_count'], 2)
+        self.assertEqual(lines[2]['placements'][0]['x_position'], 10)
+
+        response = self.client.get('/shelves/export/layouts.ndjson', {'location': '本店', 'gzip': '1'})
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+
+        response = self.client.get('/shelves/export/layouts.ndjson', {'ids': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_json_export(self):
+        response = self.client.get(f'/shelves/{self.shelf.pk}/export.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['placements'][0]['product_name'], 'お茶')
+
+
+class LayoutImportTest(ShelfTestMixin, TestCase):
+    """棚レイアウトのインポートのテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        self.tea = self.create_product('お茶', jan_code='4900000000001')
+        self.water = self.create_product('水', width=15, jan_code='4900000000002')
+        self.place(self.tea, 0, face_count=2)
+        self.place(self.water, 30)
+        ShelfSegment.objects.create(shelf=self.shelf, level=2, height=25)
+
+    def export(self):
+        import json
+        from utils.exporters import export_shelf_layout_json
+        return json.loads(export_shelf_layout_json(Shelf.objects.get(pk=self.shelf.pk)).content)
+
+    def test_round_trip(self):
+        import json
+        from .services import ShelfLayoutImportService
+
+        document = self.export()
+        copies = []
+        for index in range(3):
+            copy = json.loads(json.dumps(document))
+            copy['shelf']['name'] = f'店舗{index}'
+            copies.append(json.dumps(copy, ensure_ascii=False))
+
+        # 新規作成（商品・既存の棚をまとめて照会し、棚・段・配置を一括作成して集計値を更新）
+        with self.assertNumQueries(10):
+            reports = ShelfLayoutImportService.import_layouts('\n'.join(copies), self.user)
+        self.assertEqual([report['success'] for report in reports], [True] * 3)
+        self.assertTrue(all(report['created'] for report in reports))
+        shelf = Shelf.objects.get(name='店舗1')
+        self.assertEqual(
+            list(shelf.placements.filter(is_active=True).order_by('x_position')
+                 .values_list('product__jan_code', 'x_position', 'face_count')),
+            [('4900000000001', 0.0, 2), ('4900000000002', 30.0, 1)]
+        )
+        segment = shelf.segments.get(level=1)
+        self.assertEqual((segment.used_width, segment.active_placement_count), (35, 2))
+        self.assertEqual(shelf.segments.get(level=2).y_position, 30)
+
+        # 整形されたJSON1件で既存の棚を置き換え（段2は削除）
+        document['placements'][1]['x_position'] = 50
+        document['segments'] = document['segments'][:1]
+        revision = Shelf.objects.get(pk=self.shelf.pk).layout_revision
+        reports = ShelfLayoutImportService.import_layouts(json.dumps(document, indent=2), self.user)
+        self.assertEqual((reports[0]['shelf_id'], reports[0]['created']), (self.shelf.pk, False))
+        self.assertEqual(
+            sorted(ProductPlacement.objects.filter(shelf=self.shelf, is_active=True).values_list('x_position', flat=True)),
+            [0.0, 50.0]
+        )
+        self.assertFalse(ShelfSegment.objects.get(shelf=self.shelf, level=2).is_active)
+        self.assertGreater(Shelf.objects.get(pk=self.shelf.pk).layout_revision, revision)
+
+    def test_invalid_placements(self):
+        import json
+        from .services import ShelfLayoutImportService
+
+        document = self.export()
+        document['shelf']['name'] = '新しい棚'
+        document['placements'][1]['x_position'] = 15          # お茶(0-20)と重複
+        document['placements'].append(dict(document['placements'][0], product_jan='4999999999999', x_position=60))
+        source = json.dumps([document])
+
+        reports = ShelfLayoutImportService.import_layouts(source, self.user)
+        self.assertFalse(reports[0]['success'])
+        self.assertEqual(len(reports[0]['errors']), 3)
+        self.assertFalse(Shelf.objects.filter(name='新しい棚').exists())
+
+        reports = ShelfLayoutImportService.import_layouts(source, self.user, skip_invalid=True)
+        self.assertEqual((reports[0]['success'], reports[0]['placement_count'], reports[0]['skipped_count']), (True, 0, 3))
+
+        self.client.force_login(self.user)
+        response = self.client.post(
+            '/shelves/api/layouts/import/?replace=0', '{"shelf": {}}\nnot json\n', content_type='application/x-ndjson'
+        )
+        data = response.json()
+        self.assertEqual((data['success'], data['failed']), (False, 2))
+        self.assertIn('2行目', data['reports'][1]['errors'][0])
+
+    def test_non_finite_numbers(self):
+        import json
+        from .services import ShelfLayoutImportService
+
+        documents = []
+        for key, value in (('width', 'nan'), ('height', 'inf'), ('x_position', 'nan'), ('depth', float('nan'))):
+            document = self.export()
+            document['shelf']['name'] = f'棚_{key}'
+            if key in ('width', 'depth'):
+                document['shelf'][key] = value
+            elif key == 'height':
+                document['segments'][0]['height'] = value
+            else:
+                document['placements'][0]['x_position'] = value
+            documents.append(json.dumps(document))
+        valid = self.export()
+        valid['shelf']['name'] = '正常な棚'
+        documents.append(json.dumps(valid))
+
+        reports = ShelfLayoutImportService.import_layouts('\n'.join(documents), self.user)
+        self.assertEqual([report['success'] for report in reports], [False] * 4 + [True])
+        self.assertTrue(all('有限の数値' in report['errors'][0] for report in reports[:4]))
+        self.assertFalse(Shelf.objects.filter(name__startswith='棚_').exists())
+
+
+class LayoutScoringTest(ShelfTestMixin, TestCase):
+    """レイアウト評価のテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        self.upper = ShelfSegment.objects.create(shelf=self.shelf, level=2, height=30)
+        own = self.create_product('自社品', width=10, recommended_faces=2)
+        other = self.create_product('競合品', width=5, manufacturer=self.other_maker)
+        self.place(own, 0, face_count=2)       # 0-20
+        self.place(other, 30, face_count=2)    # 30-40（隙間 20-30）
+        self.place(other, 40)                  # 40-45（末尾の隙間 45-90）
+        self.empty_shelf = Shelf.objects.create(name='空の棚', width=60, depth=30)
+        ShelfSegment.objects.create(shelf=self.empty_shelf, level=1, height=30)
+
+    def test_shelf_metrics(self):
+        from .scoring import score_shelves
+
+        scores = score_shelves()
+        metrics = scores.for_shelf(self.shelf.pk)
+
+        self.assertAlmostEqual(metrics['fill_ratio'], 35 / 180)
+        self.assertEqual(metrics['gap_count'], 3)  # 段1の2か所 + 空の段2
+        self.assertEqual(metrics['largest_gap'], 90)
+        self.assertAlmostEqual(metrics['own_share'], 20 / 35)
+        self.assertAlmostEqual(metrics['facing_deviation'], 1 / 3)
+        self.assertEqual(metrics['placement_count'], 3)
+
+        empty = scores.for_shelf(self.empty_shelf.pk)
+        self.assertEqual((empty['fill_ratio'], empty['gap_count'], empty['largest_gap']), (0, 1, 60))
+
+    def test_segment_metrics(self):
+        from .scoring import score_shelves
+
+        scores = score_shelves(Shelf.objects.filter(pk=self.shelf.pk))
+        i = list(scores.segment_ids).index(self.segment.pk)
+
+        self.assertEqual(scores.segment['gap_count'][i], 2)
+        self.assertEqual(scores.segment['largest_gap'][i], 45)
+        self.assertEqual(len(scores.shelf_ids), 1)
+
+
+class ShelfBrowseTest(ShelfTestMixin, TestCase):
+    """棚一覧のキーセットページネーションのテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        for index in range(14):
+            Shelf.objects.create(name=f'棚{index % 7}', width=60, depth=30, location='本店' if index % 2 else '支店')
+        self.expected = list(Shelf.objects.filter(is_active=True).order_by('name', 'pk').values_list('pk', flat=True))
+        self.client.force_login(self.user)
+
+    def test_list_and_api(self):
+        response = self.client.get('/shelves/')
+        page = response.context['page_obj']
+        self.assertEqual([shelf.pk for shelf in page], self.expected[:12])
+        response = self.client.get('/shelves/?' + page.next_query)
+        self.assertEqual([shelf.pk for shelf in response.context['page_obj']], self.expected[12:])
+        self.assertEqual(response.context['paginator'].count, 15)
+
+        seen = []
+        params = {'limit': 4, 'location': '本店'}
+        while True:
+            data = self.client.get('/shelves/api/browse/', params).json()
+            seen += [row['id'] for row in data['results']]
+            if not data['next']:
+                break
+            params['after'] = data['next']
+        self.assertEqual(seen, list(
+            Shelf.objects.filter(location='本店').order_by('name', 'pk').values_list('pk', flat=True)
+        ))
+
+    def test_tampered_cursor(self):
+        from utils.pagination import encode_cursor
+
+        for values in (['棚1', 'x'], ['棚1', None], [None, 1]):
+            cursor = encode_cursor(values)
+            self.assertEqual(self.client.get('/shelves/', {'after': cursor}).status_code, 404)
+            self.assertEqual(self.client.get('/shelves/api/browse/', {'before': cursor}).status_code, 400)
+
+
+class ShelfListFilterTest(ShelfTestMixin, TestCase):
+    """棚一覧の絞り込み・クエリ数のテスト"""
+
+    def setUp(self):
+        self.create_base_data()
+        ShelfSegment.objects.create(shelf=self.shelf, level=2, height=25)
+        product = self.create_product('お茶')
+        self.place(product, 0)
+        self.place(product, 20)
+        self.wide = Shelf.objects.create(name='広い棚', width=180, depth=45)
+        ShelfSegment.objects.create(shelf=self.wide, level=1, height=30)
+        self.client.force_login(self.user)
+
+    def shelf_names(self, params):
+        response = self.client.get('/shelves/', params)
+        return [shelf.name for shelf in response.context['shelves']]
+
+    def test_counts_and_filters(self):
+        response = self.client.get('/shelves/')
+        shelves = {shelf.name: shelf for shelf in response.context['shelves']}
+        self.assertEqual(shelves['テスト棚'].annotated_segment_count, 2)
+        self.assertEqual(shelves['テスト棚'].annotated_placement_count, 2)
+        self.assertEqual(shelves['広い棚'].annotated_placement_count, 0)
+
+        self.assertEqual(self.shelf_names({'has_placements': 'true'}), ['テスト棚'])
+        self.assertEqual(self.shelf_names({'has_placements': 'false'}), ['広い棚'])
+        self.assertEqual(self.shelf_names({'min_width': '100'}), ['広い棚'])
+        self.assertEqual(self.shelf_names({'max_width': '100', 'has_placements': 'false'}), [])
+        # 形式が正しくない条件は無視
+        self.assertEqual(self.shelf_names({'min_width': 'abc'}), ['テスト棚', '広い棚'])
 
-# Create your tests here.
+    def test_constant_queries(self):
+        Counter.rebuild()
+        with CaptureQueriesContext(connection) as few:
+            self.client.get('/shelves/')
+        for index in range(10):
+            shelf = Shelf.objects.create(name=f'棚{index}', width=90, depth=45)
+            ShelfSegment.objects.create(shelf=shelf, level=1, height=30)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get('/shelves/')
+        self.assertEqual(len(response.context['shelves']), 12)
+        self.assertEqual(len(many), len(few))
@@ -11,11 +11,25 @@ urlpatterns = [
     path('<int:pk>/update/', views.ShelfUpdateView.as_view(), name='update'),
     path('<int:pk>/edit/', views.ShelfEditView.as_view(), name='edit'),
     path('<int:pk>/delete/', views.shelf_delete, name='delete'),
+    path('<int:pk>/planogram.<str:fmt>', views.shelf_planogram, name='planogram'),
+    path('<int:pk>/export.json', views.shelf_export_json, name='export_json'),
+    path('export/layouts.ndjson', views.shelf_layouts_export, name='export_layouts'),
+    path('api/browse/', views.shelf_browse_api, name='browse_api'),
     
     # API エンドポイント
     path('api/placement/create/', views.placement_create_api, name='placement_create_api'),
     path('api/placement/<int:placement_id>/update/', views.placement_update_api, name='placement_update_api'),
     path('api/placement/<int:placement_id>/delete/', views.placement_delete_api, name='placement_delete_api'),
     path('api/segment/<int:segment_id>/height/', views.segment_height_update_api, name='segment_height_update_api'),
+    path('api/segment/<int:segment_id>/facings/', views.segment_facing_allocation_api, name='segment_facing_allocation_api'),
     path('api/placement/validate/', views.placement_validation_api, name='placement_validation_api'),
+    path('api/<int:shelf_id>/placement/validate-batch/', views.placement_batch_validation_api, name='placement_batch_validation_api'),
+    path('api/<int:shelf_id>/placement/changeset/', views.placement_changeset_api, name='placement_changeset_api'),
+    path('api/<int:shelf_id>/gaps/', views.shelf_free_gaps_api, name='shelf_free_gaps_api'),
+    path('api/<int:shelf_id>/align/', views.shelf_align_api, name='shelf_align_api'),
+    path('api/<int:shelf_id>/snapshots/', views.shelf_snapshot_api, name='shelf_snapshot_api'),
+    path('api/snapshot/<int:snapshot_id>/restore/', views.snapshot_restore_api, name='snapshot_restore_api'),
+    path('api/snapshot/<int:snapshot_id>/diff/', views.snapshot_diff_api, name='snapshot_diff_api'),
+    path('api/layouts/import/', views.layout_import_api, name='layout_import_api'),
+    path('api/<int:shelf_id>/optimize/', views.shelf_optimize_api, name='shelf_optimize_api'),
 ]
\ No newline at end of file
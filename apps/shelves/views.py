@@ -1,6 +1,9 @@
 """
 棚管理ビュー
 """
+import json
+import math
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
@@ -8,52 +11,74 @@ from django.utils.decorators import method_decorator
 from django.views.generic import ListView, DetailView, CreateView, UpdateView
 from django.urls import reverse_lazy
 from django.db.models import Q, Count, Sum, Avg, Max
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, Http404
 from django.core.paginator import Paginator
 from django.views.decorators.http import require_http_methods
 from django.core.exceptions import ValidationError
 from django.db import transaction
-
-from .models import Shelf, ShelfSegment, ProductPlacement
-from .forms import ShelfForm, ShelfSegmentFormSet, ProductPlacementForm
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from .models import Shelf, ShelfSegment, ProductPlacement, ShelfLayoutSnapshot
+from .forms import ShelfForm, ShelfSegmentFormSet, ShelfSearchForm, ProductPlacementForm
+from .services import (
+    ShelfService, PlacementChangesetService, SegmentAlignmentService, ShelfSnapshotService,
+    ShelfLayoutImportService
+)
+from .optimizer import LayoutOptimizer
+from apps.core.models import Counter
 from apps.products.models import Product
+from utils.exporters import export_shelf_layout_json, export_shelf_layouts_ndjson
+from utils.pagination import InvalidCursor, KeysetPaginationMixin, browse_payload
+
+# 一括バリデーションで受け付ける候補数の上限
+MAX_BATCH_CANDIDATES = 1000
+
+# 変更セットで受け付ける操作数の上限
+MAX_CHANGESET_OPERATIONS = 500
+
+# フェース配分で受け付ける商品数の上限
+MAX_FACING_PRODUCTS = 500
+
+# 棚割り図(PNG)の幅の上限(px)と、版数指定時のブラウザキャッシュ期間(秒)
+MAX_PLANOGRAM_WIDTH = 2000
+PLANOGRAM_MAX_AGE = 60 * 60 * 24
+
+# スナップショット一覧の最大件数
+MAX_SNAPSHOT_LIST = 500
+
+# レイアウト最適化の時間予算(秒)と多点探索数の上限
+MAX_OPTIMIZE_TIME_BUDGET = 30.0
+MAX_OPTIMIZE_STARTS = 16
 
 
 @method_decorator(login_required, name='dispatch')
-class ShelfListView(ListView):
-    """棚一覧ビュー"""
+class ShelfListView(KeysetPaginationMixin, ListView):
+    """棚一覧ビュー（キーセットページネーション）"""
     model = Shelf
     template_name = 'shelves/list.html'
     context_object_name = 'shelves'
     paginate_by = 12
+    keyset_ordering = ('name', 'pk')
 
     def get_queryset(self):
-        queryset = Shelf.objects.filter(is_active=True).prefetch_related(
-            'segments',
-            'placements'
-        ).annotate(
-            annotated_segment_count=Count('segments', filter=Q(segments__is_active=True)),
-            annotated_placement_count=Count('placements', filter=Q(placements__is_active=True))
-        ).order_by('name')
-        
-        # 検索フィルタリング
-        search_query = self.request.GET.get('search', '')
-        if search_query:
-            queryset = queryset.filter(
-                Q(name__icontains=search_query) |
-                Q(location__icontains=search_query)
-            )
+        # 段数・配置数は相関サブクエリで付与（段・配置は読み込まない）
+        queryset = ShelfService.list_queryset()
+        
+        # 検索・配置状況・棚幅で絞り込み
+        queryset = ShelfService.filter_shelves(queryset, self.request.GET)
         
         return queryset
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context['search_form'] = ShelfSearchForm(self.request.GET)
         
-        # 統計情報
+        # 統計情報（集計値から1クエリで取得）
+        counters = Counter.values()
         context['stats'] = {
-            'total_shelves': Shelf.objects.filter(is_active=True).count(),
-            'total_segments': ShelfSegment.objects.filter(is_active=True).count(),
-            'total_placements': ProductPlacement.objects.filter(is_active=True).count(),
+            'total_shelves': counters[Counter.SHELVES],
+            'total_segments': counters[Counter.SEGMENTS],
+            'total_placements': counters[Counter.PLACEMENTS],
         }
         
         return context
@@ -67,37 +92,18 @@ class ShelfDetailView(DetailView):
     context_object_name = 'shelf'
 
     def get_queryset(self):
-        return Shelf.objects.filter(is_active=True).prefetch_related(
-            'segments__placements__product__manufacturer'
-        )
+        return Shelf.objects.filter(is_active=True)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        shelf = self.object
-        
-        # 段ごとの配置情報を整理
-        segments_data = []
-        for segment in shelf.segments.filter(is_active=True).order_by('level'):
-            placements = list(segment.placements.filter(is_active=True).order_by('x_position'))
-            segments_data.append({
-                'segment': segment,
-                'placements': placements,
-                'utilization': (sum(p.occupied_width for p in placements) / shelf.width * 100) if placements else 0,
-                'available_width': segment.available_width,
-            })
         
-        context['segments_data'] = segments_data
-        
-        # 統計情報
-        all_placements = ProductPlacement.objects.filter(shelf=shelf, is_active=True)
-        if all_placements.exists():
-            context['shelf_stats'] = {
-                'total_products': all_placements.count(),
-                'total_faces': all_placements.aggregate(total=Sum('face_count'))['total'],
-                'avg_utilization': sum(data['utilization'] for data in segments_data) / len(segments_data) if segments_data else 0,
-                'own_products': all_placements.filter(product__manufacturer__is_own_company=True).count(),
-                'competitor_products': all_placements.filter(product__manufacturer__is_own_company=False).count(),
-            }
+        # 段ごとの配置情報と統計情報（レイアウト版数ごとにキャッシュ）
+        layout = ShelfService.get_layout_payload(self.object)
+        context['segments_data'] = layout['segments']
+        context['segment_count'] = layout['segment_count']
+        context['total_height'] = layout['total_height']
+        if layout['stats']:
+            context['shelf_stats'] = layout['stats']
         
         return context
 
@@ -148,7 +154,10 @@ class ShelfCreateView(CreateView):
                 for i, segment in enumerate(segments, 1):
                     segment.level = i
                     segment.created_by = self.request.user
-                    segment.save()
+                    segment.save(reflow=False)
+                
+                # y_positionは最後に棚単位でまとめて再計算
+                ShelfService.reflow_segment_positions(self.object)
                 
                 messages.success(self.request, f'棚「{self.object.name}」を作成しました。')
                 return redirect(self.get_success_url())
@@ -204,11 +213,16 @@ class ShelfUpdateView(UpdateView):
                 for i, segment in enumerate(segments, 1):
                     segment.level = i
                     segment.updated_by = self.request.user
-                    segment.save()
+                    segment.save(reflow=False)
                 
-                # 削除マークされた段を処理
+                # 削除マークされた段を処理（ソフトデリート）
                 for segment in segment_formset.deleted_objects:
-                    segment.delete()
+                    segment.is_active = False
+                    segment.updated_by = self.request.user
+                    segment.save(reflow=False)
+                
+                # y_positionは最後に棚単位でまとめて再計算
+                ShelfService.reflow_segment_positions(self.object)
                 
                 messages.success(self.request, f'棚「{self.object.name}」を更新しました。')
                 return redirect(self.get_success_url())
@@ -224,9 +238,7 @@ class ShelfEditView(DetailView):
     context_object_name = 'shelf'
 
     def get_queryset(self):
-        return Shelf.objects.filter(is_active=True).prefetch_related(
-            'segments__placements__product__manufacturer'
-        )
+        return Shelf.objects.filter(is_active=True)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -236,38 +248,117 @@ class ShelfEditView(DetailView):
             'manufacturer', 'category'
         ).order_by('manufacturer__name', 'name')
         
-        # 段データをJSON形式で提供
+        # 段データをJSON形式で提供（レイアウト版数ごとにキャッシュ）
+        layout = ShelfService.get_layout_payload(self.object)
         segments_data = []
-        for segment in self.object.segments.filter(is_active=True).order_by('level'):
+        for data in layout['segments']:
+            segment = data['segment']
             placements_data = []
-            for placement in segment.placements.filter(is_active=True).order_by('x_position'):
+            for placement in data['placements']:
+                product = placement['product']
                 placements_data.append({
-                    'id': placement.id,
-                    'product_id': placement.product.id,
-                    'product_name': placement.product.name,
-                    'manufacturer_name': placement.product.manufacturer.name,
-                    'is_own': placement.product.is_own_product,
-                    'x_position': placement.x_position,
-                    'face_count': placement.face_count,
-                    'occupied_width': placement.occupied_width,
-                    'product_width': placement.product.width,
-                    'product_height': placement.product.height,
+                    'id': placement['id'],
+                    'product_id': product['id'],
+                    'product_name': product['name'],
+                    'manufacturer_name': product['manufacturer']['name'],
+                    'is_own': product['is_own_product'],
+                    'x_position': placement['x_position'],
+                    'face_count': placement['face_count'],
+                    'occupied_width': placement['occupied_width'],
+                    'product_width': product['width'],
+                    'product_height': product['height'],
                 })
             
             segments_data.append({
-                'id': segment.id,
-                'level': segment.level,
-                'height': segment.height,
-                'y_position': segment.y_position,
-                'available_width': segment.available_width,
+                'id': segment['id'],
+                'level': segment['level'],
+                'height': segment['height'],
+                'y_position': segment['y_position'],
+                'available_width': data['available_width'],
                 'placements': placements_data,
             })
         
+        context['total_height'] = layout['total_height']
         context['segments_json'] = segments_data
         
         return context
 
 
+@login_required
+@require_http_methods(["GET"])
+def shelf_planogram(request, pk, fmt):
+    """棚割り図（SVG/PNG）
+
+    ?w= でPNGの幅(px)、?images=1 で商品画像を描画。?v= に現在のレイアウト版数を
+    指定した場合はブラウザに長期キャッシュさせる（一覧のミニチュア用）。
+    """
+    if fmt not in ('svg', 'png'):
+        raise Http404
+    shelf = get_object_or_404(
+        Shelf.objects.only('id', 'name', 'width', 'layout_revision'),
+        pk=pk,
+        is_active=True
+    )
+    
+    try:
+        width_px = min(int(request.GET.get('w', 600)), MAX_PLANOGRAM_WIDTH) if fmt == 'png' else None
+    except ValueError:
+        width_px = 600
+    show_images = request.GET.get('images') == '1'
+    
+    # 変更がなければレイアウトを読み込まずに304を返す
+    etag = ShelfService.planogram_etag(shelf, fmt, width_px, show_images)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        content, content_type = ShelfService.render_planogram(shelf, fmt, width_px, show_images)
+        response = HttpResponse(content, content_type=content_type)
+    response['ETag'] = etag
+    
+    if request.GET.get('v') == str(shelf.layout_revision):
+        patch_cache_control(response, private=True, max_age=PLANOGRAM_MAX_AGE)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+@require_http_methods(["GET"])
+def shelf_export_json(request, pk):
+    """棚レイアウトのJSONエクスポート"""
+    shelf = get_object_or_404(Shelf, pk=pk, is_active=True)
+    return export_shelf_layout_json(shelf)
+
+
+@login_required
+@require_http_methods(["GET"])
+def shelf_layouts_export(request):
+    """複数の棚レイアウトのNDJSONエクスポート（1行1棚）
+
+    一覧と同じ検索条件（?search= / ?location= / ?has_placements= / ?min_width= / ?max_width=）と
+    ?ids=（棚ID、カンマ区切り）で絞り込む。?gzip=1 で圧縮。
+    """
+    shelves = ShelfService.filter_shelves(Shelf.objects.filter(is_active=True), request.GET)
+    if request.GET.get('ids'):
+        try:
+            shelf_ids = [int(value) for value in request.GET['ids'].split(',') if value.strip()]
+        except ValueError:
+            return JsonResponse({'success': False, 'errors': ['棚IDの形式が正しくありません']}, status=400)
+        shelves = shelves.filter(pk__in=shelf_ids)
+    return export_shelf_layouts_ndjson(shelves, compress=request.GET.get('gzip') == '1')
+
+
+@login_required
+def shelf_browse_api(request):
+    """棚一覧のJSON API（一覧と同じ検索条件で絞り込み。?after= / ?before= / ?limit= / ?count=1）"""
+    shelves = ShelfService.filter_shelves(Shelf.objects.filter(is_active=True), request.GET)
+    shelves = shelves.values('id', 'name', 'location', 'width', 'depth', 'layout_revision', 'updated_at')
+    try:
+        payload = browse_payload(shelves, request.GET, ShelfListView.keyset_ordering)
+    except InvalidCursor as e:
+        return JsonResponse({'success': False, 'errors': [str(e)]}, status=400)
+    return JsonResponse(payload)
+
+
 @login_required
 def shelf_delete(request, pk):
     """棚削除（ソフトデリート）"""
@@ -281,10 +372,12 @@ def shelf_delete(request, pk):
         
         shelf.is_active = False
         shelf.updated_by = request.user
-        shelf.save()
-        
-        # 関連する段も無効化
-        shelf.segments.update(is_active=False)
+        with transaction.atomic():
+            shelf.save()
+            
+            # 関連する段も無効化（save() を経由しないため段数の集計値はここで減らす）
+            deactivated = shelf.segments.filter(is_active=True).update(is_active=False)
+            Counter.add(**{Counter.SEGMENTS: -deactivated})
         
         messages.success(request, f'棚「{shelf.name}」を削除しました。')
         return redirect('shelves:list')
@@ -511,4 +604,378 @@ def placement_validation_api(request):
         return JsonResponse({
             'valid': False,
             'errors': [str(e)]
-        })
\ No newline at end of file
+        })
+
+
+@login_required
+@require_http_methods(["POST"])
+def placement_batch_validation_api(request, shelf_id):
+    """配置一括バリデーションAPI"""
+    shelf = get_object_or_404(Shelf, id=shelf_id, is_active=True)
+    
+    try:
+        payload = json.loads(request.body)
+        candidates = [
+            {
+                'segment_id': int(candidate['segment_id']),
+                'product_id': int(candidate['product_id']),
+                'x_position': float(candidate.get('x_position', 0)),
+                'face_count': int(candidate.get('face_count', 1)),
+                'placement_id': int(candidate['placement_id']) if candidate.get('placement_id') else None,
+            }
+            for candidate in payload.get('candidates', [])
+        ]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({
+            'success': False,
+            'errors': ['候補データの形式が正しくありません']
+        }, status=400)
+    
+    if len(candidates) > MAX_BATCH_CANDIDATES:
+        return JsonResponse({
+            'success': False,
+            'errors': [f'一度にチェックできる候補は{MAX_BATCH_CANDIDATES}件までです']
+        }, status=400)
+    
+    results = ShelfService.validate_placements_batch(shelf, candidates) if candidates else []
+    
+    return JsonResponse({
+        'success': True,
+        'results': results,
+        'valid_count': sum(1 for result in results if result['valid']),
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def placement_changeset_api(request, shelf_id):
+    """配置変更セットAPI（作成・更新・削除を1トランザクションで適用）"""
+    shelf = get_object_or_404(Shelf, id=shelf_id, is_active=True)
+    
+    try:
+        payload = json.loads(request.body)
+        operations = payload['operations']
+        base_revision = payload.get('base_revision')
+        if not isinstance(operations, list):
+            raise TypeError
+        if base_revision is not None:
+            base_revision = int(base_revision)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({
+            'success': False,
+            'errors': ['変更セットの形式が正しくありません']
+        }, status=400)
+    
+    if len(operations) > MAX_CHANGESET_OPERATIONS:
+        return JsonResponse({
+            'success': False,
+            'errors': [f'一度に適用できる操作は{MAX_CHANGESET_OPERATIONS}件までです']
+        }, status=400)
+    
+    outcome = PlacementChangesetService.apply(shelf, operations, request.user, base_revision)
+    
+    if outcome['conflict']:
+        return JsonResponse({
+            'success': False,
+            'revision': outcome['revision'],
+            'errors': ['他のユーザーによってレイアウトが更新されています。再読み込みしてください']
+        }, status=409)
+    
+    return JsonResponse({
+        'success': outcome['success'],
+        'revision': outcome['revision'],
+        'results': outcome['results'],
+    }, status=200 if outcome['success'] else 400)
+
+
+@login_required
+@require_http_methods(["POST"])
+def shelf_align_api(request, shelf_id):
+    """配置整列API（左詰め・右詰め・均等配置・隙間詰めを棚全体または1段に適用）"""
+    shelf = get_object_or_404(Shelf, id=shelf_id, is_active=True)
+    
+    try:
+        payload = json.loads(request.body)
+        operation = payload['operation']
+        segment_id = payload.get('segment_id')
+        if segment_id is not None:
+            segment_id = int(segment_id)
+        x_position = payload.get('x_position')
+        if x_position is not None:
+            x_position = float(x_position)
+        base_revision = payload.get('base_revision')
+        if base_revision is not None:
+            base_revision = int(base_revision)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({
+            'success': False,
+            'errors': ['整列条件の形式が正しくありません']
+        }, status=400)
+    
+    try:
+        outcome = SegmentAlignmentService.apply(
+            shelf, operation, request.user,
+            segment_id=segment_id, x_position=x_position, base_revision=base_revision
+        )
+    except ValidationError as e:
+        return JsonResponse({
+            'success': False,
+            'errors': e.messages
+        }, status=400)
+    
+    if outcome['conflict']:
+        return JsonResponse({
+            'success': False,
+            'revision': outcome['revision'],
+            'errors': ['他のユーザーによってレイアウトが更新されています。再読み込みしてください']
+        }, status=409)
+    
+    return JsonResponse(outcome, status=200 if outcome['success'] else 400)
+
+
+@login_required
+@require_http_methods(["POST"])
+def shelf_optimize_api(request, shelf_id):
+    """レイアウト最適化API（提案の変更セットを返し、DBには書き込まない）"""
+    shelf = get_object_or_404(Shelf, id=shelf_id, is_active=True)
+    
+    try:
+        payload = json.loads(request.body) if request.body else {}
+        product_ids = payload.get('product_ids')
+        if product_ids is not None:
+            product_ids = [int(product_id) for product_id in product_ids]
+        time_budget = float(payload.get('time_budget', 2.0))
+        starts = max(1, min(int(payload.get('starts', 1)), MAX_OPTIMIZE_STARTS))
+        weights = {
+            key: float(value) for key, value in (payload.get('weights') or {}).items()
+            if key in ('fill', 'recommended', 'own')
+        }
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({
+            'success': False,
+            'errors': ['最適化条件の形式が正しくありません']
+        }, status=400)
+    
+    # NaN は比較がすべて偽になり上限で丸められないため、有限の値かを先に確認
+    if not math.isfinite(time_budget) or time_budget <= 0:
+        return JsonResponse({
+            'success': False,
+            'errors': ['時間予算は0より大きい値である必要があります']
+        }, status=400)
+    time_budget = min(time_budget, MAX_OPTIMIZE_TIME_BUDGET)
+    if not all(math.isfinite(w) and 0 <= w <= LayoutOptimizer.MAX_WEIGHT for w in weights.values()):
+        return JsonResponse({
+            'success': False,
+            'errors': [f'評価重みは0以上{LayoutOptimizer.MAX_WEIGHT:g}以下の値である必要があります']
+        }, status=400)
+    
+    proposal = ShelfService.optimize_shelf_layout(
+        shelf, product_ids=product_ids, time_budget=time_budget, starts=starts, weights=weights
+    )
+    
+    return JsonResponse({'success': True, **proposal})
+
+
+@login_required
+@require_http_methods(["GET"])
+def segment_facing_allocation_api(request, segment_id):
+    """段内フェース配分API（「フェースを均等化」用）"""
+    segment = get_object_or_404(
+        ShelfSegment.objects.select_related('shelf'),
+        id=segment_id,
+        is_active=True
+    )
+    
+    try:
+        product_ids = [
+            int(product_id) for product_id in request.GET.get('product_ids', '').split(',') if product_id
+        ]
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'errors': ['商品IDの形式が正しくありません']
+        }, status=400)
+    
+    if not product_ids:
+        return JsonResponse({
+            'success': False,
+            'errors': ['商品を指定してください']
+        }, status=400)
+    
+    if len(product_ids) > MAX_FACING_PRODUCTS:
+        return JsonResponse({
+            'success': False,
+            'errors': [f'一度に配分できる商品は{MAX_FACING_PRODUCTS}件までです']
+        }, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        **ShelfService.allocate_segment_facings(segment, product_ids),
+    })
+
+
+@login_required
+@require_http_methods(["GET"])
+def shelf_free_gaps_api(request, shelf_id):
+    """段ごとの空き区間API（?product_id=&face_count=&segment_id= で絞り込み）"""
+    shelf = get_object_or_404(Shelf, id=shelf_id, is_active=True)
+    
+    try:
+        face_count = int(request.GET.get('face_count', 1))
+        segment_id = request.GET.get('segment_id')
+        segment_id = int(segment_id) if segment_id else None
+        product_id = request.GET.get('product_id')
+        product_id = int(product_id) if product_id else None
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'errors': ['パラメータの形式が正しくありません']
+        }, status=400)
+    
+    if face_count < 1:
+        return JsonResponse({
+            'success': False,
+            'errors': ['フェース数は1以上を指定してください']
+        }, status=400)
+    
+    product = None
+    if product_id is not None:
+        product = get_object_or_404(Product, id=product_id, is_active=True)
+    
+    return JsonResponse({
+        'success': True,
+        **ShelfService.get_free_gaps(shelf, product=product, face_count=face_count, segment_id=segment_id),
+    })
+
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def shelf_snapshot_api(request, shelf_id):
+    """レイアウトスナップショットAPI（GET: 一覧、POST: 現在のレイアウトを保存）"""
+    shelf = get_object_or_404(Shelf, id=shelf_id, is_active=True)
+    
+    if request.method == 'POST':
+        try:
+            payload = json.loads(request.body) if request.body else {}
+            name = str(payload.get('name', ''))[:100]
+        except (ValueError, AttributeError):
+            return JsonResponse({
+                'success': False,
+                'errors': ['スナップショットの形式が正しくありません']
+            }, status=400)
+        
+        snapshot = ShelfLayoutSnapshot.capture(shelf, request.user, name)
+        return JsonResponse({
+            'success': True,
+            'snapshot': {
+                'id': snapshot.id,
+                'name': snapshot.name,
+                'revision': snapshot.revision,
+                'segment_count': snapshot.segment_count,
+                'placement_count': snapshot.placement_count,
+                'created_at': snapshot.created_at.isoformat(),
+            }
+        })
+    
+    # 一覧ではレイアウトデータ本体を読み込まない
+    snapshots = ShelfLayoutSnapshot.objects.filter(
+        shelf=shelf,
+        is_active=True
+    ).values(
+        'id', 'name', 'revision', 'segment_count', 'placement_count',
+        'created_at', 'created_by__username'
+    )[:MAX_SNAPSHOT_LIST]
+    
+    return JsonResponse({
+        'success': True,
+        'revision': shelf.layout_revision,
+        'snapshots': [
+            {
+                'id': snapshot['id'],
+                'name': snapshot['name'],
+                'revision': snapshot['revision'],
+                'segment_count': snapshot['segment_count'],
+                'placement_count': snapshot['placement_count'],
+                'created_at': snapshot['created_at'].isoformat(),
+                'created_by': snapshot['created_by__username'],
+            }
+            for snapshot in snapshots
+        ],
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def snapshot_restore_api(request, snapshot_id):
+    """スナップショット復元API"""
+    snapshot = get_object_or_404(
+        ShelfLayoutSnapshot,
+        id=snapshot_id,
+        is_active=True,
+        shelf__is_active=True
+    )
+    
+    result = ShelfSnapshotService.restore(snapshot, request.user)
+    
+    return JsonResponse({'success': True, **result})
+
+
+@login_required
+@require_http_methods(["GET"])
+def snapshot_diff_api(request, snapshot_id):
+    """スナップショット差分API（?against= で比較先を指定、省略時は現在のレイアウト）"""
+    snapshot = get_object_or_404(ShelfLayoutSnapshot, id=snapshot_id, is_active=True)
+    
+    other = None
+    against = request.GET.get('against')
+    if against:
+        try:
+            against = int(against)
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'errors': ['比較先のIDの形式が正しくありません']
+            }, status=400)
+        other = get_object_or_404(
+            ShelfLayoutSnapshot,
+            id=against,
+            shelf_id=snapshot.shelf_id,
+            is_active=True
+        )
+    
+    return JsonResponse({
+        'success': True,
+        'snapshot_id': snapshot.id,
+        'against': other.id if other else None,
+        'diff': ShelfSnapshotService.diff(snapshot, other),
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def layout_import_api(request):
+    """棚レイアウトの一括インポートAPI
+
+    file に JSON（1件・配列）または NDJSON のファイル、ファイルがない場合はリクエスト本文を取り込む。
+    replace=0 で同名の棚があっても新規作成、skip_invalid=1 で不正な配置を除外して取り込む。
+    """
+    upload = request.FILES.get('file')
+    params = request.POST if upload is not None else request.GET
+    try:
+        reports = ShelfLayoutImportService.import_layouts(
+            upload.file if upload is not None else request.body,
+            request.user,
+            replace=params.get('replace', '1') != '0',
+            skip_invalid=params.get('skip_invalid') == '1',
+        )
+    except UnicodeDecodeError:
+        return JsonResponse({'success': False, 'errors': ['ファイルはUTF-8で保存してください']}, status=400)
+
+    failed = sum(not report['success'] for report in reports)
+    return JsonResponse({
+        'success': bool(reports) and not failed,
+        'errors': [] if reports else ['取り込む棚レイアウトがありません'],
+        'imported': len(reports) - failed,
+        'failed': failed,
+        'reports': reports,
+    })
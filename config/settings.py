@@ -91,6 +91,38 @@ else:
         }
     }
 
+# Cache
+# REDIS_URL が設定されていればRedis、未設定の場合はローカルメモリを使用
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'flexishelf',
+        }
+    }
+
+# 棚レイアウトのキャッシュ有効期間(秒)。キーにレイアウト版数を含むため、変更時は自動で別キーになる
+SHELF_LAYOUT_CACHE_TIMEOUT = int(os.environ.get('SHELF_LAYOUT_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# 一覧画面の件数の取得方法（utils/pagination.py の list_count）
+# exact: 毎回 COUNT(*) / cached: LIST_COUNT_CACHE_TIMEOUT 秒キャッシュ / approximate: PostgreSQL の推定行数
+LIST_COUNT_MODE = os.environ.get('LIST_COUNT_MODE', 'exact')
+LIST_COUNT_CACHE_TIMEOUT = int(os.environ.get('LIST_COUNT_CACHE_TIMEOUT', 60))
+APPROXIMATE_COUNT_THRESHOLD = int(os.environ.get('APPROXIMATE_COUNT_THRESHOLD', 10000))
+
+# 商品検索の方式（apps/products/search.py）
+# memory: プロセス内の検索インデックス / database: DBの索引（PostgreSQL: pg_trgm、SQLite: FTS5） / orm: icontains
+PRODUCT_SEARCH_BACKEND = os.environ.get('PRODUCT_SEARCH_BACKEND', 'memory')
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -140,5 +172,9 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'apps': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
     },
 }
@@ -7,17 +7,19 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from apps.core.models import Counter
 from apps.products.models import Product
-from apps.shelves.models import Shelf, ProductPlacement
+from apps.shelves.models import Shelf
 
 
 @login_required
 def home_view(request):
-    """ホームページビュー"""
+    """ホームページビュー（件数は集計値から1クエリで取得）"""
+    counters = Counter.values()
     context = {
-        'total_shelves': Shelf.objects.filter(is_active=True).count(),
-        'total_products': Product.objects.filter(is_active=True).count(),
-        'total_placements': ProductPlacement.objects.filter(is_active=True).count(),
+        'total_shelves': counters[Counter.SHELVES],
+        'total_products': counters[Counter.PRODUCTS],
+        'total_placements': counters[Counter.PLACEMENTS],
         'recent_shelves': Shelf.objects.filter(is_active=True).order_by('-created_at')[:5],
         'recent_products': Product.objects.filter(is_active=True).order_by('-created_at')[:5],
     }
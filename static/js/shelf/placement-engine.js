@@ -213,7 +213,87 @@ class PlacementEngine {
             return { valid: false, errors: ['バリデーションエラー'] };
         }
     }
-    
+
+    // 一括バリデーション（ドラッグ中のプレビュー用）
+    // candidates: [{segment_id, product_id, x_position, face_count, placement_id?}, ...]
+    async validatePlacements(candidates) {
+        try {
+            const response = await fetch(`/shelves/api/${this.currentShelf.id}/placement/validate-batch/`, {
+                method: 'POST',
+                body: JSON.stringify({ candidates }),
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': this.getCSRFToken(),
+                    'X-Requested-With': 'XMLHttpRequest'
+                }
+            });
+            if (!response.ok) {
+                return candidates.map(() => ({ valid: false, errors: ['バリデーションエラー'] }));
+            }
+            const data = await response.json();
+            return data.results;
+        } catch (error) {
+            return candidates.map(() => ({ valid: false, errors: ['バリデーションエラー'] }));
+        }
+    }
+
+    // 空き区間の取得（ホバー時のドロップ候補表示用）
+    async fetchFreeGaps(productId = null, faceCount = 1, segmentId = null) {
+        try {
+            const params = new URLSearchParams({ face_count: faceCount });
+            if (productId) {
+                params.append('product_id', productId);
+            }
+            if (segmentId) {
+                params.append('segment_id', segmentId);
+            }
+            
+            const response = await fetch(`/shelves/api/${this.currentShelf.id}/gaps/?${params}`);
+            if (!response.ok) {
+                return [];
+            }
+            const data = await response.json();
+            return data.segments;
+        } catch (error) {
+            return [];
+        }
+    }
+
+    // 配置の整列（compact_left / compact_right / distribute / close_gap）
+    async alignPlacements(operation, segmentId = null, xPosition = null) {
+        try {
+            const payload = { operation };
+            if (segmentId) {
+                payload.segment_id = segmentId;
+            }
+            if (xPosition !== null) {
+                payload.x_position = xPosition;
+            }
+            
+            const response = await fetch(`/shelves/api/${this.currentShelf.id}/align/`, {
+                method: 'POST',
+                body: JSON.stringify(payload),
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': this.getCSRFToken(),
+                    'X-Requested-With': 'XMLHttpRequest'
+                }
+            });
+            const data = await response.json();
+            if (!data.success) {
+                throw new Error(data.errors.join(', '));
+            }
+            
+            data.moved.forEach(placement => this.updatePlacementUI(placement.id, placement));
+            this.updateStatistics();
+            return data.moved;
+        } catch (error) {
+            console.error('Failed to align placements:', error);
+            this.showError('配置の整列に失敗しました: ' + error.message);
+            return null;
+        }
+    }
+
     // マウスイベントハンドラ
     handleMouseDown(e) {
         if (e.target.closest('.placement')) return; // 配置要素は個別処理
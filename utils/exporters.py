@@ -1,29 +1,75 @@
 # utils/exporters.py
 """
 データエクスポート機能
+
+一覧のエクスポートは StreamingHttpResponse で行ごとに送出し、クエリセットも
+iterator() で分割して読み込むため、件数によらずメモリ使用量はほぼ一定。
 """
 import csv
 import json
-from django.http import HttpResponse
-from django.template.loader import render_to_string
-
-
-def export_products_csv(products):
-    """商品データのCSVエクスポート"""
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="products.csv"'
-    response.write('\ufeff')  # BOM for Excel
-    
-    writer = csv.writer(response)
-    writer.writerow([
-        '商品名', 'JANコード', 'メーカー', 'カテゴリ', 
-        '幅(cm)', '高さ(cm)', '奥行(cm)', 
-        '最小フェース', '最大フェース', '推奨フェース',
-        '価格', '自社商品'
-    ])
-    
-    for product in products:
-        writer.writerow([
+import zlib
+from django.http import HttpResponse, StreamingHttpResponse
+
+# 1回の送出にまとめる行数
+STREAM_BATCH_SIZE = 500
+
+PRODUCT_CSV_HEADER = [
+    '商品名', 'JANコード', 'メーカー', 'カテゴリ',
+    '幅(cm)', '高さ(cm)', '奥行(cm)',
+    '最小フェース', '最大フェース', '推奨フェース',
+    '価格', '自社商品'
+]
+
+
+class _LineBuffer:
+    """csv.writer の書き込み先（書き込んだ文字列をそのまま返す）"""
+
+    def write(self, value):
+        return value
+
+
+def _gzip_stream(chunks):
+    """文字列のチャンクをgzip圧縮しながら送出"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _streaming_response(chunks, content_type, filename, compress=False):
+    """チャンクを送出するダウンロード用レスポンス（compress=True の場合は .gz ファイル）"""
+    if compress:
+        response = StreamingHttpResponse(_gzip_stream(chunks), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(
+            (chunk.encode('utf-8') for chunk in chunks), content_type=f'{content_type}; charset=utf-8'
+        )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _batched(lines, size=STREAM_BATCH_SIZE):
+    """行を size 件ずつ連結して返す"""
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def _product_csv_lines(products):
+    writer = csv.writer(_LineBuffer())
+    yield '\ufeff' + writer.writerow(PRODUCT_CSV_HEADER)  # BOM for Excel
+
+    products = products.select_related('manufacturer', 'category').order_by('pk')
+    for product in products.iterator(chunk_size=2000):
+        yield writer.writerow([
             product.name,
             product.jan_code or '',
             product.manufacturer.name,
@@ -37,12 +83,15 @@ def export_products_csv(products):
             product.price or '',
             '○' if product.is_own_product else '×'
         ])
-    
-    return response
 
 
-def export_shelf_layout_json(shelf):
-    """棚レイアウトのJSONエクスポート"""
+def export_products_csv(products, compress=False):
+    """商品データのCSVエクスポート（ストリーミング）"""
+    return _streaming_response(_batched(_product_csv_lines(products)), 'text/csv', 'products.csv', compress)
+
+
+def _shelf_layout_data(shelf, payload):
+    """棚レイアウトのエクスポート形式（get_layout_payload() の結果から生成）"""
     data = {
         'shelf': {
             'id': shelf.id,
@@ -54,30 +103,56 @@ def export_shelf_layout_json(shelf):
         'segments': [],
         'placements': []
     }
-    
-    for segment in shelf.segments.filter(is_active=True).order_by('level'):
+
+    for segment_data in payload['segments']:
+        segment = segment_data['segment']
         data['segments'].append({
-            'id': segment.id,
-            'level': segment.level,
-            'height': segment.height,
-            'y_position': segment.y_position,
+            'id': segment['id'],
+            'level': segment['level'],
+            'height': segment['height'],
+            'y_position': segment['y_position'],
         })
-        
-        for placement in segment.placements.filter(is_active=True).order_by('x_position'):
+
+        for placement in segment_data['placements']:
             data['placements'].append({
-                'id': placement.id,
-                'segment_level': segment.level,
-                'product_name': placement.product.name,
-                'product_jan': placement.product.jan_code,
-                'manufacturer': placement.product.manufacturer.name,
-                'x_position': placement.x_position,
-                'face_count': placement.face_count,
-                'occupied_width': placement.occupied_width,
+                'id': placement['id'],
+                'segment_level': segment['level'],
+                'product_name': placement['product']['name'],
+                'product_jan': placement['product']['jan_code'],
+                'manufacturer': placement['product']['manufacturer']['name'],
+                'x_position': placement['x_position'],
+                'face_count': placement['face_count'],
+                'occupied_width': placement['occupied_width'],
             })
-    
+
+    return data
+
+
+def export_shelf_layout_json(shelf):
+    """棚レイアウトのJSONエクスポート"""
+    from apps.shelves.services import ShelfService
+
+    data = _shelf_layout_data(shelf, ShelfService.get_layout_payload(shelf))
     response = HttpResponse(
         json.dumps(data, ensure_ascii=False, indent=2),
         content_type='application/json'
     )
     response['Content-Disposition'] = f'attachment; filename="shelf_{shelf.id}_layout.json"'
-    return response
\ No newline at end of file
+    return response
+
+
+def _shelf_layout_lines(shelves):
+    from apps.shelves.services import ShelfService
+
+    # 棚100件ごとに段・配置をまとめて読み込む（1チャンク3クエリ）
+    shelves = ShelfService.layout_queryset(shelves.order_by('pk'))
+    for shelf in shelves.iterator(chunk_size=100):
+        data = _shelf_layout_data(shelf, ShelfService.get_layout_payload(shelf))
+        yield json.dumps(data, ensure_ascii=False) + '\n'
+
+
+def export_shelf_layouts_ndjson(shelves, compress=False):
+    """複数の棚レイアウトのNDJSONエクスポート（1行1棚、ストリーミング）"""
+    return _streaming_response(
+        _batched(_shelf_layout_lines(shelves), 50), 'application/x-ndjson', 'shelf_layouts.ndjson', compress
+    )
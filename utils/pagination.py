@@ -0,0 +1,284 @@
+# utils/pagination.py
+"""
+キーセット（カーソル）ページネーションと一覧の件数取得
+
+OFFSET を使わず、前のページの最後（最初）の行の並び順の値より後（前）の行を取得するため、
+深いページでも取得時間が変わらない。並び順の最後の項目は一意（pk）である必要がある。
+"""
+import base64
+import binascii
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist, ValidationError
+from django.db import connection
+from django.db.models import Q
+from django.http import Http404
+
+class InvalidCursor(ValueError):
+    """カーソルの形式が正しくない"""
+
+
+def encode_cursor(values):
+    data = json.dumps(values, ensure_ascii=False, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (ValueError, binascii.Error):
+        raise InvalidCursor('カーソルの形式が正しくありません')
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor('カーソルの形式が正しくありません')
+    return values
+
+
+def list_count(queryset, mode=None):
+    """一覧の件数
+
+    mode（省略時は LIST_COUNT_MODE）:
+    - 'exact': COUNT(*)
+    - 'cached': 同じ条件の件数を LIST_COUNT_CACHE_TIMEOUT 秒キャッシュ
+    - 'approximate': PostgreSQL では実行計画の推定行数（APPROXIMATE_COUNT_THRESHOLD 未満なら正確な件数）。
+      その他のDBでは 'cached' と同じ
+    戻り値: (件数, 概数かどうか)
+    """
+    mode = mode or getattr(settings, 'LIST_COUNT_MODE', 'exact')
+    if mode == 'exact':
+        return queryset.count(), False
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0, False
+
+    if mode == 'approximate' and connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate >= getattr(settings, 'APPROXIMATE_COUNT_THRESHOLD', 10000):
+            return estimate, True
+        return queryset.count(), False
+
+    key = 'list-count:' + hashlib.md5(f'{sql}|{params!r}'.encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'LIST_COUNT_CACHE_TIMEOUT', 60))
+    return count, False
+
+
+class KeysetPage:
+    """キーセットページネーションの1ページ"""
+
+    def __init__(self, paginator, object_list, has_next, has_previous):
+        self.paginator = paginator
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[0])
+
+    def build_queries(self, params):
+        """ページ移動用のクエリ文字列（first_query, previous_query, next_query, last_query）を設定"""
+        params = params.copy()
+        for key in ('after', 'before', 'page'):
+            params.pop(key, None)
+
+        def query(**extra):
+            result = params.copy()
+            for key, value in extra.items():
+                result[key] = value
+            return result.urlencode()
+
+        self.first_query = query()
+        self.last_query = query(before='')
+        self.previous_query = query(before=self.previous_cursor) if self.previous_cursor else None
+        self.next_query = query(after=self.next_cursor) if self.next_cursor else None
+
+
+class KeysetPaginator:
+    """キーセットページネーション
+
+    ordering の項目は NULL にならない列（関連先の列は '__' 区切り）とし、最後は一意の 'pk' にする。
+    queryset はモデルのインスタンスでも values() の辞書でもよい（辞書には ordering の項目を含める）。
+    """
+
+    def __init__(self, queryset, per_page, ordering, count_mode=None):
+        ordering = tuple(ordering)
+        if ordering[-1].lstrip('-') not in ('pk', 'id'):
+            ordering += ('pk',)
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.count_mode = count_mode
+        self._count = None
+
+    def _count_value(self):
+        if self._count is None:
+            self._count = list_count(self.queryset, self.count_mode)
+        return self._count
+
+    @property
+    def count(self):
+        return self._count_value()[0]
+
+    @property
+    def count_is_approximate(self):
+        return self._count_value()[1]
+
+    def cursor_for(self, row):
+        values = []
+        for field in self.fields:
+            if isinstance(row, dict):
+                value = row['id'] if field == 'pk' and 'pk' not in row else row[field]
+            else:
+                value = row
+                for name in field.split('__'):
+                    value = getattr(value, name)
+            values.append(value)
+        return encode_cursor(values)
+
+    def _model_field(self, path):
+        """ordering の項目（'__' 区切り）に対応するモデルのフィールド（注釈などで見つからない場合は None）"""
+        model = self.queryset.model
+        field = None
+        for name in path.split('__'):
+            if model is None:
+                return None
+            try:
+                field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            model = field.related_model
+        if field.is_relation:
+            field = field.target_field
+        return field
+
+    def decode(self, cursor):
+        """カーソルを ordering の各フィールドの型の値に変換（改ざんされた値は InvalidCursor）"""
+        values = decode_cursor(cursor, len(self.fields))
+        converted = []
+        for path, value in zip(self.fields, values):
+            if value is None:
+                raise InvalidCursor('カーソルの形式が正しくありません')
+            field = self._model_field(path)
+            if field is not None:
+                try:
+                    value = field.to_python(value)
+                except (ValidationError, ValueError, TypeError):
+                    raise InvalidCursor('カーソルの形式が正しくありません')
+                if value is None:
+                    raise InvalidCursor('カーソルの形式が正しくありません')
+            converted.append(value)
+        return converted
+
+    def _seek(self, values, backward):
+        """カーソルの値より後（backward=True なら前）の行の条件"""
+        condition = Q()
+        for index, (field, order) in enumerate(zip(self.fields, self.ordering)):
+            descending = order.startswith('-')
+            lookup = 'lt' if descending != backward else 'gt'
+            term = Q(**{f'{field}__{lookup}': values[index]})
+            for previous, value in zip(self.fields[:index], values[:index]):
+                term &= Q(**{previous: value})
+            condition |= term
+        return condition
+
+    def page(self, after=None, before=None):
+        """after のカーソルより後のページ（before を指定すると前のページ。before='' は最後のページ）"""
+        queryset = self.queryset
+        if before is not None:
+            reverse = [order[1:] if order.startswith('-') else '-' + order for order in self.ordering]
+            queryset = queryset.order_by(*reverse)
+            if before:
+                queryset = queryset.filter(self._seek(self.decode(before), backward=True))
+            rows = list(queryset[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(self, rows, has_next=bool(before), has_previous=has_previous)
+
+        queryset = queryset.order_by(*self.ordering)
+        if after:
+            queryset = queryset.filter(self._seek(self.decode(after), backward=False))
+        rows = list(queryset[:self.per_page + 1])
+        return KeysetPage(self, rows[:self.per_page], has_next=len(rows) > self.per_page, has_previous=bool(after))
+
+    def page_from_params(self, params):
+        """?after= / ?before= からページを取得"""
+        return self.page(after=params.get('after') or None, before=params.get('before'))
+
+
+class KeysetPaginationMixin:
+    """ListView をキーセットページネーションにする
+
+    ?after=<カーソル> で次、?before=<カーソル> で前、?before= のみで最後のページ。
+    テンプレートでは page_obj.first_query / previous_query / next_query / last_query を使う。
+    """
+
+    keyset_ordering = ('pk',)
+    count_mode = None
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_ordering, count_mode=self.count_mode)
+        try:
+            page = paginator.page_from_params(self.request.GET)
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        page.build_queries(self.request.GET)
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
+def browse_payload(queryset, params, ordering, default_limit=50, max_limit=200):
+    """JSON一覧API用のページ（?after= / ?before= / ?limit= / ?count=1）
+
+    queryset は values() の射影を渡す。件数は ?count=1 の場合のみ取得する。
+    """
+    try:
+        limit = int(params.get('limit') or default_limit)
+    except ValueError:
+        raise InvalidCursor('件数の指定が正しくありません')
+    paginator = KeysetPaginator(queryset, min(max(limit, 1), max_limit), ordering)
+    page = paginator.page_from_params(params)
+    payload = {
+        'success': True,
+        'results': list(page.object_list),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+    if params.get('count') == '1':
+        payload['count'] = paginator.count
+        payload['count_is_approximate'] = paginator.count_is_approximate
+    return payload